@@ -0,0 +1,102 @@
+import inspect
+import typing
+from typing import Any, NamedTuple, Optional, Type, get_args, get_origin, get_type_hints
+
+import betterproto
+
+import ord_betterproto
+
+"""
+field descriptors compiled once per message class, not generated
+
+this module is not touched by the protocol buffer compiler, it only reads the generated classes
+"""
+
+ContainerSingle = "single"
+ContainerList = "list"
+ContainerDict = "dict"
+
+
+class FieldDescriptor(NamedTuple):
+    name: str
+    number: int
+    type_hint: Any
+    container: str  # one of `ContainerSingle`, `ContainerList`, `ContainerDict`
+    child_class: Type  # the element class for lists, the value class for dicts
+    oneof_group: Optional[str]  # synthetic groups like "_reflux" for optional fields
+    optional: bool
+    default: Any  # shared by all callers, do not modify
+
+
+class MessageDescriptor(NamedTuple):
+    message_class: Type
+    fields: tuple[FieldDescriptor, ...]  # in declaration order
+    sorted_fields: tuple[FieldDescriptor, ...]  # in field number order, as `_betterproto.sorted_field_names`
+    by_name: dict[str, FieldDescriptor]
+
+
+def _unpack_type_hint(type_hint) -> tuple[str, Type]:
+    if inspect.isclass(type_hint):
+        return ContainerSingle, type_hint
+    origin = get_origin(type_hint)
+    if origin == list:
+        return ContainerList, get_args(type_hint)[0]
+    elif origin == dict:
+        return ContainerDict, get_args(type_hint)[1]
+    # this can only be Optional[*]
+    assert type_hint.__class__ == typing._UnionGenericAlias and type_hint.__name__ == Optional.__name__
+    return ContainerSingle, get_args(type_hint)[0]
+
+
+def compile_message_descriptor(message_class: Type) -> MessageDescriptor:
+    assert inspect.isclass(message_class) and issubclass(message_class, betterproto.Message)
+    meta = betterproto.ProtoClassMetadata(message_class)
+    fields = []
+    for name, type_hint in get_type_hints(message_class).items():
+        if name.startswith("_"):
+            continue
+        container, child_class = _unpack_type_hint(type_hint)
+        field_meta = meta.meta_by_field_name[name]
+        fields.append(
+            FieldDescriptor(
+                name=name,
+                number=field_meta.number,
+                type_hint=type_hint,
+                container=container,
+                child_class=child_class,
+                oneof_group=meta.oneof_group_by_field.get(name),
+                optional=field_meta.optional,
+                default=meta.default_gen[name](),
+            )
+        )
+    by_name = {f.name: f for f in fields}
+    return MessageDescriptor(
+        message_class=message_class,
+        fields=tuple(fields),
+        sorted_fields=tuple(by_name[name] for name in meta.sorted_field_names),
+        by_name=by_name,
+    )
+
+
+_MessageDescriptors: dict[Type, MessageDescriptor] = dict()
+
+
+def get_message_descriptor(message_class: Type) -> MessageDescriptor:
+    """ get the compiled descriptor of a message class, it is compiled on the first request """
+    try:
+        return _MessageDescriptors[message_class]
+    except KeyError:
+        d = compile_message_descriptor(message_class)
+        _MessageDescriptors[message_class] = d
+        return d
+
+
+def compile_all_descriptors() -> dict[Type, MessageDescriptor]:
+    """ compile descriptors of all message classes in `ord_betterproto` """
+    for _, c in inspect.getmembers(
+            ord_betterproto,
+            lambda member: inspect.isclass(member) and member.__module__ == ord_betterproto.__name__
+    ):
+        if issubclass(c, betterproto.Message):
+            get_message_descriptor(c)
+    return _MessageDescriptors
@@ -2,3 +2,12 @@ from .utils import *
 from .ord_classes import *
 from .mot import *
 from .mtt import *
+from .cmot import *
+from .bulk import *
+from .dataset_io import *
+from .history import *
+from .pt_batch import *
+from .template import *
+from .doe import *
+from .units import *
+from .layout import *
@@ -0,0 +1,140 @@
+import io
+import os
+import pickle
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import Any, Iterable, Iterator, Union
+
+import betterproto
+import networkx as nx
+from loguru import logger
+
+from ord_betterproto import Dataset
+from ord_tree.cmot import get_cmot, CompactMot
+from ord_tree.mot import get_mot
+
+"""
+convert many messages, e.g. the reactions of a dataset, to MOTs in a process pool
+"""
+
+
+class _MessagePickler(pickle.Pickler):
+    """ `betterproto.PLACEHOLDER` marks unset fields by identity, keep it across processes """
+
+    def persistent_id(self, obj):
+        if obj is betterproto.PLACEHOLDER:
+            return "PLACEHOLDER"
+        return None
+
+
+class _MessageUnpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        assert pid == "PLACEHOLDER"
+        return betterproto.PLACEHOLDER
+
+
+def _dump_messages(obj) -> bytes:
+    f = io.BytesIO()
+    _MessagePickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return f.getvalue()
+
+
+def _load_messages(data: bytes):
+    return _MessageUnpickler(io.BytesIO(data)).load()
+
+
+def _convert_chunk(chunk: list[tuple[int, betterproto.Message]], compact: bool) -> list[tuple[int, Any]]:
+    convert = get_cmot if compact else get_mot
+    return [(i, convert(m)) for i, m in chunk]
+
+
+def _convert_dumped_chunk(data: bytes, compact: bool) -> list[tuple[int, Any]]:
+    return _convert_chunk(_load_messages(data), compact)
+
+
+def _iter_chunks(items: Iterable, chunksize: int) -> Iterator[list]:
+    it = iter(items)
+    while chunk := list(islice(it, chunksize)):
+        yield chunk
+
+
+def iter_mots(
+        messages: Union[Dataset, Iterable[betterproto.Message]],
+        processes: int = None,
+        chunksize: int = 16,
+        ordered: bool = True,
+        compact: bool = False,
+        max_pending: int = None,
+) -> Iterator[Union[nx.DiGraph, CompactMot, tuple[int, Union[nx.DiGraph, CompactMot]]]]:
+    """
+    convert messages to MOTs across a process pool, results are streamed back as chunks finish
+
+    :param messages: a `Dataset` (its reactions are converted) or any iterable of messages, consumed lazily
+    :param processes: number of worker processes, defaults to `os.cpu_count()`, 1 converts in this process
+    :param chunksize: number of messages sent to a worker at once
+    :param ordered: if True yield MOTs in input order, otherwise yield (index, MOT) as soon as they are ready
+    :param compact: yield `CompactMot` (see `get_cmot`) instead of `nx.DiGraph`, these are much cheaper to send back
+    :param max_pending: max number of chunks submitted but not yet yielded, defaults to twice `processes`
+    """
+    if isinstance(messages, Dataset):
+        messages = messages.reactions
+    if processes is None:
+        processes = os.cpu_count()
+    assert processes >= 1 and chunksize >= 1
+    if max_pending is None:
+        max_pending = 2 * processes
+    chunks = _iter_chunks(enumerate(messages), chunksize)
+
+    ts = time.perf_counter()
+    n_converted = 0
+    if processes == 1:
+        for chunk in chunks:
+            for i, mot in _convert_chunk(chunk, compact):
+                n_converted += 1
+                yield mot if ordered else (i, mot)
+    else:
+        executor = ProcessPoolExecutor(max_workers=processes)
+        try:
+            if ordered:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(_convert_dumped_chunk, _dump_messages(chunk), compact))
+                    while len(pending) >= max_pending or (pending and pending[0].done()):
+                        for _, mot in pending.popleft().result():
+                            n_converted += 1
+                            yield mot
+                while pending:
+                    for _, mot in pending.popleft().result():
+                        n_converted += 1
+                        yield mot
+            else:
+                pending = set()
+                for chunk in chunks:
+                    pending.add(executor.submit(_convert_dumped_chunk, _dump_messages(chunk), compact))
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            for i, mot in future.result():
+                                n_converted += 1
+                                yield i, mot
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for i, mot in future.result():
+                            n_converted += 1
+                            yield i, mot
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    te = time.perf_counter()
+    logger.info(f"converted {n_converted} messages in {te - ts:.2f} s with {processes} processes")
+
+
+def get_mots(
+        messages: Union[Dataset, Iterable[betterproto.Message]], processes: int = None, chunksize: int = 16,
+        compact: bool = False,
+) -> list[Union[nx.DiGraph, CompactMot]]:
+    """ convert messages to a list of MOTs in input order, see `iter_mots` """
+    return list(iter_mots(messages, processes=processes, chunksize=chunksize, ordered=True, compact=compact))
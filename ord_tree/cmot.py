@@ -0,0 +1,508 @@
+import array
+from typing import Any, Iterator, Type
+
+import betterproto
+import networkx as nx
+
+from ord_betterproto import Reaction
+from ord_tree import ord_classes
+from ord_tree.ord_classes import ClassTable
+from ord_tree.mot import MotEleAttr, PT_PLACEHOLDER, PT_PRESET, MotNextIdKey, _get_object_items
+from ord_tree.mtt import get_registered_mtt
+from ord_tree.utils import NodePathDelimiter, RootNodePath, PrefixDictKey, is_arithmetic
+
+"""
+compact message object tree
+
+nodes are stored column-wise in arrays, class strings and mtt node names are interned as integer ids,
+the edge from a node to its parent is stored with the node as every node has at most one parent
+"""
+
+_FLAG_NODE_PLACEHOLDER = 1
+_FLAG_NODE_CAN_EDIT = 2
+_FLAG_EDGE_PLACEHOLDER = 4
+_FLAG_EDGE_CAN_EDIT = 8
+# edge attributes holding node pairs are tuples when created, lists when loaded from json
+_FLAG_EDGE_PAIR_LIST = 16
+
+
+class StringTable:
+    """ intern strings as integer ids, an id is stable for the lifetime of the process """
+
+    def __init__(self):
+        self._ids: dict[str, int] = dict()
+        self._strings: list[str] = []
+
+    def intern(self, s: str) -> int:
+        try:
+            return self._ids[s]
+        except KeyError:
+            i = len(self._strings)
+            self._ids[s] = i
+            self._strings.append(s)
+            return i
+
+    def __getitem__(self, i: int) -> str:
+        return self._strings[i]
+
+    def __len__(self):
+        return len(self._strings)
+
+
+MttNameTable = StringTable()
+
+
+def _same(a, b) -> bool:
+    return type(a) is type(b) and a == b
+
+
+class CompactMot:
+    """
+    an array-backed MOT, the i-th entry of each column describes the node at index i
+
+    - `node_ids`: `mot_element_id` of the node, this is the node in the equivalent `nx.DiGraph`
+    - `parents`: index of the parent, -1 for the root
+    - `children`: indices of the children, in insertion order
+    - `class_ids`: `mot_class_string` as ids of `ord_classes.ClassTable`
+    - `mtt_ids`: interned `mtt_element_name`
+    - `flags`: state and `mot_can_edit` of the node and of the edge from its parent
+    - `values`: `mot_value` of the node
+    - `relations`: `mot_value` of the edge from its parent
+
+    attributes that cannot be derived from the columns are kept in `node_extra` and `edge_extra`
+    (keyed by node id) so conversions from/to `nx.DiGraph` are lossless
+    """
+
+    __slots__ = (
+        "node_ids", "parents", "children", "class_ids", "mtt_ids", "flags", "values", "relations",
+        "root", "graph", "node_extra", "edge_extra", "_index",
+    )
+
+    def __init__(self):
+        self.node_ids = array.array('q')
+        self.parents = array.array('q')
+        self.children: list[list[int]] = []
+        self.class_ids = array.array('l')
+        self.mtt_ids = array.array('l')
+        self.flags = array.array('B')
+        self.values: list[Any] = []
+        self.relations: list[Any] = []
+        self.root = -1
+        self.graph = dict()
+        self.node_extra: dict[int, dict] = dict()
+        self.edge_extra: dict[int, dict] = dict()
+        self._index: dict[int, int] = dict()
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node_id: int):
+        return node_id in self._index
+
+    def index(self, node_id: int) -> int:
+        return self._index[node_id]
+
+    def add_node(
+            self, node_id: int, parent: int, class_id: int, mtt_id: int, flags: int, value: Any, relation: Any
+    ) -> int:
+        """ add a node with its parent index, return the index of the new node """
+        assert node_id not in self._index
+        i = len(self.node_ids)
+        self.node_ids.append(node_id)
+        self.parents.append(parent)
+        self.children.append([])
+        self.class_ids.append(class_id)
+        self.mtt_ids.append(mtt_id)
+        self.flags.append(flags)
+        self.values.append(value)
+        self.relations.append(relation)
+        self._index[node_id] = i
+        if parent < 0:
+            assert self.root < 0, "a tree can only have one root"
+            self.root = i
+        else:
+            self.children[parent].append(i)
+        return i
+
+    def node_attrs(self, i: int) -> MotEleAttr:
+        f = self.flags[i]
+        d = MotEleAttr(
+            mot_element_id=self.node_ids[i],
+            mot_can_edit=bool(f & _FLAG_NODE_CAN_EDIT),
+            mot_state=PT_PLACEHOLDER if f & _FLAG_NODE_PLACEHOLDER else PT_PRESET,
+            mot_value=self.values[i],
+            mtt_element_name=MttNameTable[self.mtt_ids[i]],
+            mot_class_string=ClassTable[self.class_ids[i]].class_string,
+        )
+        try:
+            d.update(self.node_extra[self.node_ids[i]])
+        except KeyError:
+            pass
+        return d
+
+    def edge_attrs(self, i: int) -> MotEleAttr:
+        """ attributes of the edge from the parent of node `i` to node `i` """
+        p = self.parents[i]
+        assert p >= 0
+        f = self.flags[i]
+        pair_type = list if f & _FLAG_EDGE_PAIR_LIST else tuple
+        d = MotEleAttr(
+            mot_element_id=pair_type((self.node_ids[p], self.node_ids[i])),
+            mot_can_edit=bool(f & _FLAG_EDGE_CAN_EDIT),
+            mot_state=PT_PLACEHOLDER if f & _FLAG_EDGE_PLACEHOLDER else PT_PRESET,
+            mot_value=self.relations[i],
+            mtt_element_name=pair_type((MttNameTable[self.mtt_ids[p]], MttNameTable[self.mtt_ids[i]])),
+            mot_class_string=pair_type(
+                (ClassTable[self.class_ids[p]].class_string, ClassTable[self.class_ids[i]].class_string)),
+        )
+        try:
+            d.update(self.edge_extra[self.node_ids[i]])
+        except KeyError:
+            pass
+        return d
+
+    def iter_preorder(self) -> Iterator[int]:
+        if self.root < 0:
+            return
+        stack = [self.root]
+        while stack:
+            i = stack.pop()
+            yield i
+            stack.extend(reversed(self.children[i]))
+
+    def subtree(self, i: int) -> list[int]:
+        """ indices of node `i` and its descendants """
+        indices = []
+        stack = [i]
+        while stack:
+            j = stack.pop()
+            indices.append(j)
+            stack.extend(self.children[j])
+        return indices
+
+    def select(self, indices: list[int]) -> "CompactMot":
+        """ a new tree of the given nodes, their relative order is kept """
+        new = CompactMot()
+        new.graph = dict(self.graph)
+        old_to_new = {old: new_i for new_i, old in enumerate(indices)}
+        for old in indices:
+            node_id = self.node_ids[old]
+            new.node_ids.append(node_id)
+            new.parents.append(old_to_new.get(self.parents[old], -1))
+            new.children.append([old_to_new[c] for c in self.children[old] if c in old_to_new])
+            new.class_ids.append(self.class_ids[old])
+            new.mtt_ids.append(self.mtt_ids[old])
+            new.flags.append(self.flags[old])
+            new.values.append(self.values[old])
+            new._index[node_id] = old_to_new[old]
+            if new.parents[-1] < 0:
+                assert new.root < 0, "selected nodes do not form a tree"
+                new.root = old_to_new[old]
+                new.relations.append(None)
+                new.flags[-1] &= _FLAG_NODE_PLACEHOLDER | _FLAG_NODE_CAN_EDIT
+            else:
+                new.relations.append(self.relations[old])
+                if node_id in self.edge_extra:
+                    new.edge_extra[node_id] = dict(self.edge_extra[node_id])
+            if node_id in self.node_extra:
+                new.node_extra[node_id] = dict(self.node_extra[node_id])
+        return new
+
+    def copy(self) -> "CompactMot":
+        new = CompactMot()
+        new._assign(self)
+        new.node_ids = array.array('q', self.node_ids)
+        new.parents = array.array('q', self.parents)
+        new.children = [list(c) for c in self.children]
+        new.class_ids = array.array('l', self.class_ids)
+        new.mtt_ids = array.array('l', self.mtt_ids)
+        new.flags = array.array('B', self.flags)
+        new.values = list(self.values)
+        new.relations = list(self.relations)
+        new.graph = dict(self.graph)
+        new.node_extra = {k: dict(v) for k, v in self.node_extra.items()}
+        new.edge_extra = {k: dict(v) for k, v in self.edge_extra.items()}
+        new._index = dict(self._index)
+        return new
+
+    def _assign(self, other: "CompactMot"):
+        for k in self.__slots__:
+            setattr(self, k, getattr(other, k))
+
+    def __getstate__(self):
+        # interned ids are only valid in the current process
+        state = {k: getattr(self, k) for k in self.__slots__ if k not in ("class_ids", "mtt_ids", "_index")}
+        state['class_strings'] = [ClassTable[i].class_string for i in self.class_ids]
+        state['mtt_names'] = [MttNameTable[i] for i in self.mtt_ids]
+        return state
+
+    def __setstate__(self, state):
+        self.class_ids = array.array('l', [ClassTable.intern(s) for s in state.pop('class_strings')])
+        self.mtt_ids = array.array('l', [MttNameTable.intern(s) for s in state.pop('mtt_names')])
+        for k, v in state.items():
+            setattr(self, k, v)
+        self._index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+
+
+def _node_flags(attrs: dict) -> int:
+    f = 0
+    if attrs.get('mot_state') == PT_PLACEHOLDER:
+        f |= _FLAG_NODE_PLACEHOLDER
+    if attrs.get('mot_can_edit'):
+        f |= _FLAG_NODE_CAN_EDIT
+    return f
+
+
+def _edge_flags(attrs: dict) -> int:
+    f = 0
+    if attrs.get('mot_state') == PT_PLACEHOLDER:
+        f |= _FLAG_EDGE_PLACEHOLDER
+    if attrs.get('mot_can_edit'):
+        f |= _FLAG_EDGE_CAN_EDIT
+    if isinstance(attrs.get('mot_element_id'), list):
+        f |= _FLAG_EDGE_PAIR_LIST
+    return f
+
+
+def _get_extra(stored: dict, derived: dict) -> dict:
+    """ stored attributes that differ from the derived ones """
+    extra = dict()
+    for k, v in stored.items():
+        if k not in derived or not _same(v, derived[k]):
+            extra[k] = v
+    return extra
+
+
+def cmot_from_mot(mot: nx.DiGraph) -> CompactMot:
+    assert nx.is_arborescence(mot)
+    cmot = CompactMot()
+    cmot.graph = dict(mot.graph)
+    for n, d in mot.nodes(data=True):
+        i = len(cmot.node_ids)
+        cmot.node_ids.append(n)
+        cmot.parents.append(-1)
+        cmot.children.append([])
+        cmot.class_ids.append(ClassTable.intern(d['mot_class_string']))
+        cmot.mtt_ids.append(MttNameTable.intern(d['mtt_element_name']))
+        cmot.flags.append(_node_flags(d))
+        cmot.values.append(d['mot_value'])
+        cmot.relations.append(None)
+        cmot._index[n] = i
+    for n in mot.nodes:
+        i = cmot._index[n]
+        for child in mot.successors(n):
+            c = cmot._index[child]
+            cmot.parents[c] = i
+            cmot.children[i].append(c)
+            d = mot.edges[(n, child)]
+            cmot.flags[c] |= _edge_flags(d)
+            cmot.relations[c] = d['mot_value']
+    for i, p in enumerate(cmot.parents):
+        if p < 0:
+            cmot.root = i
+    # keep what cannot be derived
+    for n, d in mot.nodes(data=True):
+        extra = _get_extra(d, cmot.node_attrs(cmot._index[n]))
+        if extra:
+            cmot.node_extra[n] = extra
+    for u, v, d in mot.edges(data=True):
+        extra = _get_extra(d, cmot.edge_attrs(cmot._index[v]))
+        if extra:
+            cmot.edge_extra[v] = extra
+    return cmot
+
+
+def cmot_to_mot(cmot: CompactMot) -> nx.DiGraph:
+    mot = nx.DiGraph()
+    mot.graph.update(cmot.graph)
+    for i, n in enumerate(cmot.node_ids):
+        mot.add_node(n, **cmot.node_attrs(i))
+    for i, n in enumerate(cmot.node_ids):
+        for c in cmot.children[i]:
+            mot.add_edge(n, cmot.node_ids[c], **cmot.edge_attrs(c))
+    return mot
+
+
+# class id, mtt id pairs that have been verified against the mtt of a root class id
+_VerifiedMapping: set[tuple[int, int, int]] = set()
+
+
+def _verify_mapping(cmot: CompactMot, root_class: Type):
+    root_class_id = cmot.class_ids[cmot.root]
+    mtt = None
+    for class_id, mtt_id in set(zip(cmot.class_ids, cmot.mtt_ids)):
+        key = (root_class_id, class_id, mtt_id)
+        if key in _VerifiedMapping:
+            continue
+        if mtt is None:
+            mtt = get_registered_mtt(root_class)
+        mtt_name = MttNameTable[mtt_id]
+        assert mtt_name in mtt.nodes
+        mot_entry = ClassTable[class_id]
+        mtt_entry = ClassTable.by_string(mtt.nodes[mtt_name]['mtt_class_string'])
+        if mot_entry is not mtt_entry:
+            assert mtt_entry.kind == ord_classes.ClassKindEnum
+            assert mot_entry.kind == ord_classes.ClassKindLiteral
+        _VerifiedMapping.add(key)
+
+
+def get_cmot(message: betterproto.Message) -> CompactMot:
+    """ the compact equivalent of `get_mot`, nodes are numbered in the same (pre)order """
+    root_entry = ClassTable.by_class(message.__class__)
+    assert root_entry.kind == ord_classes.ClassKindMessage
+    cmot = CompactMot()
+    cmot.add_node(0, -1, root_entry.class_id, MttNameTable.intern(RootNodePath), 0, None, None)
+    # (parent index, relation, child object, child mtt id)
+    stack = []
+
+    def push_children(parent: int, parent_object: Any):
+        edge_prefix, items_used = _get_object_items(parent_object)
+        parent_mtt = MttNameTable[cmot.mtt_ids[parent]]
+        for field_name, child_attr in reversed(items_used):
+            relation = edge_prefix if edge_prefix else field_name
+            child_mtt_id = MttNameTable.intern(f"{parent_mtt}{NodePathDelimiter}{relation}")
+            stack.append((parent, field_name, child_attr, child_mtt_id))
+
+    push_children(0, message)
+    while stack:
+        parent, field_name, child_attr, child_mtt_id = stack.pop()
+        parent_is_dict = ClassTable[cmot.class_ids[parent]].kind == ord_classes.ClassKindDict
+        child_entry = ClassTable.by_class(child_attr.__class__)
+        if child_entry.is_literal:
+            flags = _FLAG_NODE_CAN_EDIT
+            child_value = child_attr
+        else:
+            flags = 0
+            child_value = None
+        if parent_is_dict:
+            flags |= _FLAG_EDGE_CAN_EDIT
+        i = cmot.add_node(len(cmot), parent, child_entry.class_id, child_mtt_id, flags, child_value, field_name)
+        push_children(i, child_attr)
+
+    cmot.graph[MotNextIdKey] = len(cmot)
+    _verify_mapping(cmot, message.__class__)
+    return cmot
+
+
+def message_from_cmot(cmot: CompactMot) -> betterproto.Message:
+    """ the compact equivalent of `message_from_mot` """
+    assert cmot.root >= 0
+    constructed = dict()
+    for parent in reversed(list(cmot.iter_preorder())):
+        children = cmot.children[parent]
+        if len(children) == 0:
+            constructed[parent] = cmot.values[parent]
+            continue
+
+        parent_entry = ClassTable[cmot.class_ids[parent]]
+        parent_class = parent_entry.cls
+        if parent_entry.kind == ord_classes.ClassKindMessage:
+            # this is better for `oneof` see `test/bug/betterproto_data.py`
+            parent_object = parent_class()
+            for child in children:
+                setattr(parent_object, cmot.relations[child], constructed.pop(child))
+        elif parent_entry.kind == ord_classes.ClassKindEnum:
+            raise RuntimeError(f"{parent_class} can only be leafs!")
+        elif parent_entry.kind == ord_classes.ClassKindList:
+            parent_object = []
+            children = sorted(children, key=lambda x: cmot.relations[x])
+            assert is_arithmetic([cmot.relations[c] for c in children], known_delta=1)
+            for child in children:
+                parent_object.append(constructed.pop(child))
+        elif parent_entry.kind == ord_classes.ClassKindDict:
+            parent_object = dict()
+            for child in children:
+                parent_object[cmot.relations[child]] = constructed.pop(child)
+        else:
+            raise TypeError(f"unexpected parent class: {parent_class}")
+        constructed[parent] = parent_object
+    return constructed[cmot.root]
+
+
+def _init_next_id(cmot: CompactMot, from_cmot: CompactMot = None):
+    # see `ord_tree.mot._init_next_id`, ids may come from the tree `cmot` is selected from
+    if from_cmot is None:
+        from_cmot = cmot
+    if MotNextIdKey not in cmot.graph:
+        cmot.graph[MotNextIdKey] = max(from_cmot.node_ids) + 1 if len(from_cmot) > 0 else 0
+
+
+def _new_node_id(cmot: CompactMot) -> int:
+    """ see `mot_new_node_id` """
+    _init_next_id(cmot)
+    node_id = cmot.graph[MotNextIdKey]
+    if node_id in cmot:
+        node_id = max(cmot.node_ids) + 1
+    cmot.graph[MotNextIdKey] = node_id + 1
+    return node_id
+
+
+# prototype operations
+def cmot_remove_node(cmot_original: CompactMot, node_to_remove: int, inplace=False):
+    i = cmot_original.index(node_to_remove)
+    removed = set(cmot_original.subtree(i))
+    cmot = cmot_original.select([j for j in range(len(cmot_original)) if j not in removed])
+    _init_next_id(cmot, cmot_original)
+    # if the node is an element of a list, reassign indices of the edges to its siblings
+    parent = cmot_original.parents[i]
+    if parent >= 0 and ClassTable[cmot_original.class_ids[parent]].kind == ord_classes.ClassKindList:
+        parent = cmot.index(cmot_original.node_ids[parent])
+        for index, child in enumerate(cmot.children[parent]):
+            cmot.relations[child] = index
+    if inplace:
+        cmot_original._assign(cmot)
+    else:
+        return cmot
+
+
+def cmot_detach_node(cmot_original: CompactMot, new_root: int, inplace=False):
+    i = cmot_original.index(new_root)
+    keep = set(cmot_original.subtree(i))
+    cmot = cmot_original.select([j for j in range(len(cmot_original)) if j in keep])
+    _init_next_id(cmot, cmot_original)
+    if inplace:
+        cmot_original._assign(cmot)
+    else:
+        return cmot
+
+
+def cmot_extend_node(cmot_original: CompactMot, from_node: int, inplace=False):
+    if inplace:
+        cmot = cmot_original
+    else:
+        cmot = cmot_original.copy()
+    # see `pt_extend_node`, <ROOT> is Reaction
+    mtt = get_registered_mtt(Reaction)
+    assert len(cmot) > 0
+    i = cmot.index(from_node)
+    from_node_entry = ClassTable[cmot.class_ids[i]]
+    # if the mapped node is a literal, do nothing, note enum is here
+    if not from_node_entry.is_literal:
+        from_node_mtt = MttNameTable[cmot.mtt_ids[i]]
+        children_mtt = list(mtt.successors(from_node_mtt))
+        existing_edge_values = [cmot.relations[c] for c in cmot.children[i]]
+        for child_mtt in children_mtt:
+            child_class_string = mtt.nodes[child_mtt]['mtt_class_string']
+            child_entry = ClassTable.by_string(child_class_string)
+
+            # if child is non-literal, set its state as preset, otherwise placeholder
+            flags = 0
+            if child_entry.is_literal:
+                flags |= _FLAG_NODE_PLACEHOLDER | _FLAG_NODE_CAN_EDIT
+
+            if from_node_entry.kind == ord_classes.ClassKindList:
+                assert len(children_mtt) == 1
+                relation = len(existing_edge_values)
+            elif from_node_entry.kind == ord_classes.ClassKindDict:
+                assert len(children_mtt) == 1
+                flags |= _FLAG_EDGE_CAN_EDIT | _FLAG_EDGE_PLACEHOLDER
+                relation = f"{PrefixDictKey}{len(existing_edge_values)}"
+            else:
+                relation = mtt.nodes[child_mtt]['mtt_relation_to_parent']
+                if relation in existing_edge_values:
+                    continue
+            new_child = _new_node_id(cmot)
+            cmot.add_node(new_child, i, child_entry.class_id, MttNameTable.intern(child_mtt), flags, None, relation)
+            existing_edge_values.append(relation)
+    if not inplace:
+        return cmot
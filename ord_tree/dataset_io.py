@@ -0,0 +1,368 @@
+import gzip
+import io
+import json
+import os
+import time
+from typing import BinaryIO, Iterable, Iterator, TextIO
+
+from loguru import logger
+
+from ord_betterproto import Dataset, Reaction
+from ord_tree.utils import FilePath
+
+"""
+stream reactions out of and into ORD dataset files, one reaction (or one chunk when writing) is held in memory
+
+supported formats
+- "pb": a binary `Dataset`
+- "json": a `Dataset` in json
+- "ndjson": one `Reaction` in json per line
+each of them can be gzip compressed, formats are inferred from file names, e.g. `dataset.pb.gz`
+
+a written "pb" or "ndjson" file is a valid dataset after every chunk, compressed chunks are separate gzip members
+"""
+
+DatasetFormats = ("pb", "json", "ndjson")
+
+# field number of `Dataset.reactions`
+_DATASET_REACTIONS_FIELD = 3
+_WIRE_TYPE_VARINT = 0
+_WIRE_TYPE_64BIT = 1
+_WIRE_TYPE_LENGTH_DELIMITED = 2
+_WIRE_TYPE_32BIT = 5
+
+_JSON_READ_SIZE = 1 << 20
+
+
+def get_dataset_format(fn: FilePath) -> tuple[str, bool]:
+    """ infer (format, is gzip compressed) from a file name """
+    name = str(fn).lower()
+    compressed = name.endswith(".gz")
+    if compressed:
+        name = name[:-len(".gz")]
+    if name.endswith(".pb") or name.endswith(".binpb"):
+        return "pb", compressed
+    elif name.endswith(".ndjson") or name.endswith(".jsonl"):
+        return "ndjson", compressed
+    elif name.endswith(".json"):
+        return "json", compressed
+    raise ValueError(f"cannot infer dataset format from: {fn}")
+
+
+def _read_varint(f: BinaryIO) -> int:
+    """ read a varint, return -1 at the end of the stream """
+    result = 0
+    shift = 0
+    while True:
+        b = f.read(1)
+        if not b:
+            if shift == 0:
+                return -1
+            raise EOFError("truncated varint")
+        b = b[0]
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result
+        shift += 7
+
+
+def _read_exactly(f: BinaryIO, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) != n:
+        raise EOFError(f"expecting {n} bytes, got {len(data)}")
+    return data
+
+
+def iter_pb_reactions(f: BinaryIO) -> Iterator[Reaction]:
+    """ parse `Dataset.reactions` one by one, other fields of the dataset are skipped """
+    while True:
+        tag = _read_varint(f)
+        if tag < 0:
+            return
+        field_number = tag >> 3
+        wire_type = tag & 0x07
+        if wire_type == _WIRE_TYPE_LENGTH_DELIMITED:
+            data = _read_exactly(f, _read_varint(f))
+            if field_number == _DATASET_REACTIONS_FIELD:
+                yield Reaction().parse(data)
+        elif wire_type == _WIRE_TYPE_VARINT:
+            _read_varint(f)
+        elif wire_type == _WIRE_TYPE_64BIT:
+            _read_exactly(f, 8)
+        elif wire_type == _WIRE_TYPE_32BIT:
+            _read_exactly(f, 4)
+        else:
+            raise ValueError(f"unexpected wire type: {wire_type}")
+
+
+def iter_ndjson_reactions(f: TextIO) -> Iterator[Reaction]:
+    for line in f:
+        line = line.strip()
+        if line:
+            yield Reaction().from_dict(json.loads(line))
+
+
+class _JsonStream:
+    """ decode json values one by one from a text stream, the buffer holds at most a few values """
+
+    def __init__(self, f: TextIO):
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size: int = _JSON_READ_SIZE) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """ the next non-whitespace character, "" at the end of the stream """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, c: str):
+        if self.peek() != c:
+            raise ValueError(f"expecting {c!r} at {self.pos}, got {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        size = _JSON_READ_SIZE
+        while True:
+            try:
+                v, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number may continue in the next chunk
+                if end < len(self.buffer) or self.eof or self.buffer[self.pos] in "{[\"":
+                    self.pos = end
+                    return v
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(size)
+            size *= 2
+
+
+def iter_json_reactions(f: TextIO) -> Iterator[Reaction]:
+    """ decode the elements of the "reactions" array of a json `Dataset` one by one """
+    stream = _JsonStream(f)
+    stream.expect("{")
+    while stream.peek() != "}":
+        key = stream.value()
+        stream.expect(":")
+        if key == "reactions":
+            stream.expect("[")
+            while stream.peek() != "]":
+                yield Reaction().from_dict(stream.value())
+                if stream.peek() == ",":
+                    stream.expect(",")
+            stream.expect("]")
+        else:
+            stream.value()
+        if stream.peek() == ",":
+            stream.expect(",")
+    stream.expect("}")
+
+
+def iter_dataset_reactions(fn: FilePath, dataset_format: str = None, compressed: bool = None,
+                           log_every: int = 1000) -> Iterator[Reaction]:
+    """
+    yield the reactions of a dataset file one at a time, e.g. `iter_mots(iter_dataset_reactions(fn))`
+
+    :param fn: the dataset file
+    :param dataset_format: one of `DatasetFormats`, inferred from `fn` if None
+    :param compressed: if the file is gzip compressed, inferred from `fn` if None
+    :param log_every: log the throughput every this many reactions
+    """
+    inferred_format, inferred_compressed = None, None
+    if dataset_format is None or compressed is None:
+        inferred_format, inferred_compressed = get_dataset_format(fn)
+    if dataset_format is None:
+        dataset_format = inferred_format
+    if compressed is None:
+        compressed = inferred_compressed
+    assert dataset_format in DatasetFormats
+
+    f = gzip.open(fn, "rb") if compressed else open(fn, "rb")
+    try:
+        if dataset_format == "pb":
+            reactions = iter_pb_reactions(f)
+        else:
+            text = io.TextIOWrapper(f, encoding="utf-8")
+            if dataset_format == "json":
+                reactions = iter_json_reactions(text)
+            else:
+                reactions = iter_ndjson_reactions(text)
+
+        ts = time.perf_counter()
+        n = 0
+        for reaction in reactions:
+            n += 1
+            yield reaction
+            if n % log_every == 0:
+                dt = time.perf_counter() - ts
+                logger.info(f"read {n} reactions from {fn}, {n / dt:.1f} reactions/s")
+        dt = time.perf_counter() - ts
+        logger.info(f"read {n} reactions from {fn} in {dt:.2f} s, {n / dt if dt > 0 else 0:.1f} reactions/s")
+    finally:
+        f.close()
+
+
+def _encode_varint(value: int) -> bytes:
+    b = bytearray()
+    while value > 0x7F:
+        b.append((value & 0x7F) | 0x80)
+        value >>= 7
+    b.append(value)
+    return bytes(b)
+
+
+_DATASET_REACTIONS_TAG = _encode_varint((_DATASET_REACTIONS_FIELD << 3) | _WIRE_TYPE_LENGTH_DELIMITED)
+
+
+class DatasetWriter:
+    """
+    append reactions to a dataset file in chunks of `chunksize`, each chunk is encoded, written and fsynced at once
+
+    other fields of `dataset` (name, description...) are written before the reactions, they are dropped for "ndjson",
+    a "json" file is only complete once the writer is closed, use it as a context manager
+    """
+
+    def __init__(self, fn: FilePath, dataset_format: str = None, compressed: bool = None, chunksize: int = 1000,
+                 dataset: Dataset = None, append: bool = False, fsync: bool = True):
+        """
+        :param fn: the dataset file
+        :param dataset_format: one of `DatasetFormats`, inferred from `fn` if None
+        :param compressed: if the file is gzip compressed, inferred from `fn` if None
+        :param chunksize: number of reactions held in memory before they are written
+        :param dataset: fields of the dataset other than reactions, written if the file is not appended to
+        :param append: append reactions to an existing "pb" or "ndjson" file
+        :param fsync: fsync the file after every chunk
+        """
+        if dataset_format is None:
+            dataset_format, inferred_compressed = get_dataset_format(fn)
+        else:
+            # any name is fine if the format is given
+            inferred_compressed = str(fn).lower().endswith(".gz")
+        self.dataset_format = dataset_format
+        self.compressed = inferred_compressed if compressed is None else compressed
+        assert self.dataset_format in DatasetFormats
+        assert chunksize >= 1
+        assert not (append and self.dataset_format == "json"), "cannot append to a json dataset"
+        self.fn = fn
+        self.chunksize = chunksize
+        self.fsync = fsync
+        self.n_written = 0
+        self._pending: list[Reaction] = []
+        self._first_reaction = True
+        self._f = open(fn, "ab" if append else "wb")
+
+        header = dict() if dataset is None else dataset.to_dict()
+        header.pop("reactions", None)
+        if dataset is not None and dataset.reactions:
+            logger.warning("reactions of `dataset` are not written, use `write` instead")
+        if append:
+            if header:
+                logger.warning(f"appending to {fn}, fields of `dataset` are not written")
+        elif self.dataset_format == "pb":
+            if header:
+                self._write(bytes(Dataset().from_dict(header)))
+        elif self.dataset_format == "json":
+            head = json.dumps(header)[:-1]
+            self._write(f'{head}{", " if header else ""}"reactions": ['.encode())
+        elif header:
+            logger.warning(f"fields of `dataset` are not written to ndjson: {list(header)}")
+
+    def _write(self, data: bytes):
+        if self.compressed:
+            data = gzip.compress(data)
+        self._f.write(data)
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
+
+    def _encode(self, reactions: list[Reaction]) -> bytes:
+        data = bytearray()
+        if self.dataset_format == "pb":
+            for r in reactions:
+                b = bytes(r)
+                data += _DATASET_REACTIONS_TAG
+                data += _encode_varint(len(b))
+                data += b
+        elif self.dataset_format == "ndjson":
+            for r in reactions:
+                data += r.to_json().encode()
+                data += b"\n"
+        else:
+            for r in reactions:
+                if not self._first_reaction:
+                    data += b", "
+                self._first_reaction = False
+                data += r.to_json().encode()
+        return bytes(data)
+
+    def write(self, reaction: Reaction):
+        assert not self.closed, f"{self.fn} is closed"
+        assert isinstance(reaction, Reaction), f"expecting a Reaction, got {reaction.__class__}"
+        self._pending.append(reaction)
+        if len(self._pending) >= self.chunksize:
+            self.flush()
+
+    def write_many(self, reactions: Iterable[Reaction]) -> int:
+        """ write reactions from an iterable, e.g. `iter_doe_instances`, return the number written """
+        n = self.n_written + len(self._pending)
+        for reaction in reactions:
+            self.write(reaction)
+        return self.n_written + len(self._pending) - n
+
+    def flush(self):
+        """ write the pending chunk """
+        if not self._pending:
+            return
+        ts = time.perf_counter()
+        self._write(self._encode(self._pending))
+        self.n_written += len(self._pending)
+        logger.info(f"wrote {len(self._pending)} reactions to {self.fn} in {time.perf_counter() - ts:.2f} s, "
+                    f"{self.n_written} in total")
+        self._pending = []
+
+    @property
+    def closed(self) -> bool:
+        return self._f.closed
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+            if self.dataset_format == "json":
+                self._write(b"]}")
+        finally:
+            self._f.close()
+
+    def __enter__(self) -> "DatasetWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_dataset_reactions(fn: FilePath, reactions: Iterable[Reaction], dataset_format: str = None,
+                            compressed: bool = None, chunksize: int = 1000, dataset: Dataset = None) -> int:
+    """ stream reactions into a new dataset file, see `DatasetWriter`, return the number written """
+    with DatasetWriter(fn, dataset_format=dataset_format, compressed=compressed, chunksize=chunksize,
+                       dataset=dataset) as writer:
+        return writer.write_many(reactions)
+
@@ -0,0 +1,170 @@
+import itertools
+import math
+import random
+from array import array
+from typing import Any, Iterator, Mapping, NamedTuple, Sequence, Union
+
+import betterproto
+import networkx as nx
+from loguru import logger
+
+from ord_betterproto import Dataset, Reaction
+from ord_tree.bulk import _iter_chunks
+from ord_tree.ord_classes import ClassTable
+from ord_tree.template import PtElement, compile_prototype, get_placeholder_elements, get_placeholder_paths, \
+    resolve_placeholder, coerce_placeholder_value
+from ord_tree.utils import get_root
+
+"""
+design of experiments over the placeholders of a prototype
+
+a factor is either a list of levels or a `DoeRange`, designs are generated lazily, one row of values at a time
+- `DoeFactorial`: all combinations of levels, `DoeRange.levels` evenly spaced values for ranges
+- `DoeLatinHypercube`: `n` rows, each factor has exactly one row in each of its `n` strata
+- `DoeRandom`: `n` rows drawn uniformly
+only the latin hypercube holds per factor permutations of `n` strata, no design holds its rows
+"""
+
+DoeFactorial = "factorial"
+DoeLatinHypercube = "lhs"
+DoeRandom = "random"
+DoeDesigns = (DoeFactorial, DoeLatinHypercube, DoeRandom)
+
+
+class DoeRange(NamedTuple):
+    low: float
+    high: float
+    levels: int = 2  # number of evenly spaced levels in factorial designs
+    integer: bool = False  # round sampled values
+
+
+DoeFactor = Union[Sequence[Any], DoeRange]
+
+
+def _range_value(factor: DoeRange, u: float):
+    v = factor.low + u * (factor.high - factor.low)
+    if factor.integer:
+        return int(round(v))
+    return v
+
+
+def get_factor_levels(factor: DoeFactor) -> list:
+    """ the levels of a factor in factorial designs """
+    if isinstance(factor, DoeRange):
+        assert factor.levels >= 1
+        if factor.levels == 1:
+            return [_range_value(factor, 0.5)]
+        return [_range_value(factor, i / (factor.levels - 1)) for i in range(factor.levels)]
+    assert len(factor) > 0, "a factor needs at least one level"
+    return list(factor)
+
+
+def _sample_factor(factor: DoeFactor, u: float):
+    """ map `u` in [0, 1) to a value of the factor """
+    if isinstance(factor, DoeRange):
+        return _range_value(factor, u)
+    return factor[min(int(u * len(factor)), len(factor) - 1)]
+
+
+def get_design_size(factors: Sequence[DoeFactor], design: str = DoeFactorial, n: int = None) -> int:
+    """ number of rows of a design """
+    if design == DoeFactorial:
+        return math.prod(len(get_factor_levels(f)) for f in factors)
+    assert design in DoeDesigns, f"unknown design: {design}"
+    assert n is not None and n >= 0, f"{design} needs the number of rows"
+    return n
+
+
+def iter_factorial(factors: Sequence[DoeFactor]) -> Iterator[tuple]:
+    return itertools.product(*(get_factor_levels(f) for f in factors))
+
+
+def iter_latin_hypercube(factors: Sequence[DoeFactor], n: int, seed: int = None) -> Iterator[tuple]:
+    rng = random.Random(seed)
+    strata = []
+    for _ in factors:
+        # a permutation of strata per factor, `n` integers instead of `n` rows of values
+        p = array("q", range(n))
+        rng.shuffle(p)
+        strata.append(p)
+    for i in range(n):
+        yield tuple(_sample_factor(f, (p[i] + rng.random()) / n) for f, p in zip(factors, strata))
+
+
+def iter_random(factors: Sequence[DoeFactor], n: int, seed: int = None) -> Iterator[tuple]:
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield tuple(_sample_factor(f, rng.random()) for f in factors)
+
+
+def iter_design(factors: Sequence[DoeFactor], design: str = DoeFactorial, n: int = None,
+                seed: int = None) -> Iterator[tuple]:
+    """ rows of factor values, see the module docstring for designs """
+    factors = list(factors)
+    if design == DoeFactorial:
+        return iter_factorial(factors)
+    elif design == DoeLatinHypercube:
+        return iter_latin_hypercube(factors, get_design_size(factors, design, n), seed)
+    elif design == DoeRandom:
+        return iter_random(factors, get_design_size(factors, design, n), seed)
+    raise ValueError(f"unknown design: {design}")
+
+
+def _coerce_factor(pt: nx.DiGraph, element: PtElement, factor: DoeFactor) -> DoeFactor:
+    """ levels are converted once to the classes of their placeholders """
+    if isinstance(element, tuple):
+        assert not isinstance(factor, DoeRange), f"dict key {element} needs a list of levels"
+        return [str(v) for v in factor]
+    class_string = pt.nodes[element]['mot_class_string']
+    if isinstance(factor, DoeRange):
+        cls = ClassTable.by_string(class_string).cls
+        assert cls in (int, float), f"node {element} of {cls} can not take a range"
+        if cls == int and not factor.integer:
+            factor = factor._replace(integer=True)
+        return factor
+    return [coerce_placeholder_value(v, class_string) for v in factor]
+
+
+def iter_doe_instances(
+        pt: nx.DiGraph,
+        factors: Mapping[Union[str, PtElement], DoeFactor],
+        design: str = DoeFactorial,
+        n: int = None,
+        seed: int = None,
+) -> Iterator[betterproto.Message]:
+    """
+    yield one message per row of a design, memory use does not grow with the number of rows
+
+    :param pt: the prototype
+    :param factors: placeholder -> factor, placeholders are keyed as in `resolve_placeholder`
+    :param design: one of `DoeDesigns`
+    :param n: number of rows of latin hypercube and random designs
+    :param seed: seed of latin hypercube and random designs
+    """
+    paths = get_placeholder_paths(pt)
+    elements = [resolve_placeholder(pt, k, paths=paths) for k in factors]
+    assert len(set(elements)) == len(elements), "a placeholder has more than one factor"
+    coerced = [_coerce_factor(pt, e, f) for e, f in zip(elements, factors.values())]
+    unbound = [e for e in get_placeholder_elements(pt) if e not in elements]
+    if unbound:
+        logger.warning(f"placeholders without factors keep their prototype values: {unbound}")
+    logger.info(f"{design} design of {get_design_size(coerced, design, n)} rows over {len(elements)} factors")
+    template = compile_prototype(pt, elements)
+    for values in iter_design(coerced, design, n=n, seed=seed):
+        yield template.instantiate(values)
+
+
+def iter_doe_datasets(
+        pt: nx.DiGraph,
+        factors: Mapping[Union[str, PtElement], DoeFactor],
+        design: str = DoeFactorial,
+        n: int = None,
+        seed: int = None,
+        chunksize: int = 96,
+        **dataset_kwargs,
+) -> Iterator[Dataset]:
+    """ `iter_doe_instances` of a `Reaction` prototype in datasets of `chunksize` reactions, e.g. one per plate """
+    root_class = ClassTable.by_string(pt.nodes[get_root(pt)]['mot_class_string']).cls
+    assert root_class == Reaction, "only reaction prototypes give datasets"
+    for chunk in _iter_chunks(iter_doe_instances(pt, factors, design, n=n, seed=seed), chunksize):
+        yield Dataset(reactions=chunk, **dataset_kwargs)
@@ -0,0 +1,250 @@
+import sys
+from collections import deque
+from typing import Any, Iterable, Optional
+
+import networkx as nx
+
+from ord_tree.mot import _touch_succ, _touch_pred
+
+"""
+invertible changes of a MOT and a bounded undo/redo history of them
+"""
+
+
+def _attrs_nbytes(attrs: dict) -> int:
+    return sys.getsizeof(attrs) + sum(sys.getsizeof(v) for v in attrs.values())
+
+
+class MotDelta:
+    """
+    nodes and edges added to, removed from or changed in a MOT, with their attributes
+
+    applying a delta costs O(size of the delta), `inverted` gives the delta that reverts it,
+    pass one to `pt_*` operations to record what they do
+    """
+
+    __slots__ = ("nodes_added", "nodes_removed", "nodes_changed", "edges_added", "edges_removed", "edges_changed",
+                 "label")
+
+    def __init__(self, label: str = None):
+        self.nodes_added: dict[Any, dict] = dict()
+        self.nodes_removed: dict[Any, dict] = dict()
+        self.nodes_changed: dict[Any, tuple[dict, dict]] = dict()  # node -> (old attrs, new attrs)
+        self.edges_added: dict[tuple, dict] = dict()
+        self.edges_removed: dict[tuple, dict] = dict()
+        self.edges_changed: dict[tuple, tuple[dict, dict]] = dict()
+        self.label = label
+
+    def __len__(self):
+        return len(self.nodes_added) + len(self.nodes_removed) + len(self.nodes_changed) + \
+            len(self.edges_added) + len(self.edges_removed) + len(self.edges_changed)
+
+    def add_node(self, node, attrs: dict):
+        if node in self.nodes_removed:
+            old = self.nodes_removed.pop(node)
+            if old != attrs:
+                self.nodes_changed[node] = (old, dict(attrs))
+        else:
+            self.nodes_added[node] = dict(attrs)
+
+    def remove_node(self, node, attrs: dict):
+        if node in self.nodes_added:
+            del self.nodes_added[node]
+            return
+        if node in self.nodes_changed:
+            attrs = self.nodes_changed.pop(node)[0]
+        self.nodes_removed[node] = dict(attrs)
+
+    def change_node(self, node, old: dict, new: dict):
+        if node in self.nodes_added:
+            self.nodes_added[node] = dict(new)
+        elif node in self.nodes_changed:
+            self.nodes_changed[node] = (self.nodes_changed[node][0], dict(new))
+        else:
+            self.nodes_changed[node] = (dict(old), dict(new))
+
+    def add_edge(self, u, v, attrs: dict):
+        if (u, v) in self.edges_removed:
+            old = self.edges_removed.pop((u, v))
+            if old != attrs:
+                self.edges_changed[(u, v)] = (old, dict(attrs))
+        else:
+            self.edges_added[(u, v)] = dict(attrs)
+
+    def remove_edge(self, u, v, attrs: dict):
+        if (u, v) in self.edges_added:
+            del self.edges_added[(u, v)]
+            return
+        if (u, v) in self.edges_changed:
+            attrs = self.edges_changed.pop((u, v))[0]
+        self.edges_removed[(u, v)] = dict(attrs)
+
+    def change_edge(self, u, v, old: dict, new: dict):
+        if (u, v) in self.edges_added:
+            self.edges_added[(u, v)] = dict(new)
+        elif (u, v) in self.edges_changed:
+            self.edges_changed[(u, v)] = (self.edges_changed[(u, v)][0], dict(new))
+        else:
+            self.edges_changed[(u, v)] = (dict(old), dict(new))
+
+    def merge(self, later: "MotDelta"):
+        """ fold a delta applied after this one into this one, inplace """
+        for (u, v), attrs in later.edges_removed.items():
+            self.remove_edge(u, v, attrs)
+        for n, attrs in later.nodes_removed.items():
+            self.remove_node(n, attrs)
+        for n, attrs in later.nodes_added.items():
+            self.add_node(n, attrs)
+        for n, (old, new) in later.nodes_changed.items():
+            self.change_node(n, old, new)
+        for (u, v), attrs in later.edges_added.items():
+            self.add_edge(u, v, attrs)
+        for (u, v), (old, new) in later.edges_changed.items():
+            self.change_edge(u, v, old, new)
+
+    def inverted(self) -> "MotDelta":
+        d = MotDelta(label=self.label)
+        d.nodes_added = self.nodes_removed
+        d.nodes_removed = self.nodes_added
+        d.nodes_changed = {n: (new, old) for n, (old, new) in self.nodes_changed.items()}
+        d.edges_added = self.edges_removed
+        d.edges_removed = self.edges_added
+        d.edges_changed = {e: (new, old) for e, (old, new) in self.edges_changed.items()}
+        return d
+
+    def apply(self, mot: nx.DiGraph):
+        """ apply the delta to `mot` inplace, shared dicts of snapshots are not modified """
+        for u, v in self.edges_removed:
+            del _touch_succ(mot, u)[v]
+            del _touch_pred(mot, v)[u]
+        for n in self.nodes_removed:
+            assert len(mot._succ[n]) == 0 and len(mot._pred[n]) == 0, f"edges of {n} are not removed"
+            del mot._node[n], mot._succ[n], mot._pred[n]
+        for n, attrs in self.nodes_added.items():
+            assert n not in mot._node
+            mot._node[n] = dict(attrs)
+            mot._succ[n] = dict()
+            mot._pred[n] = dict()
+        for n, (_, new) in self.nodes_changed.items():
+            mot._node[n] = dict(new)
+        for (u, v), attrs in self.edges_added.items():
+            attrs = dict(attrs)
+            _touch_succ(mot, u)[v] = attrs
+            _touch_pred(mot, v)[u] = attrs
+        for (u, v), (_, new) in self.edges_changed.items():
+            attrs = dict(new)
+            _touch_succ(mot, u)[v] = attrs
+            _touch_pred(mot, v)[u] = attrs
+
+    def revert(self, mot: nx.DiGraph):
+        self.inverted().apply(mot)
+
+    def nbytes(self) -> int:
+        """ a rough estimate of the memory held by the delta """
+        n = sys.getsizeof(self)
+        for d in (self.nodes_added, self.nodes_removed, self.edges_added, self.edges_removed):
+            n += sum(_attrs_nbytes(attrs) for attrs in d.values())
+        for d in (self.nodes_changed, self.edges_changed):
+            n += sum(_attrs_nbytes(old) + _attrs_nbytes(new) for old, new in d.values())
+        return n
+
+
+def get_mot_delta(before: nx.DiGraph, after: nx.DiGraph, nodes: Iterable = None, label: str = None) -> MotDelta:
+    """
+    the delta from `before` to `after`, restricted to `nodes` and the edges incident to them if given
+
+    dicts shared by snapshots are compared by identity first, so diffing two snapshots is cheap
+    """
+    if nodes is None:
+        nodes = set(before.nodes) | set(after.nodes)
+    delta = MotDelta(label=label)
+    edges_seen = set()
+    for n in nodes:
+        in_before = n in before._node
+        in_after = n in after._node
+        if in_before and not in_after:
+            delta.remove_node(n, before._node[n])
+        elif in_after and not in_before:
+            delta.add_node(n, after._node[n])
+        elif in_before and in_after:
+            old, new = before._node[n], after._node[n]
+            if old is not new and old != new:
+                delta.change_node(n, old, new)
+        for g in (before, after):
+            if n in g._node:
+                edges_seen.update((n, v) for v in g._succ[n])
+                edges_seen.update((u, n) for u in g._pred[n])
+    for u, v in edges_seen:
+        old = before._succ[u].get(v) if u in before._succ else None
+        new = after._succ[u].get(v) if u in after._succ else None
+        if old is not None and new is None:
+            delta.remove_edge(u, v, old)
+        elif new is not None and old is None:
+            delta.add_edge(u, v, new)
+        elif old is not new and old != new:
+            delta.change_edge(u, v, old, new)
+    return delta
+
+
+class MotHistory:
+    """
+    undo/redo stacks of `MotDelta`, the oldest deltas are dropped beyond `max_depth` or `max_bytes`
+
+    a delta is pushed after it is applied to the MOT, `undo` and `redo` modify the MOT inplace
+    """
+
+    def __init__(self, max_depth: int = 100, max_bytes: int = 16 * 1024 * 1024):
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.undo_stack: deque[MotDelta] = deque()
+        self.redo_stack: list[MotDelta] = []
+        self._nbytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def can_undo(self) -> bool:
+        return len(self.undo_stack) > 0
+
+    def can_redo(self) -> bool:
+        return len(self.redo_stack) > 0
+
+    def _enforce_limits(self):
+        while self.undo_stack and (len(self.undo_stack) > self.max_depth or self._nbytes > self.max_bytes):
+            self._nbytes -= self.undo_stack.popleft().nbytes()
+
+    def push(self, delta: MotDelta):
+        """ record a delta that has been applied, the redo stack is cleared """
+        if len(delta) == 0:
+            return
+        for d in self.redo_stack:
+            self._nbytes -= d.nbytes()
+        self.redo_stack.clear()
+        self.undo_stack.append(delta)
+        self._nbytes += delta.nbytes()
+        self._enforce_limits()
+
+    def undo(self, mot: nx.DiGraph) -> Optional[MotDelta]:
+        """ revert the last delta on `mot`, return the delta applied to `mot` or None if there is nothing to undo """
+        if not self.undo_stack:
+            return None
+        delta = self.undo_stack.pop()
+        inverted = delta.inverted()
+        inverted.apply(mot)
+        self.redo_stack.append(delta)
+        return inverted
+
+    def redo(self, mot: nx.DiGraph) -> Optional[MotDelta]:
+        """ apply the last undone delta to `mot`, return it or None if there is nothing to redo """
+        if not self.redo_stack:
+            return None
+        delta = self.redo_stack.pop()
+        delta.apply(mot)
+        self.undo_stack.append(delta)
+        return delta
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._nbytes = 0
@@ -0,0 +1,182 @@
+import argparse
+import csv
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator, Mapping, Sequence, Union
+
+import betterproto
+import networkx as nx
+from loguru import logger
+
+from ord_tree.bulk import _dump_messages, _load_messages, _iter_chunks
+from ord_tree.dataset_io import DatasetFormats, write_dataset_reactions
+from ord_tree.template import compile_prototype, get_placeholder_elements, get_placeholder_paths, \
+    resolve_placeholder, coerce_placeholder_value
+from ord_tree.utils import FilePath, read_file
+
+"""
+instantiate a prototype into many messages from a table of placeholder values, one message per row
+
+columns are keyed by
+- a node id, e.g. "12"
+- an edge, e.g. "3 12", for dict keys
+- a node path in any style of `mot_get_path`, e.g. "inputs|<DictKey>m1|components|<ListIndex>0|amount"
+rows are streamed, a table can be a csv file or a dict of columns
+
+    python -m ord_tree.instantiate prototype.json table.csv -o reactions.pb.gz --processes 4
+"""
+
+TableColumns = Mapping[str, Sequence[Any]]
+
+
+class PrototypeInstantiator:
+    """
+    bind rows of placeholder values to a prototype, each call gives a new message
+
+    the prototype is compiled once into a template with the columns as its slots,
+    empty cells (None or "") keep the values of the prototype
+    """
+
+    def __init__(self, pt: nx.DiGraph, columns: Sequence[str]):
+        self.pt = pt
+        paths = get_placeholder_paths(pt)
+        self.columns = list(columns)
+        self.elements = [resolve_placeholder(pt, c, paths=paths) for c in self.columns]
+        self.template = compile_prototype(pt, self.elements)
+        # class strings, None for dict keys
+        self._class_strings = [None if isinstance(e, tuple) else pt.nodes[e]['mot_class_string'] for e in self.elements]
+        unbound = [n for n in get_placeholder_elements(pt) if n not in self.elements]
+        if unbound:
+            logger.warning(f"placeholders not in the table keep their prototype values: {unbound}")
+
+    def __call__(self, row: Union[Mapping[str, Any], Sequence[Any]]) -> betterproto.Message:
+        if isinstance(row, Mapping):
+            row = [row.get(c) for c in self.columns]
+        values = []
+        for class_string, value in zip(self._class_strings, row):
+            if value is None or value == "":
+                values.append(None)
+            elif class_string is None:
+                values.append(str(value))
+            else:
+                values.append(coerce_placeholder_value(value, class_string))
+        return self.template.instantiate(values)
+
+
+def iter_table_rows(table: Union[FilePath, TableColumns]) -> Iterator[dict[str, Any]]:
+    """ rows of a csv file (read lazily) or of a dict of columns """
+    if isinstance(table, Mapping):
+        columns = list(table)
+        for values in zip(*(table[c] for c in columns)):
+            yield dict(zip(columns, values))
+        return
+    with open(table, "r", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def get_table_columns(table: Union[FilePath, TableColumns]) -> list[str]:
+    if isinstance(table, Mapping):
+        return list(table)
+    with open(table, "r", newline="") as f:
+        return next(csv.reader(f))
+
+
+_WorkerInstantiator: PrototypeInstantiator = None
+
+
+def _init_worker(pt_data: dict, columns: list[str]):
+    global _WorkerInstantiator
+    _WorkerInstantiator = PrototypeInstantiator(nx.node_link_graph(pt_data), columns)
+
+
+def _instantiate_chunk(rows: list[dict]) -> bytes:
+    # messages hold `betterproto.PLACEHOLDER`, see `ord_tree.bulk`
+    return _dump_messages([_WorkerInstantiator(row) for row in rows])
+
+
+def iter_instances(
+        pt: nx.DiGraph,
+        table: Union[FilePath, TableColumns],
+        processes: int = 1,
+        chunksize: int = 64,
+        max_pending: int = None,
+) -> Iterator[betterproto.Message]:
+    """
+    yield one message per row of `table` in row order, memory use does not grow with the number of rows
+
+    :param pt: the prototype
+    :param table: a csv file or a dict of columns, see the module docstring for column names
+    :param processes: number of worker processes, 1 instantiates in this process
+    :param chunksize: number of rows sent to a worker at once
+    :param max_pending: max number of chunks submitted but not yet yielded, defaults to twice `processes`
+    """
+    assert processes >= 1 and chunksize >= 1
+    columns = get_table_columns(table)
+    rows = iter_table_rows(table)
+    ts = time.perf_counter()
+    n = 0
+    if processes == 1:
+        instantiator = PrototypeInstantiator(pt, columns)
+        for row in rows:
+            n += 1
+            yield instantiator(row)
+    else:
+        if max_pending is None:
+            max_pending = 2 * processes
+        executor = ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker, initargs=(nx.node_link_data(pt), columns)
+        )
+        try:
+            pending = deque()
+            for chunk in _iter_chunks(rows, chunksize):
+                pending.append(executor.submit(_instantiate_chunk, chunk))
+                while len(pending) >= max_pending or (pending and pending[0].done()):
+                    for m in _load_messages(pending.popleft().result()):
+                        n += 1
+                        yield m
+            while pending:
+                for m in _load_messages(pending.popleft().result()):
+                    n += 1
+                    yield m
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    te = time.perf_counter()
+    logger.info(f"instantiated {n} messages in {te - ts:.2f} s with {processes} processes")
+
+
+def read_prototype(fn: FilePath) -> nx.DiGraph:
+    """ a prototype saved by the editor, either a prototype document or bare `node_link_data` """
+    d = json.loads(read_file(fn))
+    if "node_link_data" in d:
+        d = d["node_link_data"]
+    return nx.node_link_graph(d, directed=True)
+
+
+def main(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m ord_tree.instantiate",
+        description="instantiate a prototype into one message per row of a csv table",
+    )
+    parser.add_argument("prototype", help="prototype json, a prototype document or node_link_data")
+    parser.add_argument("table", help="csv file, columns are node ids, edges as \"u v\" or node paths")
+    parser.add_argument("-o", "--output", required=True,
+                        help="output dataset, the format is inferred from the name, e.g. reactions.pb.gz")
+    parser.add_argument("--format", choices=DatasetFormats, default=None, help="output format")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--chunksize", type=int, default=64)
+    parser.add_argument("--write-chunksize", type=int, default=1000, help="reactions written to disk at once")
+    args = parser.parse_args(argv)
+
+    pt = read_prototype(args.prototype)
+    write_dataset_reactions(
+        args.output,
+        iter_instances(pt, args.table, processes=args.processes, chunksize=args.chunksize),
+        dataset_format=args.format,
+        chunksize=args.write_chunksize,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import Iterable
+
+import networkx as nx
+import pygraphviz
+
+"""
+layout of MOTs with graphviz, for editors that place nodes with the positions computed here
+
+positions only depend on the structure of a tree and the class names of its nodes (the labels in the editor),
+`MotLayoutCache` keeps them by `get_structure_hash`, so undo, redo and reloading a prototype do not rerun graphviz
+
+positions are in points, which are pixels of cytoscape, y grows downwards as in cytoscape
+
+`place_new_nodes` places nodes added to a laid out tree without moving the others,
+editors should run a full layout once the placed and removed nodes exceed `LayoutDriftThreshold` of the tree
+"""
+
+LayoutProg = "dot"
+# cytoscape nodes of the editor are 30px with a 30px label below, dot sizes are in inches
+LayoutNodeHeight = 70
+LayoutNodeMinWidth = 30
+LayoutCharWidth = 17
+LayoutNodeSep = 14.4
+LayoutRankSep = 36
+LayoutPointsPerInch = 72
+LayoutCacheSize = 128
+LayoutDriftThreshold = 0.2
+
+MotPositions = dict[int, tuple[float, float]]
+
+
+def _get_node_label(mot: nx.DiGraph, node: int) -> str:
+    return mot.nodes[node]['mot_class_string'].split(".")[-1]
+
+
+def _get_node_width(mot: nx.DiGraph, node: int) -> float:
+    return max(LayoutNodeMinWidth, LayoutCharWidth * len(_get_node_label(mot, node)))
+
+
+def get_structure_hash(mot: nx.DiGraph) -> str:
+    """ a hash of the nodes, their class names and the edges of a MOT, values and states are not included """
+    h = hashlib.blake2b(digest_size=16)
+    for n in sorted(mot.nodes):
+        h.update(f"{n}:{_get_node_label(mot, n)};".encode())
+    for u, v in sorted(mot.edges):
+        h.update(f"{u}>{v};".encode())
+    return h.hexdigest()
+
+
+def get_mot_positions(mot: nx.DiGraph, prog: str = LayoutProg) -> MotPositions:
+    """ node -> (x, y) of the top-down layout by a graphviz program, children are ordered by node id """
+    ag = pygraphviz.AGraph(directed=True, strict=True)
+    ag.graph_attr.update(rankdir="TB", nodesep=str(LayoutNodeSep / LayoutPointsPerInch),
+                         ranksep=str(LayoutRankSep / LayoutPointsPerInch))
+    ag.node_attr.update(shape="box", fixedsize="true", label="", height=str(LayoutNodeHeight / LayoutPointsPerInch))
+    for n in sorted(mot.nodes):
+        ag.add_node(n, width=str(_get_node_width(mot, n) / LayoutPointsPerInch))
+    for u, v in sorted(mot.edges):
+        ag.add_edge(u, v)
+    ag.layout(prog=prog)
+    positions = dict()
+    for node in ag.nodes_iter():
+        x, y = node.attr['pos'].split(",")
+        positions[int(node)] = (float(x), -float(y))
+    return positions
+
+
+def place_new_nodes(mot: nx.DiGraph, positions: MotPositions, nodes: Iterable[int]) -> MotPositions:
+    """
+    positions with `nodes` placed one rank below their parents, other nodes keep their positions
+
+    new children are placed right of the placed children of their parent, or centered below a parent without them,
+    they can overlap other subtrees, which is what a full layout after `LayoutDriftThreshold` is for
+    """
+    positions = dict(positions)
+    pending = set(nodes)
+    queue = deque(sorted({p for n in pending for p in mot.pred[n] if p not in pending}))
+    for n in sorted(pending):
+        if len(mot.pred[n]) == 0:
+            # a new root
+            positions[n] = (0.0, 0.0)
+            pending.discard(n)
+            queue.append(n)
+    while queue:
+        parent = queue.popleft()
+        new = [c for c in sorted(mot.succ[parent]) if c in pending]
+        if len(new) == 0:
+            continue
+        placed = [c for c in mot.succ[parent] if c not in pending and c in positions]
+        widths = [_get_node_width(mot, c) for c in new]
+        parent_x, parent_y = positions[parent]
+        if placed:
+            x = max(positions[c][0] + _get_node_width(mot, c) / 2 for c in placed) + LayoutNodeSep
+        else:
+            x = parent_x - (sum(widths) + LayoutNodeSep * (len(new) - 1)) / 2
+        y = parent_y + LayoutNodeHeight + LayoutRankSep
+        for c, w in zip(new, widths):
+            positions[c] = (x + w / 2, y)
+            x += w + LayoutNodeSep
+            pending.discard(c)
+            queue.append(c)
+    assert len(pending) == 0, f"nodes not below a placed node: {sorted(pending)}"
+    return positions
+
+
+def dump_positions(positions: MotPositions) -> dict[str, list[float]]:
+    """ jsonable positions, e.g. to be stored with a prototype """
+    return {str(n): [x, y] for n, (x, y) in positions.items()}
+
+
+def load_positions(d: dict[str, list[float]]) -> MotPositions:
+    return {int(n): (x, y) for n, (x, y) in d.items()}
+
+
+class MotLayoutCache:
+    """
+    positions of MOTs by structure hash, the least recently used are dropped beyond `max_size`
+
+    the positions returned are shared, do not modify them
+    """
+
+    def __init__(self, max_size: int = LayoutCacheSize, prog: str = LayoutProg):
+        assert max_size >= 1
+        self.max_size = max_size
+        self.prog = prog
+        self._positions: OrderedDict[str, MotPositions] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, structure_hash: str):
+        return structure_hash in self._positions
+
+    def put(self, structure_hash: str, positions: MotPositions):
+        with self._lock:
+            self._positions[structure_hash] = positions
+            self._positions.move_to_end(structure_hash)
+            while len(self._positions) > self.max_size:
+                self._positions.popitem(last=False)
+
+    def get(self, mot: nx.DiGraph) -> tuple[str, MotPositions]:
+        """ the structure hash and the positions of a MOT, graphviz only runs on a miss """
+        structure_hash = get_structure_hash(mot)
+        with self._lock:
+            positions = self._positions.get(structure_hash)
+            if positions is not None:
+                self._positions.move_to_end(structure_hash)
+                return structure_hash, positions
+        positions = get_mot_positions(mot, self.prog)
+        self.put(structure_hash, positions)
+        return structure_hash, positions
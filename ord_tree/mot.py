@@ -1,16 +1,19 @@
-import inspect
-from copy import deepcopy
-from typing import Any, Union, TypedDict, Tuple
+from typing import TYPE_CHECKING, Any, Iterator, Union, TypedDict, Tuple
 
 import betterproto
 import networkx as nx
 from loguru import logger
 
 from ord_betterproto import Reaction
+from ord_betterproto.descriptors import get_message_descriptor, ContainerSingle
 from ord_tree import ord_classes
-from ord_tree.mtt import get_mtt
+from ord_tree.ord_classes import ClassTable
+from ord_tree.mtt import get_registered_mtt
 from ord_tree.utils import NodePathDelimiter, RootNodePath, PrefixListIndex, PrefixDictKey, get_root, \
-    get_leafs, is_arithmetic, import_string, get_class_string
+    is_arithmetic, TreePathIndex
+
+if TYPE_CHECKING:
+    from ord_tree.history import MotDelta
 
 """
 convert a betterproto.message instance to an arborescence
@@ -20,6 +23,9 @@ PT_PLACEHOLDER = "PT_PLACEHOLDER"
 PT_PRESET = "PT_PRESET"
 PT_STATES = (PT_PLACEHOLDER, PT_PRESET)
 
+# graph attribute holding the next node id, kept in `nx.node_link_data`
+MotNextIdKey = "mot_next_id"
+
 
 def _node_path_mot_to_mtt(mot_node_path: str):
     relations = mot_node_path.split(NodePathDelimiter)
@@ -40,65 +46,99 @@ class MotEleAttr(TypedDict):
     mot_class_string: Union[str, Tuple[str, str]]
 
 
-def _extend_object(
-        node_id: int, tree: nx.DiGraph, node_object: Any, node_path: str
-):
-    assert node_id in tree.nodes
-
-    mtt_node = _node_path_mot_to_mtt(node_path)
-
+def is_default_message(message: betterproto.Message) -> bool:
+    """
+    if every field of a message has its default value, same as comparing every field with its default
+    but decided by presence, nothing is compared deeply and no default is materialized
+    """
+    for field in get_message_descriptor(message.__class__).sorted_fields:
+        v = message._Message__raw_get(field.name)
+        if v is betterproto.PLACEHOLDER:
+            continue
+        if field.container != ContainerSingle:
+            if len(v) > 0:
+                return False
+        elif field.optional:
+            if v is not None:
+                return False
+        elif isinstance(v, betterproto.Message):
+            if v.__class__ is not field.child_class or not is_default_message(v):
+                return False
+        elif v != field.default:
+            return False
+    return True
+
+
+def _get_object_items(node_object: Any) -> Tuple[str, list[Tuple[Any, Any]]]:
+    """
+    get the edge prefix and the (relation, child object) pairs used to extend an object,
+    literals have no children and children of default values are skipped
+    """
     edge_prefix = ""
     # stop if reached literal leafs
-    if node_object.__class__ in ord_classes.BuiltinLiteralClasses or node_object is None:
-        return
+    if node_object is None:
+        return edge_prefix, []
+    kind = ClassTable.by_class(node_object.__class__).kind
+    if kind == ord_classes.ClassKindLiteral:
+        return edge_prefix, []
 
-    elif node_object.__class__ in ord_classes.OrdEnumClasses:
+    elif kind == ord_classes.ClassKindEnum:
         # two ways to handle OrdEnum
         # 1. treat them as leafs
-        return
+        return edge_prefix, []
         # 2. treat them as one level above leafs, initialized as Enum[name] when backward converting
         # see https://docs.python.org/3/library/enum.html#:~:text=Color.GREEN%3A%202%3E-,__getitem__,-(cls%2C
         # items = dict(name=obj.name).items()
 
-    elif node_object.__class__ in ord_classes.OrdMessageClasses:
+    elif kind == ord_classes.ClassKindMessage:
         items = dict()
-        for field_name in node_object._betterproto.sorted_field_names:
-            v = node_object._Message__raw_get(field_name)
+        for field in get_message_descriptor(node_object.__class__).sorted_fields:
+            v = node_object._Message__raw_get(field.name)
             if v is not betterproto.PLACEHOLDER:
-                items[field_name] = v
+                items[field.name] = v
         items = items.items()
 
-    elif node_object.__class__ == list:
+    elif kind == ord_classes.ClassKindList:
         edge_prefix = PrefixListIndex
         items = {index: obj for index, obj in enumerate(node_object)}.items()
 
-    elif node_object.__class__ == dict:
+    else:
         edge_prefix = PrefixDictKey
         items = node_object.items()
-    else:
-        raise TypeError(f"unexpected class: {node_object.__class__} of {node_object}")
 
     # do not extend the child attr if it's default
     items_used = []
     for field_name, child_attr in items:
-        if child_attr.__class__ in ord_classes.OrdMessageClasses:
-            if all(
-                    getattr(child_attr, f) == child_attr._get_field_default(f)
-                    for f in child_attr._betterproto.sorted_field_names
-            ):
+        if child_attr is None:
+            continue
+        child_kind = ClassTable.by_class(child_attr.__class__).kind
+        if child_kind == ord_classes.ClassKindMessage:
+            if is_default_message(child_attr):
                 continue
         elif child_attr.__class__ in (list, dict, str) and len(child_attr) == 0:
             continue
-        elif child_attr is None:
-            continue
         # special handling for enum not necessary
         items_used.append((field_name, child_attr))
+    return edge_prefix, items_used
+
+
+def _extend_object(
+        node_id: int, tree: nx.DiGraph, node_object: Any, node_path: str
+):
+    assert node_id in tree.nodes
+
+    mtt_node = _node_path_mot_to_mtt(node_path)
+    edge_prefix, items_used = _get_object_items(node_object)
+    if len(items_used) == 0:
+        return
+    node_class_string = ClassTable.by_class(node_object.__class__).class_string
 
     for field_name, child_attr in items_used:
         child_id = len(tree.nodes)
         child_node_path = f"{node_path}{NodePathDelimiter}{edge_prefix}{field_name}"
         child_mtt_node = _node_path_mot_to_mtt(child_node_path)
-        is_child_literal = child_attr.__class__ in ord_classes.BuiltinLiteralClasses + ord_classes.OrdEnumClasses  # or child_attr is None
+        child_entry = ClassTable.by_class(child_attr.__class__)
+        is_child_literal = child_entry.is_literal  # or child_attr is None
         if is_child_literal:
             child_value = child_attr
         else:
@@ -109,7 +149,7 @@ def _extend_object(
             mot_state=PT_PRESET,
             mot_value=child_value,
             mtt_element_name=child_mtt_node,
-            mot_class_string=get_class_string(child_attr)
+            mot_class_string=child_entry.class_string
         )
         tree.add_node(child_id, **child_node_attr)
 
@@ -119,16 +159,16 @@ def _extend_object(
             mot_state=PT_PRESET,
             mot_value=field_name,
             mtt_element_name=(mtt_node, child_mtt_node),
-            mot_class_string=(get_class_string(node_object), get_class_string(child_attr)),
+            mot_class_string=(node_class_string, child_entry.class_string),
         )
 
         tree.add_edge(node_id, child_id, **edge_attr)
-        logger.debug(f"extending: {child_id}, {mot_get_path(tree, child_id)}, {child_node_attr['mot_value']}")
+        logger.debug("extending: {}, {}, {}", child_id, child_node_path, child_node_attr['mot_value'])
         _extend_object(child_id, tree, node_object=child_attr, node_path=child_node_path)
 
 
 def get_mot(message: betterproto.Message, ) -> nx.DiGraph:
-    assert message.__class__ in ord_classes.OrdMessageClasses
+    assert ClassTable.by_class(message.__class__).kind == ord_classes.ClassKindMessage
     tree = nx.DiGraph()
     root_node_attr = MotEleAttr(
         mot_element_id=0,
@@ -136,130 +176,233 @@ def get_mot(message: betterproto.Message, ) -> nx.DiGraph:
         mot_state=PT_PRESET,
         mot_value=None,
         mtt_element_name=RootNodePath,
-        mot_class_string=get_class_string(message),
+        mot_class_string=ClassTable.by_class(message.__class__).class_string,
     )
     tree.add_node(
         0, **root_node_attr
     )
     _extend_object(0, tree, message, RootNodePath)
+    tree.graph[MotNextIdKey] = len(tree)
 
     # verify mapping
-    mtt = get_mtt(message.__class__)
+    mtt = get_registered_mtt(message.__class__)
     for n, d in tree.nodes(data=True):
         assert d['mtt_element_name'] in mtt.nodes
         mot_class_string = d['mot_class_string']
         mtt_class_string = mtt.nodes[d['mtt_element_name']]['mtt_class_string']
-        mot_class = import_string(mot_class_string)
-        mtt_class = import_string(mtt_class_string)
+        mot_entry = ClassTable.by_string(mot_class_string)
+        mtt_entry = ClassTable.by_string(mtt_class_string)
         try:
-            assert mot_class == mtt_class
+            assert mot_entry is mtt_entry
         except AssertionError:
             logger.debug(
                 f"for node path: {mot_get_path(tree, n)} mtt_class: {mtt_class_string}, mot_class: {mot_class_string}")
-            assert mtt_class in ord_classes.OrdEnumClasses
-            assert mot_class in ord_classes.BuiltinLiteralClasses
+            assert mtt_entry.kind == ord_classes.ClassKindEnum
+            assert mot_entry.kind == ord_classes.ClassKindLiteral
     return tree
 
 
-def _construct_from_leafs(tree: nx.DiGraph, visited_leafs: set[int] = None):
-    if visited_leafs is None:
-        visited_leafs = set()
-
-    n_visited = len(visited_leafs)
-
-    unvisited_leafs = set(tree.nodes).difference(visited_leafs)
-    if len(unvisited_leafs) == 1:
-        logger.debug("all nodes visited, stopping")
-        return
-
-    leaf = get_leafs(tree.subgraph(unvisited_leafs))[0]
-
-    logger.debug(f"contracting leaf node: {leaf}")
-
-    parent = next(tree.predecessors(leaf))
-
-    parent_class = import_string(tree.nodes[parent]['mot_class_string'])
-    assert inspect.isclass(parent_class)
-
-    logger.debug(f"target parent: {parent_class}")
+class MotViewNode:
+    """
+    a node of `MotView`, its children are created from the wrapped object when first visited
+
+    attributes are the same as the node attributes of `get_mot` except `mot_element_id`,
+    which is only assigned by `MotView.to_mot`
+    """
+
+    __slots__ = ("node_object", "relation", "parent", "mtt_element_name", "_entry", "_children")
+
+    def __init__(self, node_object: Any, relation: Any, parent: "MotViewNode", mtt_element_name: str):
+        self.node_object = node_object
+        self.relation = relation  # `mot_value` of the edge from its parent
+        self.parent = parent
+        self.mtt_element_name = mtt_element_name
+        self._entry = ClassTable.by_class(node_object.__class__)
+        self._children = None
+
+    @property
+    def mot_class_string(self) -> str:
+        return self._entry.class_string
+
+    @property
+    def mot_can_edit(self) -> bool:
+        return self._entry.is_literal
+
+    @property
+    def mot_state(self) -> str:
+        return PT_PRESET
+
+    @property
+    def mot_value(self):
+        if self._entry.is_literal:
+            return self.node_object
+        return None
+
+    @property
+    def children(self) -> dict[Any, "MotViewNode"]:
+        """ children keyed by relation, in the order of `get_mot` """
+        if self._children is None:
+            edge_prefix, items_used = _get_object_items(self.node_object)
+            self._children = dict()
+            for field_name, child_attr in items_used:
+                child_mtt_node = f"{self.mtt_element_name}{NodePathDelimiter}{edge_prefix or field_name}"
+                self._children[field_name] = MotViewNode(child_attr, field_name, self, child_mtt_node)
+        return self._children
+
+    def __getitem__(self, relation) -> "MotViewNode":
+        return self.children[relation]
+
+    def __iter__(self):
+        return iter(self.children.values())
+
+    def __len__(self):
+        return len(self.children)
+
+    def node_attrs(self, node_id: int = None) -> MotEleAttr:
+        return MotEleAttr(
+            mot_element_id=node_id,
+            mot_can_edit=self.mot_can_edit,
+            mot_state=self.mot_state,
+            mot_value=self.mot_value,
+            mtt_element_name=self.mtt_element_name,
+            mot_class_string=self.mot_class_string,
+        )
 
-    children = list(tree.successors(parent))
-    logger.debug(f"contracting with children: {children}")
+    def edge_attrs(self, parent_id: int = None, node_id: int = None) -> MotEleAttr:
+        assert self.parent is not None
+        return MotEleAttr(
+            mot_element_id=(parent_id, node_id),
+            mot_can_edit=self.parent._entry.kind == ord_classes.ClassKindDict,
+            mot_state=PT_PRESET,
+            mot_value=self.relation,
+            mtt_element_name=(self.parent.mtt_element_name, self.mtt_element_name),
+            mot_class_string=(self.parent.mot_class_string, self.mot_class_string),
+        )
 
-    if parent_class in ord_classes.OrdMessageClasses:
 
-        # this is better for `oneof` see `test/bug/betterproto_data.py`
-        parent_object = parent_class()
-        for child in children:
-            attr = tree.nodes[child]['mot_value']
-            attr_name = tree.edges[(parent, child)]['mot_value']
-            setattr(parent_object, attr_name, attr)
-            logger.debug(f"setting {mot_get_path(tree, child)} {attr_name}=={attr}")
-
-        # kwargs = dict()
-        # for child in children:
-        #     attr = tree.nodes[child]['mot_value']
-        #     attr_name = tree.edges[(parent, child)]['mot_value']
-        #     logger.debug(f"setting {mot_get_path(tree, child)} {attr_name}=={attr} {type(attr)}")
-        #     kwargs[attr_name] = attr
-        # parent_object = parent_class(**kwargs)
-
-
-    elif parent_class in ord_classes.OrdEnumClasses:
-        raise RuntimeError(f"{parent_class} can only be leafs!")
-    # # as we use ord_enum as leafs (so ord_enum will always be leafs), this is not necessary
-    #     if len(children) != 1:
-    #         raise MessageObjectTreeError(f"try to construct an Enum: {parent_class} from !=1 children")
-    #     child = children[0]
-    #     v = tree.node_elements[child]['node_object']
-    #     k = tree.edges[(parent, child)]['relation_repr']
-    #     assert k == 'name'
-    #     parent_object = parent_class[v]
-
-    elif parent_class == list:
-        parent_object = []
-        children = sorted(children, key=lambda x: tree.edges[(parent, x)]['mot_value'])
-        assert is_arithmetic([tree.edges[(parent, c)]['mot_value'] for c in children], known_delta=1)
-        for child in children:
-            attr = tree.nodes[child]['mot_value']
-            parent_object.append(attr)
+class MotView:
+    """
+    a lazy, read-only MOT of a message, nothing is converted until a node is visited
+
+    the message must not be modified while the view is in use
+    """
+
+    def __init__(self, message: betterproto.Message):
+        assert ClassTable.by_class(message.__class__).kind == ord_classes.ClassKindMessage
+        self.message = message
+        self.root = MotViewNode(message, None, None, RootNodePath)
+
+    def get(self, *relations) -> MotViewNode:
+        """ the node reached by following relations (field names, list indices or dict keys) from the root """
+        node = self.root
+        for r in relations:
+            node = node[r]
+        return node
+
+    def iter_preorder(self) -> Iterator[MotViewNode]:
+        """ visit all nodes in the order `get_mot` numbers them """
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children.values()))
+
+    def to_mot(self) -> nx.DiGraph:
+        """ materialize the full MOT, equivalent to `get_mot(self.message)` """
+        tree = nx.DiGraph()
+        node_ids = dict()
+        for node_id, node in enumerate(self.iter_preorder()):
+            node_ids[id(node)] = node_id
+            tree.add_node(node_id, **node.node_attrs(node_id))
+            if node.parent is not None:
+                parent_id = node_ids[id(node.parent)]
+                tree.add_edge(parent_id, node_id, **node.edge_attrs(parent_id, node_id))
+        tree.graph[MotNextIdKey] = len(tree)
+        return tree
+
+
+def _construct_from_children(tree: nx.DiGraph, root: int) -> Any:
+    """
+    rebuild objects bottom-up in a single post-order pass, each parent is constructed once from its children
+
+    the tree is not modified, constructed objects are kept in a lookup that drops children once consumed
+    """
+    constructed = dict()
+    for parent in nx.dfs_postorder_nodes(tree, source=root):
+        children = list(tree.successors(parent))
+        if len(children) == 0:
+            constructed[parent] = tree.nodes[parent]['mot_value']
+            continue
 
-    elif parent_class == dict:
-        parent_object = dict()
-        for child in children:
-            attr = tree.nodes[child]['mot_value']
-            key_name = tree.edges[(parent, child)]['mot_value']
-            parent_object[key_name] = attr
-    else:
-        raise TypeError(f"unexpected parent class: {parent_class}")
+        parent_entry = ClassTable.by_string(tree.nodes[parent]['mot_class_string'])
+        parent_class = parent_entry.cls
+        logger.debug("contracting parent: {} {} with children: {}", parent, parent_class, children)
+
+        if parent_entry.kind == ord_classes.ClassKindMessage:
+
+            # this is better for `oneof` see `test/bug/betterproto_data.py`
+            parent_object = parent_class()
+            for child in children:
+                attr = constructed.pop(child)
+                attr_name = tree.edges[(parent, child)]['mot_value']
+                setattr(parent_object, attr_name, attr)
+                logger.debug("setting {} {}=={}", child, attr_name, attr)
+
+            # kwargs = dict()
+            # for child in children:
+            #     attr = constructed.pop(child)
+            #     attr_name = tree.edges[(parent, child)]['mot_value']
+            #     kwargs[attr_name] = attr
+            # parent_object = parent_class(**kwargs)
+
+        elif parent_entry.kind == ord_classes.ClassKindEnum:
+            raise RuntimeError(f"{parent_class} can only be leafs!")
+        # # as we use ord_enum as leafs (so ord_enum will always be leafs), this is not necessary
+        #     if len(children) != 1:
+        #         raise MessageObjectTreeError(f"try to construct an Enum: {parent_class} from !=1 children")
+        #     child = children[0]
+        #     v = constructed.pop(child)
+        #     k = tree.edges[(parent, child)]['relation_repr']
+        #     assert k == 'name'
+        #     parent_object = parent_class[v]
+
+        elif parent_entry.kind == ord_classes.ClassKindList:
+            parent_object = []
+            children = sorted(children, key=lambda x: tree.edges[(parent, x)]['mot_value'])
+            assert is_arithmetic([tree.edges[(parent, c)]['mot_value'] for c in children], known_delta=1)
+            for child in children:
+                parent_object.append(constructed.pop(child))
+
+        elif parent_entry.kind == ord_classes.ClassKindDict:
+            parent_object = dict()
+            for child in children:
+                key_name = tree.edges[(parent, child)]['mot_value']
+                parent_object[key_name] = constructed.pop(child)
+        else:
+            raise TypeError(f"unexpected parent class: {parent_class}")
 
-    logger.debug(f"parent object constructed: {parent_object}")
-    for child in children:
-        visited_leafs.add(child)
-    tree.nodes[parent]['mot_value'] = parent_object
-    logger.debug(f"visited: {n_visited} -> {len(visited_leafs)}")
-    _construct_from_leafs(tree, visited_leafs)
+        logger.debug("parent object constructed: {}", parent_object)
+        constructed[parent] = parent_object
+    return constructed[root]
 
 
 def message_from_mot(tree: nx.DiGraph) -> betterproto.Message:
     assert nx.is_arborescence(tree)
-    working_tree = deepcopy(tree)
-    _construct_from_leafs(working_tree)
-    root_node = get_root(working_tree)
-    return working_tree.nodes[root_node]['mot_value']
+    root_node = get_root(tree)
+    return _construct_from_children(tree, root_node)
 
 
 # TODO this is not actually pt
 def mot_to_dict(mot: nx.DiGraph):
     m = message_from_mot(mot)
-    root_class_string = get_class_string(m.__class__)
+    root_class_string = ClassTable.by_class(m.__class__).class_string
     d = {'message': m.to_dict(), 'root_class_string': root_class_string}
     return d
 
 
 def mot_from_dict(d):
     m_class = d['root_class_string']
-    m_class = import_string(m_class)
+    m_class = ClassTable.by_string(m_class).cls
     m = m_class()
     m.from_dict(d['message'])
     return get_mot(m)
@@ -269,17 +412,20 @@ def pt_to_dict(mot: nx.DiGraph):
     return nx.node_link_data(mot)
 
 
-def mot_get_path(mot: nx.DiGraph, node: int, delimiter: str = "default", with_node=False, remove_last=False):
+def mot_get_path(mot: nx.DiGraph, node: int, delimiter: str = "default", with_node=False, remove_last=False,
+                 path_index: "MotPathIndex" = None):
+    if path_index is not None:
+        return path_index.get_path(node, delimiter=delimiter, with_node=with_node, remove_last=remove_last)
     root = get_root(mot)
     p = nx.shortest_path(mot, source=root, target=node)
     if len(p) == 1:
-        return import_string(mot.nodes[root]['mot_class_string']).__name__
+        return ClassTable.by_string(mot.nodes[root]['mot_class_string']).cls.__name__
         # return RootNodePath
     str_path = []
     for i in range(len(p) - 1):
         u = p[i]
         v = p[i + 1]
-        u_class = import_string(mot.nodes[u]['mot_class_string'])
+        u_class = ClassTable.by_string(mot.nodes[u]['mot_class_string']).cls
         if u_class == list:
             prefix = PrefixListIndex
         elif u_class == dict:
@@ -292,7 +438,7 @@ def mot_get_path(mot: nx.DiGraph, node: int, delimiter: str = "default", with_no
             str_path.append(u_class.__name__)
         str_path.append(str_p)
         if i == len(p) - 2 and with_node:
-            v_class = import_string(mot.nodes[v]['mot_class_string'])
+            v_class = ClassTable.by_string(mot.nodes[v]['mot_class_string']).cls
             str_path.append(v_class.__name__)
 
     if remove_last:
@@ -310,128 +456,466 @@ def mot_get_path(mot: nx.DiGraph, node: int, delimiter: str = "default", with_no
     return r
 
 
+PathDelimiterStyles = {"default": NodePathDelimiter, "arrow": " \u2192 ", "dot": "."}
+
+
+class MotPathIndex(TreePathIndex):
+    """
+    parent pointers and cached root-to-node paths of a MOT in all delimiter styles, see `mot_get_path`
+
+    `pt_extend_node`, `pt_remove_node` and `pt_detach_node` keep it up to date if it is passed to them,
+    the index then describes the resulting tree, which is the returned copy if `inplace=False`
+    """
+
+    def __init__(self, mot: nx.DiGraph):
+        self.class_name = dict()
+        self.segment = dict()
+        self._is_list = dict()
+        self._is_dict = dict()
+        super().__init__(mot, edge_attr_name="mot_value")
+
+    def _index_node(self, tree: nx.DiGraph, node, parent):
+        self.parent[node] = parent
+        node_entry = ClassTable.by_string(tree.nodes[node]['mot_class_string'])
+        self.class_name[node] = node_entry.cls.__name__
+        self._is_list[node] = node_entry.kind == ord_classes.ClassKindList
+        self._is_dict[node] = node_entry.kind == ord_classes.ClassKindDict
+        if parent is None:
+            self.segment[node] = None
+            self.paths[node] = (self.class_name[node],) * len(PathDelimiterStyles)
+            return
+        if self._is_list[parent]:
+            prefix = PrefixListIndex
+        elif self._is_dict[parent]:
+            prefix = PrefixDictKey
+        else:
+            prefix = ""
+        str_p = prefix + str(tree.edges[(parent, node)][self.edge_attr_name])
+        self.segment[node] = str_p
+        paths = []
+        for parent_path, delimiter in zip(self.paths[parent], PathDelimiterStyles.values()):
+            str_p_styled = str_p.replace(NodePathDelimiter, delimiter)
+            if parent == self.root:
+                paths.append(str_p_styled)
+            else:
+                paths.append(parent_path + delimiter + str_p_styled)
+        self.paths[node] = tuple(paths)
+
+    def forget(self, nodes):
+        for n in nodes:
+            for d in (self.parent, self.paths, self.class_name, self.segment, self._is_list, self._is_dict):
+                d.pop(n, None)
+
+    def reroot(self, tree: nx.DiGraph, root):
+        for d in (self.class_name, self.segment, self._is_list, self._is_dict):
+            d.clear()
+        super().reroot(tree, root)
+
+    def get_path(self, node, delimiter: str = "default", with_node=False, remove_last=False):
+        try:
+            i = list(PathDelimiterStyles).index(delimiter)
+        except ValueError:
+            raise ValueError('unknown delimiter')
+        if node == self.root:
+            return self.class_name[node]
+        if not with_node and not remove_last:
+            return self.paths[node][i]
+        str_path = []
+        v = node
+        while v != self.root:
+            u = self.parent[v]
+            if with_node:
+                if v == node:
+                    str_path.append(self.class_name[v])
+                str_path.append(self.segment[v])
+                str_path.append(self.class_name[u])
+            else:
+                str_path.append(self.segment[v])
+            v = u
+        str_path.reverse()
+        if remove_last:
+            str_path = str_path[:-1]
+        return NodePathDelimiter.join(str_path).replace(NodePathDelimiter, PathDelimiterStyles[delimiter])
+
+
+"""
+copy-on-write snapshots
+
+a snapshot has its own node and adjacency tables, but shares the attribute dict of every node and edge and the
+adjacency dict of every node with the MOT it is taken from, so taking one costs a few pointer copies per node
+instead of a deepcopy. shared dicts must be touched (replaced by a private copy) before they are modified,
+`pt_*` operations always do so, other code should use `mot_touch_node` and `mot_touch_edge`
+"""
+
+
+def mot_snapshot(mot: nx.DiGraph) -> nx.DiGraph:
+    """ a structurally shared copy of `mot`, neither of them is affected by `pt_*` operations on the other """
+    new = mot.__class__()
+    new.graph.update(mot.graph)
+    new._node = dict(mot._node)
+    new._succ = new._adj = dict(mot._succ)
+    new._pred = dict(mot._pred)
+    return new
+
+
+def _touch_succ(mot: nx.DiGraph, u) -> dict:
+    mot._succ[u] = succ = dict(mot._succ[u])
+    return succ
+
+
+def _touch_pred(mot: nx.DiGraph, v) -> dict:
+    mot._pred[v] = pred = dict(mot._pred[v])
+    return pred
+
+
+def mot_touch_node(mot: nx.DiGraph, node) -> dict:
+    """ replace the attribute dict of a node by a private copy, return the copy for modification """
+    mot._node[node] = attrs = dict(mot._node[node])
+    return attrs
+
+
+def mot_touch_edge(mot: nx.DiGraph, u, v) -> dict:
+    """ replace the attribute dict of an edge by a private copy, return the copy for modification """
+    attrs = dict(mot._succ[u][v])
+    _touch_succ(mot, u)[v] = attrs
+    _touch_pred(mot, v)[u] = attrs
+    return attrs
+
+
+def _init_next_id(mot: nx.DiGraph, from_mot: nx.DiGraph = None):
+    # MOTs saved before ids were allocated by a counter do not have one, ids may come from the MOT `mot` is cut from
+    if from_mot is None:
+        from_mot = mot
+    if MotNextIdKey not in mot.graph:
+        mot.graph[MotNextIdKey] = max(from_mot.nodes) + 1 if len(from_mot) > 0 else 0
+
+
+def mot_new_node_id(mot: nx.DiGraph) -> int:
+    """ allocate a node id in O(1), ids are never reused in a MOT even after their nodes are removed """
+    _init_next_id(mot)
+    node_id = mot.graph[MotNextIdKey]
+    # nodes added without the counter, e.g. by `nx.compose`
+    if node_id in mot._node:
+        node_id = max(mot.nodes) + 1
+    mot.graph[MotNextIdKey] = node_id + 1
+    return node_id
+
+
+def _remove_subtree(mot: nx.DiGraph, node) -> set:
+    """ remove a node and its descendants without modifying shared dicts, return the descendants """
+    _init_next_id(mot)
+    offs = nx.descendants(mot, node)
+    for parent in mot._pred[node]:
+        del _touch_succ(mot, parent)[node]
+    for n in offs:
+        del mot._node[n], mot._succ[n], mot._pred[n]
+    del mot._node[node], mot._succ[node], mot._pred[node]
+    return offs
+
+
+def _record_removal(mot: nx.DiGraph, nodes: set, delta: "MotDelta"):
+    """ record the removal of `nodes` and all edges incident to them """
+    for n in nodes:
+        for u, attrs in mot._pred[n].items():
+            delta.remove_edge(u, n, attrs)
+        for v, attrs in mot._succ[n].items():
+            if v not in nodes:
+                delta.remove_edge(n, v, attrs)
+        delta.remove_node(n, mot._node[n])
+
+
 # prototype operations
-def pt_remove_node(mot_original: nx.DiGraph, node_to_remove: int, inplace=False):
+def pt_remove_node(mot_original: nx.DiGraph, node_to_remove: int, inplace=False, path_index: MotPathIndex = None,
+                   delta: "MotDelta" = None):
     if inplace:
         mot = mot_original
     else:
-        mot = deepcopy(mot_original)
+        mot = mot_snapshot(mot_original)
     # if the node is an element of a list, reassign indices of the edges to its siblings
     parent = next(mot.predecessors(node_to_remove))
-    parent_class = import_string(mot.nodes[parent]['mot_class_string'])
-    if parent_class == list:
+    parent_kind = ClassTable.by_string(mot.nodes[parent]['mot_class_string']).kind
+    reindexed = []
+    if parent_kind == ord_classes.ClassKindList:
         children = list(mot.successors(parent))
         i = 0
         for child in children:
             if child == node_to_remove:
                 continue
-            edge = (parent, child)
-            edge_attr = mot.edges[edge]
-            edge_attr['mot_value'] = i
+            old_attrs = mot.edges[(parent, child)]
+            if old_attrs['mot_value'] != i:
+                reindexed.append(child)
+                new_attrs = mot_touch_edge(mot, parent, child)
+                new_attrs['mot_value'] = i
+                if delta is not None:
+                    delta.change_edge(parent, child, old_attrs, new_attrs)
             i += 1
-    for off in nx.descendants(mot, node_to_remove):
-        mot.remove_node(off)
-    mot.remove_node(node_to_remove)
+    if delta is not None:
+        subtree = nx.descendants(mot, node_to_remove)
+        subtree.add(node_to_remove)
+        _record_removal(mot, subtree, delta)
+    offs = _remove_subtree(mot, node_to_remove)
+    if path_index is not None:
+        path_index.forget(offs)
+        path_index.forget([node_to_remove])
+        for child in reindexed:
+            path_index.index_subtree(mot, child)
     if not inplace:
         return mot
 
 
-def pt_detach_node(mot: nx.DiGraph, new_root: int, inplace=False):
-    new_tree = list(nx.descendants(mot, new_root))
-    new_tree.append(new_root)
+def pt_detach_node(mot: nx.DiGraph, new_root: int, inplace=False, path_index: MotPathIndex = None,
+                   delta: "MotDelta" = None):
+    new_tree = nx.descendants(mot, new_root)
+    new_tree.add(new_root)
+    if delta is not None:
+        _record_removal(mot, {n for n in mot.nodes if n not in new_tree}, delta)
     if inplace:
+        _init_next_id(mot)
         nodes_to_remove = [n for n in mot.nodes if n not in new_tree]
         for n in nodes_to_remove:
-            mot.remove_node(n)
+            del mot._node[n], mot._succ[n], mot._pred[n]
+        new_mot = mot
     else:
-        return deepcopy(mot.subgraph(new_tree))
+        new_mot = mot.__class__()
+        new_mot.graph.update(mot.graph)
+        _init_next_id(new_mot, mot)
+        for n in mot.nodes:
+            if n in new_tree:
+                new_mot._node[n] = mot._node[n]
+                new_mot._succ[n] = mot._succ[n]
+                new_mot._pred[n] = mot._pred[n]
+    # the edge to the old parent
+    new_mot._pred[new_root] = dict()
+    if path_index is not None:
+        path_index.reroot(new_mot, new_root)
+    if not inplace:
+        return new_mot
 
 
-def pt_extend_node(mot_original: nx.DiGraph, from_node: int, inplace=False):
-    if inplace:
-        mot = mot_original
-    else:
-        mot = deepcopy(mot_original)
+def _extend_node(mot: nx.DiGraph, from_node: int, path_index: MotPathIndex = None, delta: "MotDelta" = None,
+                 verbose: bool = True):
+    """ add the missing children of `from_node` inplace, shared dicts are touched first """
     # TODO if we are to extend a node in a detached tree,
     #  mtt_element_name field can have <ROOT> points to `Reaction` which is not present in the current mtt
-    # mtt = get_mtt(import_string(mot.nodes[get_root(mot)]['mot_class_string']))
-    mtt = get_mtt(Reaction)
+    # mtt = get_registered_mtt(import_string(mot.nodes[get_root(mot)]['mot_class_string']))
+    mtt = get_registered_mtt(Reaction)
     assert len(mot.nodes) > 0
-    logger.info(
-        f"extending node: {from_node} {mot_get_path(mot, from_node)}, current tree size: {len(mot.nodes)}"
-    )
+    if verbose:
+        from_node_path = mot_get_path(mot, from_node, path_index=path_index)
+        logger.info(
+            f"extending node: {from_node} {from_node_path}, current tree size: {len(mot.nodes)}"
+        )
     from_node_class_string = mot.nodes[from_node]['mot_class_string']
-    from_node_class = import_string(from_node_class_string)
+    from_node_entry = ClassTable.by_string(from_node_class_string)
     # if the mapped node is a literal, do nothing, note enum is here
-    if from_node_class in ord_classes.BuiltinLiteralClasses + ord_classes.OrdEnumClasses:
-        pass
+    if from_node_entry.is_literal:
+        return
 
     # otherwise, add children
-    else:
-        from_node_mtt = mot.nodes[from_node]['mtt_element_name']  # in which <ROOT> is Reaction!
-        children_mtt = list(mtt.successors(from_node_mtt))
-        for child_mtt in children_mtt:
-            child_class_string = mtt.nodes[child_mtt]['mtt_class_string']
-            child_class = import_string(child_class_string)
-            new_child = max(mot.nodes) + 1
-
-            # if child is non-literal, set its state as preset, otherwise placeholder
-            child_attr_mot_state = PT_PRESET
-            child_class_is_literal = child_class in ord_classes.BuiltinLiteralClasses + ord_classes.OrdEnumClasses
-            if child_class_is_literal:
-                child_attr_mot_state = PT_PLACEHOLDER
-            child_attr = MotEleAttr(
-                mot_element_id=new_child,
-                mot_can_edit=child_class_is_literal,
-                mot_state=child_attr_mot_state,
-                mot_value=None,
-                mtt_element_name=child_mtt,
-                mot_class_string=child_class_string,
-            )
-            existing_edge_values = [d['mot_value'] for _, _, d in mot.out_edges(from_node, data=True)]
-
-            if from_node_class == list:
-                assert len(children_mtt) == 1
-                tmp_mot_can_edit = False
-                tmp_mot_state = PT_PRESET
-                tmp_mot_value = len(existing_edge_values)
-
-            elif from_node_class == dict:
-                assert len(children_mtt) == 1
-                tmp_mot_can_edit = True
-                tmp_mot_state = PT_PLACEHOLDER
-                tmp_mot_value = f"{PrefixDictKey}{len(existing_edge_values)}"
+    _touch_succ(mot, from_node)
+    from_node_mtt = mot.nodes[from_node]['mtt_element_name']  # in which <ROOT> is Reaction!
+    children_mtt = list(mtt.successors(from_node_mtt))
+    existing_edge_values = {d['mot_value'] for d in mot._succ[from_node].values()}
+    n_existing_edges = len(mot._succ[from_node])
+    for child_mtt in children_mtt:
+        child_class_string = mtt.nodes[child_mtt]['mtt_class_string']
+        child_entry = ClassTable.by_string(child_class_string)
+
+        if from_node_entry.kind == ord_classes.ClassKindList:
+            assert len(children_mtt) == 1
+            tmp_mot_can_edit = False
+            tmp_mot_state = PT_PRESET
+            tmp_mot_value = n_existing_edges
+
+        elif from_node_entry.kind == ord_classes.ClassKindDict:
+            assert len(children_mtt) == 1
+            tmp_mot_can_edit = True
+            tmp_mot_state = PT_PLACEHOLDER
+            tmp_mot_value = f"{PrefixDictKey}{n_existing_edges}"
 
-            else:
-                child_mtt_relation_to_parent = mtt.nodes[child_mtt]['mtt_relation_to_parent']
-                if child_mtt_relation_to_parent in existing_edge_values:
+        else:
+            child_mtt_relation_to_parent = mtt.nodes[child_mtt]['mtt_relation_to_parent']
+            if child_mtt_relation_to_parent in existing_edge_values:
+                if verbose:
                     logger.info(
                         f"extending an edge but its label already exists, skipping: {child_mtt_relation_to_parent}")
-                    continue
-
-                tmp_mot_can_edit = False
-                tmp_mot_state = PT_PRESET
-                tmp_mot_value = child_mtt_relation_to_parent
+                continue
 
-            edge_attr = MotEleAttr(
-                mot_element_id=(from_node, new_child),
-                mot_can_edit=tmp_mot_can_edit,
-                mot_state=tmp_mot_state,
-                mot_value=tmp_mot_value,
-                mtt_element_name=(from_node_mtt, child_mtt),
-                mot_class_string=(from_node_class_string, child_class_string),
-            )
+            tmp_mot_can_edit = False
+            tmp_mot_state = PT_PRESET
+            tmp_mot_value = child_mtt_relation_to_parent
+
+        new_child = mot_new_node_id(mot)
+        # if child is non-literal, set its state as preset, otherwise placeholder
+        child_attr_mot_state = PT_PRESET
+        child_class_is_literal = child_entry.is_literal
+        if child_class_is_literal:
+            child_attr_mot_state = PT_PLACEHOLDER
+        child_attr = MotEleAttr(
+            mot_element_id=new_child,
+            mot_can_edit=child_class_is_literal,
+            mot_state=child_attr_mot_state,
+            mot_value=None,
+            mtt_element_name=child_mtt,
+            mot_class_string=child_class_string,
+        )
+        edge_attr = MotEleAttr(
+            mot_element_id=(from_node, new_child),
+            mot_can_edit=tmp_mot_can_edit,
+            mot_state=tmp_mot_state,
+            mot_value=tmp_mot_value,
+            mtt_element_name=(from_node_mtt, child_mtt),
+            mot_class_string=(from_node_class_string, child_class_string),
+        )
 
+        if verbose:
             logger.info(
-                f"adding edge: ({from_node}, {new_child}) {mot_get_path(mot, from_node)}.{edge_attr['mot_value']}")
-            mot.add_node(new_child, **child_attr)
-            mot.add_edge(from_node, new_child, **edge_attr)
+                f"adding edge: ({from_node}, {new_child}) {from_node_path}.{edge_attr['mot_value']}")
+        mot.add_node(new_child, **child_attr)
+        mot.add_edge(from_node, new_child, **edge_attr)
+        existing_edge_values.add(tmp_mot_value)
+        n_existing_edges += 1
+        if path_index is not None:
+            path_index.index_subtree(mot, new_child)
+        if delta is not None:
+            delta.add_node(new_child, child_attr)
+            delta.add_edge(from_node, new_child, edge_attr)
+        if verbose:
             logger.info(f"edge added, current tree size: {len(mot.nodes)}")
+
+
+def pt_extend_node(mot_original: nx.DiGraph, from_node: int, inplace=False, path_index: MotPathIndex = None,
+                   delta: "MotDelta" = None):
+    if inplace:
+        mot = mot_original
+    else:
+        mot = mot_snapshot(mot_original)
+    _extend_node(mot, from_node, path_index=path_index, delta=delta)
+    if not inplace:
+        return mot
+
+
+def pt_graft_subtree(mot_original: nx.DiGraph, target: int, donor: nx.DiGraph, inplace=False,
+                     path_index: MotPathIndex = None, delta: "MotDelta" = None):
+    """
+    graft a prototype onto a leaf of `mot`, the leaf takes the place of the donor root
+
+    other donor nodes get new ids and mtt names relative to the leaf, the names are checked in a pass over the donor
+    before the nodes are added in another, so the cost is proportional to the size of the donor,
+    the donor is not modified
+    """
+    if inplace:
+        mot = mot_original
+    else:
+        mot = mot_snapshot(mot_original)
+    if len(mot._succ[target]) > 0:
+        raise ValueError(f"cannot graft on node {target} that has children")
+    donor_root = get_root(donor)
+    target_attrs = mot._node[target]
+    donor_root_attrs = donor._node[donor_root]
+    if donor_root_attrs['mot_class_string'] != target_attrs['mot_class_string']:
+        raise ValueError(f"cannot graft {donor_root_attrs['mot_class_string']} on {target_attrs['mot_class_string']}")
+    target_mtt = target_attrs['mtt_element_name']
+    donor_root_mtt = donor_root_attrs['mtt_element_name']
+    mtt = get_registered_mtt(Reaction)
+
+    # all names are checked before `mot` is modified, a failed graft leaves it as it was
+    names = dict()
+    for v, mtt_name in donor.nodes(data='mtt_element_name'):
+        if v == donor_root:
+            continue
+        if not mtt_name.startswith(donor_root_mtt):
+            raise ValueError(f"{mtt_name} is not under the donor root {donor_root_mtt}")
+        new_name = target_mtt + mtt_name[len(donor_root_mtt):]
+        if new_name not in mtt:
+            raise ValueError(f"{new_name} is not in the mtt")
+        names[v] = new_name
+
+    mapping = {donor_root: target}
+    new_attrs = dict(donor_root_attrs)
+    new_attrs['mot_element_id'] = target
+    new_attrs['mtt_element_name'] = target_mtt
+    mot._node[target] = new_attrs
+    if delta is not None:
+        delta.change_node(target, target_attrs, new_attrs)
+    _touch_succ(mot, target)
+    # preorder, parents are mapped before their children
+    stack = [donor_root]
+    while stack:
+        u = stack.pop()
+        for v, edge_attrs in donor._succ[u].items():
+            new_v = mot_new_node_id(mot)
+            mapping[v] = new_v
+            node_attrs = dict(donor._node[v])
+            node_attrs['mot_element_id'] = new_v
+            node_attrs['mtt_element_name'] = names[v]
+            edge_attrs = dict(edge_attrs)
+            edge_attrs['mot_element_id'] = (mapping[u], new_v)
+            edge_attrs['mtt_element_name'] = (mot._node[mapping[u]]['mtt_element_name'], node_attrs['mtt_element_name'])
+            mot._node[new_v] = node_attrs
+            mot._succ[new_v] = dict()
+            mot._pred[new_v] = {mapping[u]: edge_attrs}
+            mot._succ[mapping[u]][new_v] = edge_attrs
+            if delta is not None:
+                delta.add_node(new_v, node_attrs)
+                delta.add_edge(mapping[u], new_v, edge_attrs)
+            stack.append(v)
+    if path_index is not None:
+        path_index.index_subtree(mot, target)
+    logger.info(f"grafted {len(mapping)} nodes on {target}, current tree size: {len(mot.nodes)}")
     if not inplace:
         return mot
 
 
+def _is_literal_value(value: Any, entry: ord_classes.OrdClassEntry) -> bool:
+    # values loaded from json: enums are ints or strings of their names or values, bytes are strings
+    if isinstance(value, bool):
+        return entry.cls == bool
+    if entry.kind == ord_classes.ClassKindEnum:
+        if isinstance(value, str):
+            value = value.strip()
+            if not value.lstrip("-").isdigit():
+                return value in entry.cls.__members__
+            value = int(value)
+        return isinstance(value, int) and value in entry.cls._value2member_map_
+    if entry.cls == float:
+        return isinstance(value, (int, float))
+    if entry.cls == bytes:
+        return isinstance(value, (bytes, str))
+    return isinstance(value, entry.cls)
+
+
+def pt_validate(mot: nx.DiGraph):
+    """ check the structure and the attributes of a prototype in one pass, raise ValueError if it is invalid """
+    # prototypes can come from clients, the checks are not asserts
+    if not nx.is_arborescence(mot):
+        raise ValueError("the prototype is not a tree")
+    for n, d in mot.nodes(data=True):
+        if d['mot_element_id'] != n:
+            raise ValueError(f"node {n} has element id {d['mot_element_id']}")
+        if d['mot_state'] not in PT_STATES:
+            raise ValueError(f"node {n} has invalid state {d['mot_state']}")
+        entry = ClassTable.by_string(d['mot_class_string'])
+        if entry.kind == ord_classes.ClassKindList:
+            indices = sorted(mot._succ[n][c]['mot_value'] for c in mot._succ[n])
+            if indices != list(range(len(indices))):
+                raise ValueError(f"list node {n} has indices {indices}")
+        elif entry.kind == ord_classes.ClassKindMessage or entry.kind == ord_classes.ClassKindDict:
+            keys = [mot._succ[n][c]['mot_value'] for c in mot._succ[n]]
+            if len(set(keys)) != len(keys):
+                raise ValueError(f"node {n} has duplicate relations {keys}")
+        else:
+            if len(mot._succ[n]) > 0:
+                raise ValueError(f"literal node {n} has children")
+            if d['mot_state'] == PT_PRESET and not _is_literal_value(d['mot_value'], entry):
+                raise ValueError(f"literal node {n} has value {d['mot_value']!r} that is not a {d['mot_class_string']}")
+    for u, v, d in mot.edges(data=True):
+        if tuple(d['mot_element_id']) != (u, v):
+            raise ValueError(f"edge {(u, v)} has element id {d['mot_element_id']}")
+        if d['mot_state'] not in PT_STATES:
+            raise ValueError(f"edge {(u, v)} has invalid state {d['mot_state']}")
+
+
 def get_literal_nodes(mot: nx.DiGraph):
-    literal_classes = ord_classes.BuiltinLiteralClasses + ord_classes.OrdEnumClasses
-    return [n for n in mot.nodes if
-            import_string(mot.nodes[n]['mot_class_string']) in literal_classes]
+    return [n for n, class_string in mot.nodes(data='mot_class_string')
+            if ClassTable.by_string(class_string).is_literal]
@@ -3,11 +3,10 @@ import typing
 from typing import get_args, Type, get_origin, Optional, TypedDict, Union
 
 import networkx as nx
-from betterproto import ProtoClassMetadata
 
-from ord_tree.ord_classes import BuiltinLiteralClasses, OrdEnumClasses, OrdMessageClasses
-from ord_tree.utils import get_class_string, NodePathDelimiter, RootNodePath, PrefixListIndex, PrefixDictKey, \
-    import_string, get_root, get_type_hints_without_private
+from ord_betterproto.descriptors import get_message_descriptor
+from ord_tree.ord_classes import ClassTable, ClassKindList, ClassKindDict, ClassKindMessage
+from ord_tree.utils import NodePathDelimiter, RootNodePath, PrefixListIndex, PrefixDictKey, get_root
 
 """
 message type tree
@@ -43,9 +42,10 @@ def _extend_mtt(
             assert type_hint.__class__ == typing._UnionGenericAlias and type_hint.__name__ == Optional.__name__
             node_class = get_args(type_hint)[0]
 
+    node_entry = ClassTable.by_class(node_class)
     node_attr = MttNodeAttr(
         mtt_type_hint_string=str(type_hint),
-        mtt_class_string=get_class_string(node_class),
+        mtt_class_string=node_entry.class_string,
         mtt_relation_to_parent=relation_to_parent,
         mtt_parent=parent,
         mtt_node_name=node_name,
@@ -57,36 +57,61 @@ def _extend_mtt(
         tree.add_edge(parent, node_name)
 
     # children
-    if node_class == list:
+    if node_entry.kind == ClassKindList:
         attr_name = PrefixListIndex
         attr_type = get_args(type_hint)[0]
         _extend_mtt(attr_type, tree, parent=node_name, relation_to_parent=attr_name)
-    elif node_class == dict:
+    elif node_entry.kind == ClassKindDict:
         attr_name = PrefixDictKey
         attr_type = get_args(type_hint)[1]
         _extend_mtt(attr_type, tree, parent=node_name, relation_to_parent=attr_name)
-    elif node_class in BuiltinLiteralClasses + OrdEnumClasses:
+    elif node_entry.is_literal:
         return
     else:
-        assert node_class in OrdMessageClasses
-        pcm = ProtoClassMetadata(node_class)
-        for attr_name, attr_type in get_type_hints_without_private(type_hint).items():
-            try:
-                group_name = pcm.oneof_group_by_field[attr_name]
-            except KeyError:
-                group_name = None
-            _extend_mtt(attr_type, tree, parent=node_name, relation_to_parent=attr_name,
-                        relation_to_parent_oneof=group_name)
+        assert node_entry.kind == ClassKindMessage
+        for field in get_message_descriptor(node_class).fields:
+            _extend_mtt(field.type_hint, tree, parent=node_name, relation_to_parent=field.name,
+                        relation_to_parent_oneof=field.oneof_group)
 
 
 def get_mtt(message: Type) -> nx.DiGraph:
-    assert inspect.isclass(message) and message in OrdMessageClasses
+    assert inspect.isclass(message) and ClassTable.by_class(message).kind == ClassKindMessage
     g = nx.DiGraph()
     _extend_mtt(message, g)
     assert nx.is_arborescence(g)
     return g
 
 
+"""
+process-wide registry, each message class is walked only once
+"""
+
+_MttRegistry: dict[Type, nx.DiGraph] = dict()
+
+
+def get_registered_mtt(message: Type) -> nx.DiGraph:
+    """
+    get the mtt of a message class from the registry, it is built on the first request
+
+    the returned mtt is frozen and shared by all callers, do not modify its attributes,
+    use `get_mtt` if a private copy is needed
+    """
+    try:
+        return _MttRegistry[message]
+    except KeyError:
+        mtt = nx.freeze(get_mtt(message))
+        _MttRegistry[message] = mtt
+        return mtt
+
+
+def invalidate_mtt_registry(message: Type = None):
+    """ drop the registered mtt of `message`, or all registered mtts if `message` is None """
+    if message is None:
+        _MttRegistry.clear()
+    else:
+        _MttRegistry.pop(message, None)
+
+
 def mtt_to_dict(mtt: nx.DiGraph) -> dict:
     return nx.node_link_data(mtt)
 
@@ -96,9 +121,7 @@ def mtt_from_dict(d: dict) -> nx.DiGraph:
 
 
 def get_mtt_node_class(mtt: nx.DiGraph, node: str) -> Type:
-    c = import_string(mtt.nodes[node]['mtt_class_string'])
-    assert inspect.isclass(c)
-    return c
+    return ClassTable.by_string(mtt.nodes[node]['mtt_class_string']).cls
 
 
 def get_mtt_root_class(mtt: nx.DiGraph) -> Type:
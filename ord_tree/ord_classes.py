@@ -1,7 +1,9 @@
 import inspect
 from enum import Enum
+from typing import NamedTuple, Type
 
 import ord_betterproto
+from ord_tree.utils import get_class_string, import_string
 
 """
 Groups for classes used in ORD
@@ -25,3 +27,93 @@ for c in OrdClasses:
         OrdEnumClasses.append(c)
     else:
         OrdMessageClasses.append(c)
+
+"""
+Class table
+
+every class that can appear in a MOT/MTT gets an integer id, lookups by id, class string or class object are O(1)
+"""
+
+ClassKindLiteral = "literal"
+ClassKindEnum = "enum"
+ClassKindMessage = "message"
+ClassKindList = "list"
+ClassKindDict = "dict"
+
+
+class OrdClassEntry(NamedTuple):
+    class_id: int
+    class_string: str
+    cls: Type
+    kind: str
+    is_literal: bool  # literals and enums are leafs
+
+
+def _get_class_kind(c: Type) -> str:
+    if c in BuiltinLiteralClasses:
+        return ClassKindLiteral
+    elif c == list:
+        return ClassKindList
+    elif c == dict:
+        return ClassKindDict
+    elif c in OrdEnumClasses:
+        return ClassKindEnum
+    elif c in OrdMessageClasses:
+        return ClassKindMessage
+    raise TypeError(f"unexpected class: {c}")
+
+
+class OrdClassTable:
+    """ precomputed entries of all ORD classes, classes outside of ORD are rejected """
+
+    def __init__(self, classes):
+        self.entries: list[OrdClassEntry] = []
+        self._by_string: dict[str, OrdClassEntry] = dict()
+        self._by_class: dict[Type, OrdClassEntry] = dict()
+        for c in classes:
+            self.add(c)
+
+    def add(self, c: Type) -> OrdClassEntry:
+        try:
+            return self._by_class[c]
+        except KeyError:
+            pass
+        kind = _get_class_kind(c)
+        entry = OrdClassEntry(
+            class_id=len(self.entries),
+            class_string=get_class_string(c),
+            cls=c,
+            kind=kind,
+            is_literal=kind in (ClassKindLiteral, ClassKindEnum),
+        )
+        self.entries.append(entry)
+        self._by_string[entry.class_string] = entry
+        self._by_class[c] = entry
+        return entry
+
+    def __getitem__(self, class_id: int) -> OrdClassEntry:
+        return self.entries[class_id]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def by_class(self, c: Type) -> OrdClassEntry:
+        try:
+            return self._by_class[c]
+        except KeyError:
+            return self.add(c)
+
+    def by_string(self, class_string: str) -> OrdClassEntry:
+        try:
+            return self._by_string[class_string]
+        except KeyError:
+            # e.g. an alias of a known class
+            entry = self.by_class(import_string(class_string))
+            self._by_string[class_string] = entry
+            return entry
+
+    def intern(self, class_string: str) -> int:
+        return self.by_string(class_string).class_id
+
+
+ClassTable = OrdClassTable([*BuiltinLiteralClasses, list, dict, *OrdEnumClasses, *OrdMessageClasses])
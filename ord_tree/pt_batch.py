@@ -0,0 +1,157 @@
+import base64
+from typing import TYPE_CHECKING, Any, Iterable, NamedTuple, Union
+
+import networkx as nx
+from loguru import logger
+
+from ord_tree.mot import PT_PLACEHOLDER, PT_STATES, MotPathIndex, mot_snapshot, mot_touch_node, mot_touch_edge, \
+    pt_remove_node, pt_detach_node, pt_graft_subtree, pt_validate, _extend_node, _record_removal, _remove_subtree
+from ord_tree.ord_classes import ClassTable
+from ord_tree.template import coerce_placeholder_value
+
+if TYPE_CHECKING:
+    from ord_tree.history import MotDelta
+
+"""
+apply many prototype operations in one pass
+
+new nodes are numbered by the id counter of the prototype, paths are not built for logging,
+and the prototype is validated once after the last operation instead of after each of them
+"""
+
+PtOpExtend = "extend"
+PtOpRemove = "remove"
+PtOpDetach = "detach"
+PtOpSetValue = "set_value"
+PtOpSetState = "set_state"
+PtOpGraft = "graft"
+PtOps = (PtOpExtend, PtOpRemove, PtOpDetach, PtOpSetValue, PtOpSetState, PtOpGraft)
+
+
+class PtOperation(NamedTuple):
+    op: str  # one of `PtOps`
+    target: Union[int, tuple[int, int]]  # a node id, or an edge for `PtOpSetValue` and `PtOpSetState`
+    value: Any = None  # the value, the state, or the prototype to graft
+
+
+def _as_element_id(target) -> Union[int, tuple[int, int]]:
+    # edges are lists in json
+    if isinstance(target, list):
+        return tuple(target)
+    return target
+
+
+def _check_target(mot: nx.DiGraph, op: str, target):
+    # operations can come from clients, the checks are not asserts
+    if isinstance(target, tuple):
+        if op not in (PtOpSetValue, PtOpSetState):
+            raise ValueError(f"{op} takes a node, not the edge {target}")
+        if not (len(target) == 2 and target[0] in mot._succ and target[1] in mot._succ[target[0]]):
+            raise ValueError(f"edge {target} is not in the prototype")
+    elif not (isinstance(target, int) and target in mot._node):
+        raise ValueError(f"node {target} is not in the prototype")
+
+
+def _set_state(mot: nx.DiGraph, target, state: str, path_index: MotPathIndex = None, delta: "MotDelta" = None):
+    if state not in PT_STATES:
+        raise ValueError(f"invalid state: {state}")
+    if isinstance(target, tuple):
+        old = mot._succ[target[0]][target[1]]
+        new = mot_touch_edge(mot, *target)
+        new['mot_state'] = state
+        if delta is not None:
+            delta.change_edge(*target, old, new)
+        return
+    old = mot._node[target]
+    new = mot_touch_node(mot, target)
+    new['mot_state'] = state
+    if delta is not None:
+        delta.change_node(target, old, new)
+    # a non-literal placeholder has no children, same as in the editor
+    if state == PT_PLACEHOLDER and not ClassTable.by_string(new['mot_class_string']).is_literal:
+        for child in list(mot._succ[target]):
+            if delta is not None:
+                subtree = nx.descendants(mot, child)
+                subtree.add(child)
+                _record_removal(mot, subtree, delta)
+            offs = _remove_subtree(mot, child)
+            if path_index is not None:
+                path_index.forget(offs)
+                path_index.forget([child])
+
+
+def _coerce_value(value: Any, class_string: str) -> Any:
+    # values from json, bytes are base64 strings as in the editor
+    if value is None:
+        return None
+    cls = ClassTable.by_string(class_string).cls
+    if cls == str and not isinstance(value, str):
+        raise ValueError(f"not a string: {value!r}")
+    try:
+        if cls == bytes and isinstance(value, str):
+            return base64.b64decode(value, validate=True)
+        return coerce_placeholder_value(value, class_string)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"invalid value for {class_string}: {value!r}") from e
+
+
+def _set_value(mot: nx.DiGraph, target, value: Any, delta: "MotDelta" = None):
+    if isinstance(target, tuple):
+        old = mot._succ[target[0]][target[1]]
+        if not old['mot_can_edit']:
+            raise ValueError(f"edge {target} is not editable")
+        # dict keys
+        if not (value is None or isinstance(value, str)):
+            raise ValueError(f"edge {target} takes a string, not {value!r}")
+        new = mot_touch_edge(mot, *target)
+    else:
+        old = mot._node[target]
+        if not old['mot_can_edit']:
+            raise ValueError(f"node {target} is not editable")
+        value = _coerce_value(value, old['mot_class_string'])
+        new = mot_touch_node(mot, target)
+    new['mot_value'] = value
+    if delta is not None:
+        if isinstance(target, tuple):
+            delta.change_edge(*target, old, new)
+        else:
+            delta.change_node(target, old, new)
+
+
+def pt_apply_operations(mot_original: nx.DiGraph, operations: Iterable[PtOperation], inplace=False,
+                        path_index: MotPathIndex = None, delta: "MotDelta" = None, validate=True):
+    """
+    apply operations in order, an operation can use nodes created by the ones before it
+
+    :param operations: `PtOperation` or (op, target, value) tuples
+    :param validate: run `pt_validate` after the last operation
+    """
+    if inplace:
+        mot = mot_original
+    else:
+        mot = mot_snapshot(mot_original)
+    n_operations = 0
+    for operation in operations:
+        operation = PtOperation(*operation)
+        target = _as_element_id(operation.target)
+        _check_target(mot, operation.op, target)
+        if operation.op == PtOpExtend:
+            _extend_node(mot, target, path_index=path_index, delta=delta, verbose=False)
+        elif operation.op == PtOpRemove:
+            pt_remove_node(mot, target, inplace=True, path_index=path_index, delta=delta)
+        elif operation.op == PtOpDetach:
+            pt_detach_node(mot, target, inplace=True, path_index=path_index, delta=delta)
+        elif operation.op == PtOpSetValue:
+            _set_value(mot, target, operation.value, delta=delta)
+        elif operation.op == PtOpSetState:
+            _set_state(mot, target, operation.value, path_index=path_index, delta=delta)
+        elif operation.op == PtOpGraft:
+            pt_graft_subtree(mot, target, operation.value, inplace=True, path_index=path_index, delta=delta)
+        else:
+            raise ValueError(f"unknown operation: {operation.op}")
+        n_operations += 1
+    if validate:
+        pt_validate(mot)
+    logger.info(f"applied {n_operations} operations, current tree size: {len(mot.nodes)}")
+    if not inplace:
+        return mot
@@ -0,0 +1,254 @@
+from typing import Any, Iterable, Mapping, Sequence, Union
+
+import betterproto
+import networkx as nx
+
+from ord_betterproto.descriptors import get_message_descriptor
+from ord_tree import ord_classes
+from ord_tree.mot import PT_PLACEHOLDER, MotPathIndex, PathDelimiterStyles
+from ord_tree.ord_classes import ClassTable
+from ord_tree.utils import get_root
+
+"""
+compile a prototype into a template that builds messages without walking the graph
+
+the tree is flattened once into a post-order list of construction steps, instantiating a template only
+writes the values of its slots (placeholder nodes and dict keys) into a copy of the leaf values and runs the steps,
+the result is the same as `message_from_mot` of the prototype with the slot values set
+
+messages are not built by `__init__` and `setattr` of betterproto, their `__dict__` are copied from
+a prebuilt one with all fields unset, this skips `__post_init__` and the `oneof` bookkeeping of every `setattr`
+"""
+
+_StepMessage = 0
+_StepList = 1
+_StepDict = 2
+
+PtElement = Union[int, tuple[int, int]]
+
+
+class _SlotUnset:
+
+    def __repr__(self):
+        return "SlotUnset"
+
+
+# a slot value that sets a leaf value or a dict key to None, None keeps the prototype value
+SlotUnset = _SlotUnset()
+
+
+def _compile_message_step(cls, items: list[tuple[str, int]]) -> tuple:
+    """ the prebuilt `__dict__`, `oneof` groups and (field, child position) of a message step """
+    descriptor = get_message_descriptor(cls)
+    # fields as left by `__init__`, unset or None for optional fields, and what `setattr` would write
+    base = dict(cls().__dict__)
+    groups = base.pop('_group_current')
+    base['_serialized_on_wire'] = True
+    fields = dict()
+    for attr_name, c in items:
+        group = descriptor.by_name[attr_name].oneof_group
+        if group is not None:
+            # a later `setattr` unsets the other fields of the group
+            if groups[group] is not None:
+                del fields[groups[group]]
+            groups[group] = attr_name
+        fields[attr_name] = c
+    return base, groups, tuple(fields.items())
+
+
+def get_placeholder_elements(pt: nx.DiGraph) -> list[PtElement]:
+    """ editable nodes and edges in the placeholder state """
+    elements = [n for n, d in pt.nodes(data=True) if d['mot_can_edit'] and d['mot_state'] == PT_PLACEHOLDER]
+    elements += [(u, v) for u, v, d in pt.edges(data=True) if d['mot_can_edit'] and d['mot_state'] == PT_PLACEHOLDER]
+    return elements
+
+
+def _parse_bool(value: str) -> bool:
+    v = value.strip().lower()
+    if v in ("true", "t", "yes", "y", "1"):
+        return True
+    elif v in ("false", "f", "no", "n", "0"):
+        return False
+    raise ValueError(f"not a boolean: {value}")
+
+
+def coerce_placeholder_value(value: Any, class_string: str) -> Any:
+    """ convert a table cell to the class of a literal node, strings from csv files are parsed """
+    entry = ClassTable.by_string(class_string)
+    cls = entry.cls
+    if entry.kind == ord_classes.ClassKindEnum:
+        if isinstance(value, str):
+            value = value.strip()
+            if not value.lstrip("-").isdigit():
+                return cls[value]
+        return cls(int(value))
+    assert entry.kind == ord_classes.ClassKindLiteral, f"{class_string} is not a literal class"
+    if isinstance(value, cls):
+        return value
+    if cls == bool:
+        return _parse_bool(value) if isinstance(value, str) else bool(value)
+    if cls == bytes:
+        return value.encode() if isinstance(value, str) else bytes(value)
+    if cls == int:
+        if isinstance(value, str):
+            value = value.strip()
+            if value.lstrip("-").isdigit():
+                return int(value)
+            # "3.0" from spreadsheets
+            value = float(value)
+        # values that are not integral are not truncated
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"not an integer: {value}")
+        return int(value)
+    return cls(value)
+
+
+def resolve_placeholder(pt: nx.DiGraph, key: Union[str, int, tuple], path_index: MotPathIndex = None,
+                        paths: dict[str, int] = None) -> PtElement:
+    """
+    the node or edge a key refers to, a key is
+    - a node id, e.g. "12"
+    - an edge, e.g. "3 12", for dict keys
+    - a node path in any style of `mot_get_path`, e.g. "inputs|<DictKey>m1|components|<ListIndex>0|amount"
+    """
+    if isinstance(key, int) or isinstance(key, tuple):
+        element = key
+    elif key.strip().isdigit():
+        element = int(key)
+    elif len(key.split()) == 2 and all(k.isdigit() for k in key.split()):
+        u, v = key.split()
+        element = (int(u), int(v))
+    else:
+        if paths is None:
+            paths = get_placeholder_paths(pt, path_index)
+        try:
+            element = paths[key]
+        except KeyError:
+            raise KeyError(f"no node has the path: {key}")
+    if isinstance(element, tuple):
+        assert pt.has_edge(*element), f"no such edge: {element}"
+        assert pt.edges[element]['mot_can_edit'], f"edge {element} is not editable"
+    else:
+        assert element in pt, f"no such node: {element}"
+        assert pt.nodes[element]['mot_can_edit'], f"node {element} is not editable"
+    return element
+
+
+def get_placeholder_paths(pt: nx.DiGraph, path_index: MotPathIndex = None) -> dict[str, int]:
+    """ paths of all editable nodes in all delimiter styles """
+    if path_index is None:
+        path_index = MotPathIndex(pt)
+    paths = dict()
+    for n, can_edit in pt.nodes(data='mot_can_edit'):
+        if can_edit:
+            for style in PathDelimiterStyles:
+                paths[path_index.get_path(n, delimiter=style)] = n
+    return paths
+
+
+class PrototypeTemplate:
+    """
+    a prototype compiled by `compile_prototype`, `instantiate` gives a new message for every call
+
+    slots are the nodes (leaf values) and edges (dict keys) that can be set per call,
+    slots that are not set keep the values of the prototype
+    """
+
+    __slots__ = ("slots", "root_class", "_slot_index", "_slot_refs", "_values", "_keys", "_steps", "_root")
+
+    def __init__(self, pt: nx.DiGraph, slots: Iterable[PtElement] = None):
+        if slots is None:
+            slots = get_placeholder_elements(pt)
+        self.slots = [tuple(s) if isinstance(s, list) else s for s in slots]
+        self._slot_index = {s: i for i, s in enumerate(self.slots)}
+
+        assert nx.is_arborescence(pt)
+        root = get_root(pt)
+        self.root_class = ClassTable.by_string(pt.nodes[root]['mot_class_string']).cls
+        position = dict()  # node -> index in `_values`
+        edge_position = dict()  # edge -> index in `_keys`
+        self._values = []
+        self._keys = []
+        self._steps = []
+        for node in nx.dfs_postorder_nodes(pt, source=root):
+            position[node] = len(self._values)
+            children = list(pt.successors(node))
+            if len(children) == 0:
+                self._values.append(pt.nodes[node]['mot_value'])
+                continue
+            # a placeholder for the object built by the step
+            self._values.append(None)
+            entry = ClassTable.by_string(pt.nodes[node]['mot_class_string'])
+            if entry.kind == ord_classes.ClassKindMessage:
+                items = [(pt.edges[(node, c)]['mot_value'], position[c]) for c in children]
+                self._steps.append((_StepMessage, position[node], entry.cls, _compile_message_step(entry.cls, items)))
+            elif entry.kind == ord_classes.ClassKindList:
+                children = sorted(children, key=lambda c: pt.edges[(node, c)]['mot_value'])
+                self._steps.append((_StepList, position[node], list, tuple(position[c] for c in children)))
+            elif entry.kind == ord_classes.ClassKindDict:
+                items = []
+                for c in children:
+                    edge_position[(node, c)] = len(self._keys)
+                    self._keys.append(pt.edges[(node, c)]['mot_value'])
+                    items.append((edge_position[(node, c)], position[c]))
+                self._steps.append((_StepDict, position[node], dict, tuple(items)))
+            else:
+                raise TypeError(f"{entry.cls} can only be leafs!")
+        self._root = position[root]
+
+        self._slot_refs = []  # (is a dict key, index in `_keys` or `_values`)
+        for s in self.slots:
+            if isinstance(s, tuple):
+                assert s in edge_position, f"edge {s} is not a dict key"
+                self._slot_refs.append((True, edge_position[s]))
+            else:
+                assert s in position and pt.out_degree(s) == 0, f"node {s} is not a leaf"
+                self._slot_refs.append((False, position[s]))
+
+    def __contains__(self, slot: PtElement):
+        return slot in self._slot_index
+
+    def instantiate(self, values: Union[Sequence[Any], Mapping[PtElement, Any]] = ()) -> betterproto.Message:
+        """
+        build a new message
+
+        :param values: slot values in the order of `slots`, or a dict of slot -> value,
+            None keeps the prototype value, `SlotUnset` sets it to None
+        """
+        objects = self._values.copy()
+        keys = self._keys.copy()
+        if isinstance(values, Mapping):
+            items = ((self._slot_refs[self._slot_index[s]], v) for s, v in values.items())
+        else:
+            assert len(values) <= len(self._slot_refs)
+            items = zip(self._slot_refs, values)
+        for (is_key, i), v in items:
+            if v is None:
+                continue
+            if v is SlotUnset:
+                v = None
+            if is_key:
+                keys[i] = v
+            else:
+                objects[i] = v
+
+        for step, i, cls, items in self._steps:
+            if step == _StepMessage:
+                base, groups, fields = items
+                o = object.__new__(cls)
+                d = o.__dict__
+                d.update(base)
+                d['_group_current'] = groups.copy()
+                for attr_name, c in fields:
+                    d[attr_name] = objects[c]
+            elif step == _StepList:
+                o = [objects[c] for c in items]
+            else:
+                o = {keys[k]: objects[c] for k, c in items}
+            objects[i] = o
+        return objects[self._root]
+
+
+def compile_prototype(pt: nx.DiGraph, slots: Iterable[PtElement] = None) -> PrototypeTemplate:
+    """ compile a prototype, by default its placeholder nodes and edges are the slots """
+    return PrototypeTemplate(pt, slots)
@@ -0,0 +1,243 @@
+from typing import Iterable, Iterator, NamedTuple, Type, Union
+
+import betterproto
+import numpy as np
+from loguru import logger
+
+import ord_betterproto
+from ord_betterproto.descriptors import get_message_descriptor
+from ord_tree.mtt import get_registered_mtt, get_mtt_node_class
+from ord_tree.utils import NodePathDelimiter, RootNodePath, PrefixListIndex, PrefixDictKey
+
+"""
+convert the units of ORD unit messages (`Volume`, `Mass`, `Temperature`...) in bulk
+
+the unit messages at one mtt path, e.g. "inputs|<DictKey>|components|<ListIndex>|amount|volume",
+are gathered from many messages into arrays, converted in one vectorized step and written back,
+values without units (UNSPECIFIED) or with units that cannot be converted are left as they are
+"""
+
+# unit -> (scale, offset) to the base unit of its enum, value in base unit = value * scale + offset
+UnitConversions: dict[Type[betterproto.Enum], dict[betterproto.Enum, tuple[float, float]]] = {
+    ord_betterproto.TimeUnit: {
+        ord_betterproto.TimeUnit.DAY: (86400.0, 0.0),
+        ord_betterproto.TimeUnit.HOUR: (3600.0, 0.0),
+        ord_betterproto.TimeUnit.MINUTE: (60.0, 0.0),
+        ord_betterproto.TimeUnit.SECOND: (1.0, 0.0),
+    },
+    ord_betterproto.MassUnit: {
+        ord_betterproto.MassUnit.KILOGRAM: (1e3, 0.0),
+        ord_betterproto.MassUnit.GRAM: (1.0, 0.0),
+        ord_betterproto.MassUnit.MILLIGRAM: (1e-3, 0.0),
+        ord_betterproto.MassUnit.MICROGRAM: (1e-6, 0.0),
+    },
+    ord_betterproto.MolesUnit: {
+        ord_betterproto.MolesUnit.MOLE: (1.0, 0.0),
+        ord_betterproto.MolesUnit.MILLIMOLE: (1e-3, 0.0),
+        ord_betterproto.MolesUnit.MICROMOLE: (1e-6, 0.0),
+        ord_betterproto.MolesUnit.NANOMOLE: (1e-9, 0.0),
+    },
+    ord_betterproto.VolumeUnit: {
+        ord_betterproto.VolumeUnit.LITER: (1.0, 0.0),
+        ord_betterproto.VolumeUnit.MILLILITER: (1e-3, 0.0),
+        ord_betterproto.VolumeUnit.MICROLITER: (1e-6, 0.0),
+        ord_betterproto.VolumeUnit.NANOLITER: (1e-9, 0.0),
+    },
+    ord_betterproto.ConcentrationUnit: {
+        ord_betterproto.ConcentrationUnit.MOLAR: (1.0, 0.0),
+        ord_betterproto.ConcentrationUnit.MILLIMOLAR: (1e-3, 0.0),
+        ord_betterproto.ConcentrationUnit.MICROMOLAR: (1e-6, 0.0),
+    },
+    ord_betterproto.PressureUnit: {
+        ord_betterproto.PressureUnit.BAR: (1e5, 0.0),
+        ord_betterproto.PressureUnit.ATMOSPHERE: (101325.0, 0.0),
+        ord_betterproto.PressureUnit.PSI: (6894.757293168, 0.0),
+        ord_betterproto.PressureUnit.KPSI: (6894757.293168, 0.0),
+        ord_betterproto.PressureUnit.PASCAL: (1.0, 0.0),
+        ord_betterproto.PressureUnit.KILOPASCAL: (1e3, 0.0),
+        ord_betterproto.PressureUnit.TORR: (101325.0 / 760.0, 0.0),
+        ord_betterproto.PressureUnit.MM_HG: (133.322387415, 0.0),
+    },
+    ord_betterproto.TemperatureUnit: {
+        ord_betterproto.TemperatureUnit.CELSIUS: (1.0, 0.0),
+        ord_betterproto.TemperatureUnit.FAHRENHEIT: (5.0 / 9.0, -32.0 * 5.0 / 9.0),
+        ord_betterproto.TemperatureUnit.KELVIN: (1.0, -273.15),
+    },
+    ord_betterproto.CurrentUnit: {
+        ord_betterproto.CurrentUnit.AMPERE: (1.0, 0.0),
+        ord_betterproto.CurrentUnit.MILLIAMPERE: (1e-3, 0.0),
+    },
+    ord_betterproto.VoltageUnit: {
+        ord_betterproto.VoltageUnit.VOLT: (1.0, 0.0),
+        ord_betterproto.VoltageUnit.MILLIVOLT: (1e-3, 0.0),
+    },
+    ord_betterproto.LengthUnit: {
+        ord_betterproto.LengthUnit.CENTIMETER: (1e-2, 0.0),
+        ord_betterproto.LengthUnit.MILLIMETER: (1e-3, 0.0),
+        ord_betterproto.LengthUnit.METER: (1.0, 0.0),
+        ord_betterproto.LengthUnit.INCH: (0.0254, 0.0),
+        ord_betterproto.LengthUnit.FOOT: (0.3048, 0.0),
+    },
+    # wavenumbers are not proportional to wavelengths
+    ord_betterproto.WavelengthUnit: {
+        ord_betterproto.WavelengthUnit.NANOMETER: (1.0, 0.0),
+    },
+    ord_betterproto.FlowRateUnit: {
+        ord_betterproto.FlowRateUnit.MICROLITER_PER_MINUTE: (1.0 / 60.0, 0.0),
+        ord_betterproto.FlowRateUnit.MICROLITER_PER_SECOND: (1.0, 0.0),
+        ord_betterproto.FlowRateUnit.MILLILITER_PER_MINUTE: (1e3 / 60.0, 0.0),
+        ord_betterproto.FlowRateUnit.MILLILITER_PER_SECOND: (1e3, 0.0),
+        ord_betterproto.FlowRateUnit.MICROLITER_PER_HOUR: (1.0 / 3600.0, 0.0),
+    },
+}
+
+
+def _get_lookup_tables(unit_class: Type[betterproto.Enum]) -> tuple[np.ndarray, np.ndarray]:
+    """ scales and offsets indexed by enum values, NaN for units that cannot be converted """
+    size = max(int(u) for u in unit_class) + 1
+    scales = np.full(size, np.nan)
+    offsets = np.full(size, np.nan)
+    for u, (scale, offset) in UnitConversions[unit_class].items():
+        scales[int(u)] = scale
+        offsets[int(u)] = offset
+    return scales, offsets
+
+
+_LookupTables = {unit_class: _get_lookup_tables(unit_class) for unit_class in UnitConversions}
+
+
+def get_unit_class(message_class: Type[betterproto.Message]) -> Union[Type[betterproto.Enum], None]:
+    """ the enum of the `units` field if `message_class` is a unit message """
+    descriptor = get_message_descriptor(message_class)
+    units = descriptor.by_name.get("units")
+    if units is None or "value" not in descriptor.by_name or units.child_class not in UnitConversions:
+        return None
+    return units.child_class
+
+
+def get_unit_paths(message_class: Type[betterproto.Message]) -> list[str]:
+    """ mtt paths of all unit messages in `message_class` """
+    mtt = get_registered_mtt(message_class)
+    paths = []
+    for node in mtt.nodes:
+        cls = get_mtt_node_class(mtt, node)
+        if isinstance(cls, type) and issubclass(cls, betterproto.Message) and get_unit_class(cls) is not None:
+            paths.append(node)
+    return paths
+
+
+def _split_mtt_path(mtt_path: str) -> list[str]:
+    relations = mtt_path.split(NodePathDelimiter)
+    if relations and relations[0] == RootNodePath:
+        relations = relations[1:]
+    return relations
+
+
+def _iter_at_path(obj, relations: list[str], i: int = 0) -> Iterator[betterproto.Message]:
+    """ objects at the end of a mtt path, unset fields are not followed (nor set as `getattr` would do) """
+    if i == len(relations):
+        yield obj
+        return
+    relation = relations[i]
+    if relation == PrefixListIndex:
+        children = obj
+    elif relation == PrefixDictKey:
+        children = obj.values()
+    else:
+        child = obj.__dict__[relation]
+        if child is betterproto.PLACEHOLDER or child is None:
+            return
+        children = (child,)
+    for child in children:
+        yield from _iter_at_path(child, relations, i + 1)
+
+
+class UnitLeaves(NamedTuple):
+    messages: list[betterproto.Message]
+    values: np.ndarray  # float64, NaN if not set
+    precisions: np.ndarray  # float64, NaN if not set
+    units: np.ndarray  # int64
+
+
+def _raw_float(message: betterproto.Message, name: str) -> float:
+    v = message.__dict__[name]
+    return np.nan if v is None or v is betterproto.PLACEHOLDER else v
+
+
+def gather_unit_leaves(messages: Iterable[betterproto.Message], mtt_path: str) -> UnitLeaves:
+    """ the unit messages at `mtt_path` of all `messages` and their values, precisions and units as arrays """
+    relations = _split_mtt_path(mtt_path)
+    leaves = [leaf for m in messages for leaf in _iter_at_path(m, relations)]
+    values = np.fromiter((_raw_float(leaf, "value") for leaf in leaves), dtype=np.float64, count=len(leaves))
+    precisions = np.fromiter((_raw_float(leaf, "precision") for leaf in leaves), dtype=np.float64, count=len(leaves))
+    units = np.fromiter(
+        (0 if leaf.__dict__["units"] is betterproto.PLACEHOLDER else int(leaf.__dict__["units"]) for leaf in leaves),
+        dtype=np.int64, count=len(leaves)
+    )
+    return UnitLeaves(leaves, values, precisions, units)
+
+
+def convert_units(values: np.ndarray, units: np.ndarray, unit_class: Type[betterproto.Enum], to_unit: betterproto.Enum,
+                  precisions: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    convert values (and precisions) of `units` to `to_unit`
+
+    :return: converted values, converted precisions (None if not given), mask of the values that are converted
+    """
+    scales, offsets = _LookupTables[unit_class]
+    assert not np.isnan(scales[int(to_unit)]), f"cannot convert to {to_unit}"
+    units = np.asarray(units)
+    in_table = (units >= 0) & (units < len(scales))
+    safe_units = np.where(in_table, units, 0)
+    scale = np.where(in_table, scales[safe_units], np.nan) / scales[int(to_unit)]
+    offset = (np.where(in_table, offsets[safe_units], np.nan) - offsets[int(to_unit)]) / scales[int(to_unit)]
+    converted = ~np.isnan(scale) & ~np.isnan(values)
+    new_values = np.where(converted, values * scale + offset, values)
+    new_precisions = None
+    if precisions is not None:
+        # a precision is a difference of values, offsets do not apply
+        new_precisions = np.where(converted, precisions * scale, precisions)
+    return new_values, new_precisions, converted
+
+
+def scatter_unit_leaves(leaves: UnitLeaves, values: np.ndarray, precisions: np.ndarray, units: np.ndarray,
+                        mask: np.ndarray = None):
+    """ write values, precisions (NaN is not set) and units back to the unit messages, only where `mask` is True """
+    if not leaves.messages:
+        return
+    unit_class = get_unit_class(type(leaves.messages[0]))
+    indices = range(len(leaves.messages)) if mask is None else np.flatnonzero(mask).tolist()
+    values, precisions, units = values.tolist(), precisions.tolist(), units.tolist()
+    for i in indices:
+        m = leaves.messages[i]
+        m.value = values[i]
+        if precisions[i] == precisions[i]:
+            m.precision = precisions[i]
+        m.units = unit_class(units[i])
+
+
+def normalize_units(messages: Iterable[betterproto.Message], mtt_path: str, to_unit: betterproto.Enum = None,
+                    message_class: Type[betterproto.Message] = ord_betterproto.Reaction) -> int:
+    """
+    convert the unit messages at `mtt_path` of all `messages` to `to_unit` inplace, return the number converted
+
+    :param mtt_path: a node of the mtt of `message_class`, with or without the root
+    :param to_unit: defaults to the base unit in `UnitConversions`, e.g. LITER for volumes
+    """
+    mtt = get_registered_mtt(message_class)
+    relations = _split_mtt_path(mtt_path)
+    node = NodePathDelimiter.join([RootNodePath, *relations])
+    assert node in mtt, f"{node} is not in the mtt of {message_class.__name__}"
+    unit_class = get_unit_class(get_mtt_node_class(mtt, node))
+    assert unit_class is not None, f"{node} is not a unit message"
+    if to_unit is None:
+        to_unit = next(u for u, (scale, offset) in UnitConversions[unit_class].items() if scale == 1 and offset == 0)
+    to_unit = unit_class(to_unit)
+
+    leaves = gather_unit_leaves(messages, node)
+    values, precisions, converted = convert_units(leaves.values, leaves.units, unit_class, to_unit, leaves.precisions)
+    units = np.where(converted, int(to_unit), leaves.units)
+    scatter_unit_leaves(leaves, values, precisions, units, mask=converted)
+    n_converted = int(converted.sum())
+    logger.info(f"converted {n_converted} of {len(leaves.messages)} {unit_class.__name__} at {node} to {to_unit.name}")
+    return n_converted
@@ -35,7 +35,8 @@ def write_file(s: str, fn: FilePath):
         f.write(s)
 
 
-def get_path(tree: nx.DiGraph, node, edge_attr_name: str, root_path: str = RootNodePath):
+def get_path(tree: nx.DiGraph, node, edge_attr_name: str, root_path: str = RootNodePath,
+             path_index: "TreePathIndex" = None):
     """
     get a string representation of the path from root to node
 
@@ -43,8 +44,11 @@ def get_path(tree: nx.DiGraph, node, edge_attr_name: str, root_path: str = RootN
     :param node:
     :param edge_attr_name:
     :param root_path:
+    :param path_index: if given, the path is looked up from this index built for `tree`
     :return:
     """
+    if path_index is not None:
+        return path_index.get_path(node)
     root = get_root(tree)
     p = nx.shortest_path(tree, source=root, target=node)
     if len(p) == 1:
@@ -58,6 +62,60 @@ def get_path(tree: nx.DiGraph, node, edge_attr_name: str, root_path: str = RootN
     return NodePathDelimiter.join(str_path)
 
 
+class TreePathIndex:
+    """
+    parent pointers and cached root-to-node paths of an arborescence, paths are the same as `get_path`
+
+    the index does not observe the tree, after the tree is changed
+    `index_subtree`, `forget` or `reroot` should be called to keep it up to date
+    """
+
+    def __init__(self, tree: nx.DiGraph, edge_attr_name: str, root_path: str = RootNodePath):
+        self.edge_attr_name = edge_attr_name
+        self.root_path = root_path
+        self.root = None
+        self.parent = dict()
+        self.paths = dict()
+        self.reroot(tree, get_root(tree))
+
+    def _index_node(self, tree: nx.DiGraph, node, parent):
+        self.parent[node] = parent
+        if parent is None:
+            self.paths[node] = self.root_path
+            return
+        str_p = str(tree.edges[(parent, node)][self.edge_attr_name])
+        if parent == self.root:
+            self.paths[node] = str_p
+        else:
+            self.paths[node] = self.paths[parent] + NodePathDelimiter + str_p
+
+    def index_subtree(self, tree: nx.DiGraph, node):
+        """ (re)index a node and its descendants, the parent of the node should have been indexed """
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if n == self.root:
+                parent = None
+            else:
+                parent = next(tree.predecessors(n))
+            self._index_node(tree, n, parent)
+            stack.extend(tree.successors(n))
+
+    def forget(self, nodes):
+        for n in nodes:
+            self.parent.pop(n, None)
+            self.paths.pop(n, None)
+
+    def reroot(self, tree: nx.DiGraph, root):
+        self.root = root
+        self.parent.clear()
+        self.paths.clear()
+        self.index_subtree(tree, root)
+
+    def get_path(self, node):
+        return self.paths[node]
+
+
 def get_root(tree: nx.DiGraph):
     return [n for n, d in tree.in_degree() if d == 0][0]
 
@@ -67,7 +125,8 @@ def get_leafs(tree: nx.DiGraph, sort=True):
     leafs = [n for n in tree.nodes if tree.out_degree(n) == 0]
     if sort:
         root_node = get_root(tree)
-        leafs = sorted(leafs, key=lambda x: len(nx.shortest_path(tree, root_node, x)), reverse=True)
+        depth = nx.shortest_path_length(tree, root_node)
+        leafs = sorted(leafs, key=lambda x: depth[x], reverse=True)
     return leafs
 
 
@@ -157,13 +216,7 @@ def get_type_hints_without_private(obj):
 
 def get_tree_depth(tree: nx.DiGraph):
     r = get_root(tree)
-    deep = 0
-    for n in tree.nodes:
-        p = nx.shortest_path(tree, source=r, target=n)
-        d = len(p) - 1
-        if d > deep:
-            deep = d
-    return deep
+    return max(nx.shortest_path_length(tree, source=r).values())
 
 
 def enum_class_to_options(enum_class):
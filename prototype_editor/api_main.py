@@ -10,8 +10,15 @@ from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response, JSONResponse
 
-from api_models import OrdPrototypeModel, UpdateOrdPrototypeModel
+import json
+
+import networkx as nx
+
+from api_models import OrdPrototypeModel, UpdateOrdPrototypeModel, PrototypeOperationsModel
+from dash_app_support.cyto_elements import BytesDump
 from dash_app_support.db import ENV_MONGO_DB, ENV_MONGO_COLLECTION
+from ord_tree.mot import pt_to_dict
+from ord_tree.pt_batch import PtOperation, PtOpGraft, PtOps, pt_apply_operations
 
 app = FastAPI(
     title="ORD Prototype API",
@@ -239,6 +246,41 @@ async def update_prototype(id: str, prototype: UpdateOrdPrototypeModel = Body(..
     raise HTTPException(status_code=404, detail=f"Prototype {id} not found")
 
 
+@app.post("/prototype/{id}/operations", response_description="Apply operations to a prototype",
+          response_model=OrdPrototypeModel)
+async def apply_prototype_operations(id: str, operations: PrototypeOperationsModel = Body(...)):
+    if (pt_doc := await db[ENV_MONGO_COLLECTION].find_one({"_id": ObjectId(id)})) is None:
+        raise HTTPException(status_code=404, detail=f"Prototype {id} not found")
+    pt = nx.node_link_graph(pt_doc['node_link_data'], directed=True)
+
+    pt_operations = []
+    for operation in operations.operations:
+        if operation.op not in PtOps:
+            raise HTTPException(status_code=422, detail=f"Unknown operation {operation.op}")
+        value = operation.value
+        if operation.op == PtOpGraft:
+            # `ObjectId(None)` would be a new id
+            if operation.prototype_id is None or not ObjectId.is_valid(operation.prototype_id):
+                raise HTTPException(status_code=422,
+                                    detail=f"Graft needs a valid prototype_id, not {operation.prototype_id!r}")
+            other_doc = await db[ENV_MONGO_COLLECTION].find_one({"_id": ObjectId(operation.prototype_id)})
+            if other_doc is None:
+                raise HTTPException(status_code=404, detail=f"Prototype {operation.prototype_id} not found")
+            value = nx.node_link_graph(other_doc['node_link_data'], directed=True)
+        pt_operations.append(PtOperation(operation.op, operation.target, value))
+
+    try:
+        pt_apply_operations(pt, pt_operations, inplace=True)
+    except (AssertionError, KeyError, StopIteration, ValueError, nx.NetworkXError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid operations: {e!r}")
+
+    node_link_data = json.loads(json.dumps(pt_to_dict(pt), cls=BytesDump))
+    await db[ENV_MONGO_COLLECTION].update_one(
+        {"_id": ObjectId(id)}, {"$set": {"node_link_data": node_link_data, "time_modified": datetime.now()}}
+    )
+    return await db[ENV_MONGO_COLLECTION].find_one({"_id": ObjectId(id)})
+
+
 @app.delete("/prototype/{id}", response_description="Delete a prototype")
 async def delete_prototype(id: str):
     delete_result = await db[ENV_MONGO_COLLECTION].delete_one({"_id": ObjectId(id)})
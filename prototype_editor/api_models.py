@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import json
 from datetime import datetime
-from typing import Optional
+from typing import Any, List, Optional, Union
 
 from bson import ObjectId
 from pydantic import BaseModel, Field
@@ -85,3 +85,32 @@ class UpdateOrdPrototypeModel(BaseModel):
             }
         }
 
+
+
+class PrototypeOperationModel(BaseModel):
+    # one of `ord_tree.PtOps`
+    op: str = Field(...)
+
+    # a node id, or an edge [u, v] for "set_value" and "set_state"
+    target: Union[int, List[int]] = Field(...)
+
+    # the value for "set_value", the state for "set_state"
+    value: Any = Field(None)
+
+    # the prototype to graft for "graft"
+    prototype_id: Optional[str] = Field(None)
+
+
+class PrototypeOperationsModel(BaseModel):
+    operations: List[PrototypeOperationModel] = Field(...)
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "operations": [
+                    {"op": "extend", "target": 220},
+                    {"op": "set_value", "target": 222, "value": "2 x 50 mL DCM extraction"},
+                    {"op": "set_state", "target": 223, "value": "PT_PRESET"},
+                ]
+            }
+        }
@@ -1,56 +1,128 @@
-// const placeholder_class = "CYTO_PLACEHOLDER_CLASS";
-// const preset_class = "CYTO_PRESET_CLASS";
-// const literal_node_class = "CYTO_LITERAL_NODE_CLASS";
-// const edge_can_edit_class = "CYTO_MESSAGE_EDGE_CAN_EDIT_CLASS";
-//
-// window.dash_clientside = Object.assign({}, window.dash_clientside, {
-//     clientside_client: {
-//         cy_mot_editor: function (is_placeholder, value_value, state_id, value_id) {
-//             // let state_dict = JSON.stringify(state_id[0], Object.keys(state_id[0]).sort())
-//             // let value_dict = JSON.stringify(value_id[0], Object.keys(value_id[0]).sort())
-//             if (state_id.length === 0) {
-//                 return
-//             }
-//             let state_dict = state_id[0]
-//             let element_id = '' + state_dict['index']
-//             let element = window.cy.elements(`[ id="${element_id}" ]`)
-//             // let ele = element[0]
-//             let new_attrs = {...element.data('ele_attrs')}
-//             let state_value = "PT_PRESET"
-//             if (is_placeholder[0] === true){
-//                 state_value = "PT_PLACEHOLDER"
-//             }
-//             new_attrs['mot_state'] = state_value
-//             new_attrs['mot_value'] = value_value[0]
-//             element.data('ele_attrs', new_attrs)
-//
-//             let can_edit = element.hasClass(literal_node_class) || element.hasClass(edge_can_edit_class)
-//
-//             if (state_value === 'PT_PLACEHOLDER') {
-//                 element.removeClass(preset_class)
-//                 element.addClass(placeholder_class)
-//                 if (!can_edit){
-//                     let successors0 = element.successors()
-//                     let successors = successors0.difference(element)
-//                     successors.remove()
-//                 }
-//             } else {
-//                 if (can_edit){
-//                     element.addClass(preset_class)
-//                     element.removeClass(placeholder_class)
-//                 }
-//                 else {
-//                     element.removeClass(preset_class)
-//                     element.removeClass(placeholder_class)
-//                 }
-//                 // let remove_both_state_classes = true
-//                 // let literals = ['builtins.str', 'builtins.float', 'builtins.int', 'builtins.bytes']
-//                 // if (class_string.startsWith('builtins.')){
-//                 //     if (class_string !== 'builtins.list' || class_string !== 'builtins.dict') or
-//                 // }
-//
-//                 // if new_attrs['mot_class_string']
-//             }
-//         }
-//     }
-// });
+// state and value edits are made here, the server gets them with its next callback, see `MotSession.apply_edits`
+const pt_placeholder = "PT_PLACEHOLDER";
+const pt_preset = "PT_PRESET";
+const pt_op_set_state = "set_state";
+const pt_op_set_value = "set_value";
+const cid_input_pt_element_state = "CID_MOT_INPUT_PT_ELEMENT_STATE";
+const cid_store_editor_edit_seq = "MOT_STORE_EDITOR_EDIT_SEQ";
+const cyto_placeholder_class = "CYTO_PLACEHOLDER_CLASS";
+const cyto_preset_class = "CYTO_PRESET_CLASS";
+const cyto_literal_node_class = "CYTO_LITERAL_NODE_CLASS";
+const cyto_edge_can_edit_class = "CYTO_MESSAGE_EDGE_CAN_EDIT_CLASS";
+
+// the pending edits without the ones applied by the server, the sequence number keeps counting
+function drop_applied_edits(pending, applied_seq) {
+    if (!pending) {
+        return {seq: 0, edits: {}}
+    }
+    let edits = {}
+    for (let key in pending.edits) {
+        if (pending.edits[key].seq > applied_seq) {
+            edits[key] = pending.edits[key]
+        }
+    }
+    return {seq: pending.seq, edits: edits}
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    clientside_client: {
+        // set the state or the value of an element, record the edit in the pending edits,
+        // a non-literal node set to placeholder loses its successors, that is done by the server
+        cy_edit_element: function (state_values, value_values, editor_edit_seq, state_ids, value_ids, pending,
+                                   edit_seq) {
+            let no_update = window.dash_clientside.no_update
+            let triggered = window.dash_clientside.callback_context.triggered
+            if (!triggered || triggered.length !== 1) {
+                return [no_update, no_update]
+            }
+            let prop_id = triggered[0].prop_id
+            let applied_seq = Math.max(editor_edit_seq || 0, edit_seq || 0)
+            if (prop_id.startsWith(cid_store_editor_edit_seq + '.')) {
+                return [drop_applied_edits(pending, applied_seq), no_update]
+            }
+            let cid = JSON.parse(prop_id.substring(0, prop_id.lastIndexOf('.')))
+            let is_state = cid.type === cid_input_pt_element_state
+            let ids = is_state ? state_ids : value_ids
+            let i = ids.findIndex(id => id.index === cid.index)
+            let element_id = '' + cid.index
+            let ele = window.cy.getElementById(element_id)
+            if (i < 0 || ele.empty()) {
+                return [no_update, no_update]
+            }
+
+            let attrs = ele.data('ele_attrs')
+            let op = pt_op_set_value
+            let value = value_values[i]
+            if (is_state) {
+                op = pt_op_set_state
+                value = state_values[i] ? pt_placeholder : pt_preset
+            }
+            // inputs also fire when they are rendered
+            if ((is_state && attrs['mot_state'] === value) || (!is_state && attrs['mot_value'] === value)) {
+                return [no_update, no_update]
+            }
+
+            pending = drop_applied_edits(pending, applied_seq)
+            pending.seq += 1
+            // only the latest edit of an attribute is kept
+            pending.edits[op + ' ' + element_id] = {seq: pending.seq, op: op, target: element_id, value: value}
+
+            let can_edit = ele.hasClass(cyto_literal_node_class) || ele.hasClass(cyto_edge_can_edit_class)
+            if (is_state && value === pt_placeholder && !can_edit) {
+                return [pending, pending.seq]
+            }
+
+            let new_attrs = {...attrs}
+            if (is_state) {
+                new_attrs['mot_state'] = value
+                if (value === pt_placeholder) {
+                    ele.removeClass(cyto_preset_class)
+                    ele.addClass(cyto_placeholder_class)
+                } else {
+                    ele.removeClass(cyto_placeholder_class)
+                    // non-literal is by default preset
+                    if (can_edit) {
+                        ele.addClass(cyto_preset_class)
+                    }
+                }
+            } else {
+                new_attrs['mot_value'] = value
+            }
+            ele.data('ele_attrs', new_attrs)
+            return [pending, no_update]
+        },
+
+        // apply a patch from `update_cyto_elements` to the graph, only the changed elements are sent
+        cy_apply_patch: function (patch) {
+            if (!patch) {
+                return
+            }
+            let cy = window.cy
+            cy.batch(function () {
+                if (patch.reset) {
+                    cy.elements().remove()
+                    cy.add(patch.reset)
+                }
+                for (let i = 0, len = patch.remove.length; i < len; i++) {
+                    cy.getElementById(patch.remove[i]).remove()
+                }
+                cy.add(patch.add)
+                for (let i = 0, len = patch.update.length; i < len; i++) {
+                    let e = patch.update[i]
+                    let ele = cy.getElementById(e.data.id)
+                    ele.data(e.data)
+                    ele.classes(e.classes)
+                }
+                // positions from the server layout, of the nodes that moved
+                for (let id in patch.positions) {
+                    let [x, y] = patch.positions[id]
+                    cy.getElementById(id).position({x: x, y: y})
+                }
+            })
+            window.dash_clientside.clientside_viewport.cy_derive_relations()
+            if (patch.center) {
+                window.dash_clientside.clientside_viewport.cy_center_selected()
+            }
+        },
+    }
+});
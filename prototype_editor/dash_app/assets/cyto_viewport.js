@@ -6,12 +6,6 @@ const mtt_layout = {
     align: 'UL',
 };
 
-const mot_layout = {
-    name: 'dagre',
-    nodeDimensionsIncludeLabels: true,
-    align: 'UL',
-};
-
 const hide_class = "CYTO_MESSAGE_NODE_TMP_HIDE";
 
 window.dash_clientside = Object.assign({}, window.dash_clientside, {
@@ -34,15 +28,6 @@ window.dash_clientside = Object.assign({}, window.dash_clientside, {
             window.cy.layout(mtt_layout).run()
         },
 
-        // run layout
-        cy_run_mot_layout: function (n_clicks) {
-            let current_zoom = window.cy.zoom()
-            let current_pan = {...window.cy.pan()}
-            window.cy.layout(mot_layout).run()
-            window.cy.zoom(current_zoom)
-            window.cy.pan(current_pan)
-        },
-
         // select element by data id
         cy_select_element_by_id: function (data_id) {
             if (data_id) {
@@ -3,7 +3,8 @@ import json
 from collections import defaultdict
 from copy import deepcopy
 from datetime import datetime
-from typing import Union
+from typing import Optional, Union
+from uuid import uuid4
 
 import dash_bootstrap_components as dbc
 import dash_cytoscape as cyto
@@ -13,17 +14,21 @@ import networkx as nx
 from bson.json_util import ObjectId
 from dash import html, Input, Output, State, dcc, ctx, ALL, no_update, get_asset_url, MATCH, register_page, get_app, \
     ClientsideFunction
+from loguru import logger
 from pymongo import MongoClient
 
 from dash_app_support.components import simple_open, PCI_MOT, get_cards_from_selected_nodes, \
     get_cards_from_selected_edges, JsonTheme
 from dash_app_support.db import ENV_MONGO_COLLECTION,ENV_MONGO_DB,ENV_MONGO_URI
-from dash_app_support.cyto_config import CYTO_STYLE_SHEET_MOT, CYTO_PLACEHOLDER_CLASS, CYTO_PRESET_CLASS
-from dash_app_support.cyto_elements import cyto_to_mot, mot_to_cyto_element_list, BytesDump
-from ord_tree.mot import get_mot, pt_extend_node, pt_detach_node, pt_remove_node, mot_get_path, pt_to_dict, \
-    PT_PLACEHOLDER, PT_PRESET
-from ord_tree.ord_classes import BuiltinLiteralClasses, OrdEnumClasses
-from ord_tree.utils import get_root, import_string
+from dash_app_support.cyto_config import CYTO_STYLE_SHEET_MOT
+from dash_app_support.cyto_elements import mot_to_cyto_element_list, mot_delta_to_cyto_patch, BytesDump
+from dash_app_support.mot_store import MotSession, MotSessionStore
+from ord_tree.layout import MotLayoutCache, dump_positions, load_positions, place_new_nodes, LayoutDriftThreshold, \
+    MotPositions, get_structure_hash
+from ord_tree.mot import pt_extend_node, pt_detach_node, pt_remove_node, mot_get_path, pt_to_dict, \
+    MotPathIndex, pt_graft_subtree
+from ord_tree.history import MotDelta
+from ord_tree.utils import get_root
 
 """
 1. use server side callback to edit element attributes
@@ -38,12 +43,26 @@ cyto.load_extra_layouts()
 MONGO_DB = MongoClient(ENV_MONGO_URI)[ENV_MONGO_DB]
 COLLECTION = ENV_MONGO_COLLECTION
 
+# MOTs and undo/redo histories of editor sessions
+MOT_SESSION_MAX_SESSIONS = 64
+MOT_SESSION_TTL = 2 * 3600
+MOT_SESSIONS = MotSessionStore(max_sessions=MOT_SESSION_MAX_SESSIONS, ttl=MOT_SESSION_TTL)
+# node positions by the structure of MOTs
+MOT_LAYOUTS = MotLayoutCache()
+
 
 def get_init_doc(pid):
     mot_data = MONGO_DB[COLLECTION].find_one({"_id": ObjectId(pid)})
     return mot_data
 
 
+def get_session(session_id: str, prototype_id: str) -> MotSession:
+    """ the session of a page, reloaded from the database if it was dropped from the store """
+    return MOT_SESSIONS.get(
+        session_id, prototype_id, loader=lambda: nx.node_link_graph(get_init_doc(prototype_id)['node_link_data'])
+    )
+
+
 def log_string(s):
     return f"{datetime.now()}:\n{s}\n\n"
 
@@ -51,10 +70,9 @@ def log_string(s):
 # TODO validate prototype (all leafs literal, no oneof conflict)
 # TODO pop over for loading prototypes
 
+# positions are computed on the server, see `MOT_LAYOUTS`
 MOT_CYTO_LAYOUT_OPTIONS = {
-    'name': 'dagre',
-    'nodeDimensionsIncludeLabels': True,
-    'align': 'UL',
+    'name': 'preset',
 }
 
 # define components
@@ -79,8 +97,14 @@ cs_dummies = [
 def layout(prototype_id=None):
     init_doc = get_init_doc(prototype_id)
     init_mot = nx.node_link_graph(init_doc['node_link_data'])
-    init_elements = mot_to_cyto_element_list(init_mot)
-    init_metadata = {k: v for k, v in init_doc.items() if k not in ('node_link_data', '_id')}
+    if init_doc.get('layout'):
+        # positions saved with the prototype, used if the structure is the same
+        MOT_LAYOUTS.put(init_doc['layout']['structure_hash'], load_positions(init_doc['layout']['positions']))
+    _, positions = MOT_LAYOUTS.get(init_mot)
+    init_elements = mot_to_cyto_element_list(init_mot, positions)
+    session_id = str(uuid4())
+    MOT_SESSIONS.open(session_id, prototype_id, init_mot).positions = positions
+    init_metadata = {k: v for k, v in init_doc.items() if k not in ('node_link_data', '_id', 'layout')}
 
     component_cyto_mot = cyto.Cytoscape(
         id=PCI_MOT.MOT_CYTO,
@@ -99,12 +123,14 @@ def layout(prototype_id=None):
             *cs_dummies,
             dji.Import(src=get_asset_url("defer_cyto.js")),
             dcc.Store(id=PCI_MOT.MOT_STORE_UPDATE_ELEMENTS),
+            dcc.Store(id=PCI_MOT.MOT_STORE_SESSION_ID, data=session_id),
+            dcc.Store(id=PCI_MOT.MOT_STORE_PROTOTYPE_ID, data=prototype_id),
+            dcc.Store(id=PCI_MOT.MOT_STORE_MOT_VERSION, data=0),
+            dcc.Store(id=PCI_MOT.MOT_STORE_PENDING_EDITS),
+            dcc.Store(id=PCI_MOT.MOT_STORE_PRUNE_REQUEST),
+            dcc.Store(id=PCI_MOT.MOT_STORE_EDIT_SEQ, data=0),
+            dcc.Store(id=PCI_MOT.MOT_STORE_EDITOR_EDIT_SEQ, data=0),
             dcc.Store(id=PCI_MOT.MOT_STORE_INIT_PROTOTYPE_DOC, data=init_metadata),
-            dcc.Store(id=PCI_MOT.MOT_STORE_PROTOTYPE_DOC),
-            dcc.Store(id=PCI_MOT.MOT_STORE_EDITABLE_NODES, data=[]),
-            dcc.Store(id=PCI_MOT.MOT_STORE_EDITABLE_EDGES, data=[]),
-            dcc.Store(id=PCI_MOT.MOT_STORE_ALL_NODES, data=[]),
-            dcc.Store(id=PCI_MOT.MOT_STORE_ALL_EDGES, data=[]),
             dcc.Download(id=PCI_MOT.MOT_DOWNLOAD),
             dbc.Row(
                 [
@@ -129,6 +155,10 @@ def layout(prototype_id=None):
                                                n_clicks=0),
                                     dbc.Button("Center Selected", id=PCI_MOT.MOT_BTN_CYTO_CENTER_SELECTED,
                                                class_name="mx-1 mt-3", n_clicks=0),
+                                    dbc.Button("Undo", id=PCI_MOT.MOT_BTN_UNDO, class_name="mx-1 mt-3",
+                                               color="secondary", n_clicks=0),
+                                    dbc.Button("Redo", id=PCI_MOT.MOT_BTN_REDO, class_name="mx-1 mt-3",
+                                               color="secondary", n_clicks=0),
                                 ],
                                 className="text-center"
                             ),
@@ -353,13 +383,15 @@ for toggle_triples in [
     Output({'type': PCI_MOT.MOT_LIST_GROUP_PT_UNION, 'index': MATCH}, 'children'),
     Input({'type': PCI_MOT.MOT_MODAL_UNION, 'index': MATCH}, 'is_open'),
     State({'type': PCI_MOT.MOT_MODAL_UNION, 'index': MATCH}, 'id'),
-    State(PCI_MOT.MOT_CYTO, 'elements'),
+    State(PCI_MOT.MOT_STORE_SESSION_ID, 'data'),
+    State(PCI_MOT.MOT_STORE_PROTOTYPE_ID, 'data'),
 )
-def render_union_list(is_open, node_cid, elements):
-    mot = cyto_to_mot(elements)
-    node_id = node_cid['index']
-    message_type = mot.nodes[node_id]['mot_class_string']
+def render_union_list(is_open, node_cid, session_id, prototype_id):
     if is_open:
+        session = get_session(session_id, prototype_id)
+        node_id = node_cid['index']
+        with session.lock:
+            message_type = session.mot.nodes[node_id]['mot_class_string']
         cursor = MONGO_DB[COLLECTION].find({'root_message_type': message_type}, {'_id': 1, "root_message_type": 1})
         docs = list(cursor)
         if len(docs) == 0:
@@ -391,81 +423,57 @@ def render_union_list(is_open, node_cid, elements):
     return no_update
 
 
-@app.callback(
-    Output(PCI_MOT.MOT_STORE_ALL_NODES, 'data'),
-    Output(PCI_MOT.MOT_STORE_ALL_EDGES, 'data'),
-    Output(PCI_MOT.MOT_STORE_EDITABLE_NODES, 'data'),
-    Output(PCI_MOT.MOT_STORE_EDITABLE_EDGES, 'data'),
-    Input(PCI_MOT.MOT_CYTO, 'elements'),
-)
-def update_intermediate_elements(elements: list[dict]):
-    nodes = []
-    edges = []
-    editable_nodes = []
-    editable_edges = []
-    for e in elements:
-        if e['group'] == 'nodes':
-            nodes.append(e)
-            if e['data']['ele_attrs']['mot_can_edit']:
-                editable_nodes.append(e)
-        else:
-            edges.append(e)
-            if e['data']['ele_attrs']['mot_can_edit']:
-                editable_edges.append(e)
-    return nodes, edges, editable_nodes, editable_edges
-
-
 @app.callback(
     Output(PCI_MOT.MOT_DROPDOWN_NAV_SELECTOR_1, 'options'),
     Output(PCI_MOT.MOT_DROPDOWN_NAV_SELECTOR_2, 'options'),
-    Input(PCI_MOT.MOT_STORE_ALL_NODES, 'data'),
-    Input(PCI_MOT.MOT_STORE_ALL_EDGES, 'data'),
+    Input(PCI_MOT.MOT_STORE_MOT_VERSION, 'data'),
     Input(PCI_MOT.MOT_DROPDOWN_NAV_SELECTOR_0, 'value'),
     Input(PCI_MOT.MOT_DROPDOWN_NAV_SELECTOR_1, 'value'),
+    State(PCI_MOT.MOT_STORE_SESSION_ID, 'data'),
+    State(PCI_MOT.MOT_STORE_PROTOTYPE_ID, 'data'),
 )
 def update_navigator_selector_options(
-        nodes, edges, element_group, element_class,
+        mot_version, element_group, element_class, session_id, prototype_id,
 ):
-    mot = cyto_to_mot(nodes + edges)
-    class_to_nx_ids = defaultdict(set)
-    if element_group == 'node':
-        for e in nodes:
-            # TODO nav can find hidden elements, the following does not fix it as hiding does not update elements
-            # if CYTO_MESSAGE_NODE_TMP_HIDE in e['classes']:
-            #     continue
-            node_id = int(e['data']['id'])
-            class_string = mot.nodes[node_id]['mot_class_string']
-            label = class_string.split(".")[-1]
-            class_to_nx_ids[label].add(node_id)
-    else:
-        for e in edges:
-            u_id = int(e['data']['source'])
-            v_id = int(e['data']['target'])
-            u_class_string = mot.nodes[u_id]['mot_class_string']
-            u_label = u_class_string.split(".")[-1]
-            v_class_string = mot.nodes[v_id]['mot_class_string']
-            v_label = v_class_string.split(".")[-1]
-            label = f"{u_label} || {v_label}"
-            class_to_nx_ids[label].add((u_id, v_id))
-
-    options_1 = sorted(class_to_nx_ids.keys())
-    options_2 = []
-
-    if not element_class:
-        return options_1, options_2
-    else:
-        nx_ids = class_to_nx_ids[element_class]
-        for i in nx_ids:
-            if isinstance(i, int):
-                label = mot_get_path(mot, i, delimiter='arrow')
-                value = str(i)
-            else:
-                u, v = i
-                label_v = mot_get_path(mot, v, delimiter='arrow')
-                label = label_v
-                value = f"{u} {v}"
-            options_2.append({"label": label, "value": value})
-        return options_1, options_2
+    session = get_session(session_id, prototype_id)
+    with session.lock:
+        mot = session.mot
+        class_to_nx_ids = defaultdict(set)
+        if element_group == 'node':
+            for node_id, class_string in mot.nodes(data='mot_class_string'):
+                # TODO nav can find hidden elements, the following does not fix it as hiding does not update elements
+                # if CYTO_MESSAGE_NODE_TMP_HIDE in e['classes']:
+                #     continue
+                label = class_string.split(".")[-1]
+                class_to_nx_ids[label].add(node_id)
+        else:
+            for u_id, v_id in mot.edges:
+                u_class_string = mot.nodes[u_id]['mot_class_string']
+                u_label = u_class_string.split(".")[-1]
+                v_class_string = mot.nodes[v_id]['mot_class_string']
+                v_label = v_class_string.split(".")[-1]
+                label = f"{u_label} || {v_label}"
+                class_to_nx_ids[label].add((u_id, v_id))
+
+        options_1 = sorted(class_to_nx_ids.keys())
+        options_2 = []
+
+        if not element_class:
+            return options_1, options_2
+        else:
+            nx_ids = class_to_nx_ids[element_class]
+            path_index = MotPathIndex(mot)
+            for i in nx_ids:
+                if isinstance(i, int):
+                    label = mot_get_path(mot, i, delimiter='arrow', path_index=path_index)
+                    value = str(i)
+                else:
+                    u, v = i
+                    label_v = mot_get_path(mot, v, delimiter='arrow', path_index=path_index)
+                    label = label_v
+                    value = f"{u} {v}"
+                options_2.append({"label": label, "value": value})
+            return options_1, options_2
 
 
 @app.callback(
@@ -500,21 +508,18 @@ def save_validation(iv1, iv2):
     return True, True
 
 
-@app.callback(
-    Output(PCI_MOT.MOT_STORE_PROTOTYPE_DOC, 'data'),
-    Input(PCI_MOT.MOT_CYTO, 'elements'),
-    Input(PCI_MOT.MOT_SAVE_NAME_INPUT, 'value'),
-    Input(PCI_MOT.MOT_SAVE_VERSION_INPUT, 'value'),
-    Input(PCI_MOT.MOT_SAVE_VERSION_INHERIT, 'value'),
-    State(PCI_MOT.MOT_STORE_INIT_PROTOTYPE_DOC, 'data'),
-)
-def update_current_prototype_document(elements, name, version, inherit, init_data):
-    mot = cyto_to_mot(elements)
+def get_prototype_document(mot: nx.DiGraph, name, version, inherit, init_data, positions: MotPositions = None) -> dict:
+    """ the document of a prototype to be saved, with `positions` as its layout or the layout by `MOT_LAYOUTS` """
     d = json.loads(json.dumps(pt_to_dict(mot), cls=BytesDump))
+    if positions is None:
+        structure_hash, positions = MOT_LAYOUTS.get(mot)
+    else:
+        structure_hash = get_structure_hash(mot)
     doc = {
         'name': name,
         'version': version,
         'node_link_data': d,
+        'layout': {'structure_hash': structure_hash, 'positions': dump_positions(positions)},
         'root_message_type': mot.nodes[get_root(mot)]['mot_class_string'],
         'time_modified': datetime.now(),
         'time_created': datetime.now(),
@@ -526,34 +531,57 @@ def update_current_prototype_document(elements, name, version, inherit, init_dat
     return doc
 
 
+def get_session_document(session_id, prototype_id, pending_edits, name, version, inherit, init_data) -> dict:
+    session = get_session(session_id, prototype_id)
+    with session.lock:
+        session.apply_edits(pending_edits)
+        # the positions shown in the editor, including placed nodes
+        return get_prototype_document(session.mot, name, version, inherit, init_data, session.positions)
+
+
 @app.callback(
     Output(PCI_MOT.MOT_DIV_EDITOR, 'children'),
+    Output(PCI_MOT.MOT_STORE_EDITOR_EDIT_SEQ, 'data'),
     Input(PCI_MOT.MOT_CYTO, 'selectedNodeData'),
     Input(PCI_MOT.MOT_CYTO, 'selectedEdgeData'),
-    State(PCI_MOT.MOT_CYTO, "elements"),
+    State(PCI_MOT.MOT_STORE_SESSION_ID, 'data'),
+    State(PCI_MOT.MOT_STORE_PROTOTYPE_ID, 'data'),
+    State(PCI_MOT.MOT_STORE_PENDING_EDITS, 'data'),
 )
-def update_element_editor(node_data, edge_data, elements):
+def update_element_editor(node_data, edge_data, session_id, prototype_id, pending_edits):
     if node_data is None:
         node_data = []
     if edge_data is None:
         edge_data = []
 
     if len(node_data) + len(edge_data) == 0:
-        return []
-    mot = cyto_to_mot(elements)
-    cards_node = get_cards_from_selected_nodes(node_data, mot)
-    cards_edge = get_cards_from_selected_edges(edge_data, mot)
-    return cards_node + cards_edge
+        return [], no_update
+    session = get_session(session_id, prototype_id)
+    with session.lock:
+        session.apply_edits(pending_edits)
+        mot = session.mot
+        path_index = MotPathIndex(mot)
+        cards_node = get_cards_from_selected_nodes(node_data, mot, path_index)
+        cards_edge = get_cards_from_selected_edges(edge_data, mot, path_index)
+        edit_seq = session.edit_seq
+    return cards_node + cards_edge, edit_seq
 
 
 @app.callback(
     Output(PCI_MOT.MOT_DOWNLOAD, 'data'),
     Input(PCI_MOT.MOT_BTN_DOWNLOAD, 'n_clicks'),
-    State(PCI_MOT.MOT_STORE_PROTOTYPE_DOC, 'data'),
+    State(PCI_MOT.MOT_STORE_SESSION_ID, 'data'),
+    State(PCI_MOT.MOT_STORE_PROTOTYPE_ID, 'data'),
+    State(PCI_MOT.MOT_SAVE_NAME_INPUT, 'value'),
+    State(PCI_MOT.MOT_SAVE_VERSION_INPUT, 'value'),
+    State(PCI_MOT.MOT_SAVE_VERSION_INHERIT, 'value'),
+    State(PCI_MOT.MOT_STORE_INIT_PROTOTYPE_DOC, 'data'),
+    State(PCI_MOT.MOT_STORE_PENDING_EDITS, 'data'),
     prevent_initial_call=True,
 )
-def download_json(n_clicks, data):
+def download_json(n_clicks, session_id, prototype_id, name, version, inherit, init_data, pending_edits):
     if n_clicks:
+        data = get_session_document(session_id, prototype_id, pending_edits, name, version, inherit, init_data)
         s = json.dumps(data, indent=2, cls=BytesDump)
         return dict(content=s, filename="prototype.json")
     return no_update
@@ -562,10 +590,18 @@ def download_json(n_clicks, data):
 @app.callback(
     Output('mot-dummy-4', 'children'),
     Input(PCI_MOT.MOT_BTN_SAVETODB, 'n_clicks'),
-    State(PCI_MOT.MOT_STORE_PROTOTYPE_DOC, 'data'),
+    State(PCI_MOT.MOT_STORE_SESSION_ID, 'data'),
+    State(PCI_MOT.MOT_STORE_PROTOTYPE_ID, 'data'),
+    State(PCI_MOT.MOT_SAVE_NAME_INPUT, 'value'),
+    State(PCI_MOT.MOT_SAVE_VERSION_INPUT, 'value'),
+    State(PCI_MOT.MOT_SAVE_VERSION_INHERIT, 'value'),
+    State(PCI_MOT.MOT_STORE_INIT_PROTOTYPE_DOC, 'data'),
+    State(PCI_MOT.MOT_STORE_PENDING_EDITS, 'data'),
 )
-def save_to_database(n_clicks, data):
+def save_to_database(n_clicks, session_id, prototype_id, name, version, inherit, init_data, pending_edits):
     if n_clicks:
+        data = get_session_document(session_id, prototype_id, pending_edits, name, version, inherit, init_data)
+        data = json.loads(json.dumps(data, cls=BytesDump))
         doc_inserted = MONGO_DB[COLLECTION].insert_one(data)
         return no_update
     return no_update
@@ -612,16 +648,6 @@ app.clientside_callback(
     Input(PCI_MOT.MOT_DROPDOWN_NAV_PAN_BTN, 'n_clicks'),
 )
 
-app.clientside_callback(
-    ClientsideFunction(
-        namespace='clientside_viewport',
-        function_name='cy_run_mot_layout',
-    ),
-    Output('mot-dummy-1', 'children'),
-    Input(PCI_MOT.MOT_BTN_RELOAD_LAYOUT, 'n_clicks'),
-    prevent_initial_call=True,
-)
-
 app.clientside_callback(
     ClientsideFunction(
         namespace='clientside_viewport',
@@ -672,25 +698,37 @@ app.clientside_callback(
 )
 
 
-# # 2023/03/14it turns out dash_cyto.elements will not be updated when clientside elements got updated
-# # so we update elements (preset and placeholder classes) on server side only, the following is deprecated
-# # one could also use pure client side to do these...
-# # https://community.plotly.com/t/clientside-callback-with-pattern-matching/45657/2
-# app.clientside_callback(
-#     ClientsideFunction(namespace='clientside_client', function_name='cy_mot_editor',),
-#     Output('mot-dummy-7', 'children'),
-#     Input({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_STATE, 'index': ALL}, 'value'),
-#     Input({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_VALUE, 'index': ALL}, 'value'),
-#     State({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_STATE, 'index': ALL}, 'id'),
-#     State({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_VALUE, 'index': ALL}, 'id'),
-#     prevent_initial_call=True,
-# )
+# state and value edits are applied to the graph in the browser and collected in `MOT_STORE_PENDING_EDITS`,
+# server callbacks that need the MOT apply them to the session first, a non-literal placeholder is pruned by
+# `update_cyto_elements` through `MOT_STORE_PRUNE_REQUEST`,
+# edits applied by the server are dropped, `MOT_STORE_EDIT_SEQ` is a state as `update_cyto_elements` takes
+# the prune request, the pending edits are trimmed with the next edit or element selection
+app.clientside_callback(
+    ClientsideFunction(namespace='clientside_client', function_name='cy_edit_element'),
+    Output(PCI_MOT.MOT_STORE_PENDING_EDITS, 'data'),
+    Output(PCI_MOT.MOT_STORE_PRUNE_REQUEST, 'data'),
+    Input({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_STATE, 'index': ALL}, 'value'),
+    Input({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_VALUE, 'index': ALL}, 'value'),
+    Input(PCI_MOT.MOT_STORE_EDITOR_EDIT_SEQ, 'data'),
+    State({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_STATE, 'index': ALL}, 'id'),
+    State({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_VALUE, 'index': ALL}, 'id'),
+    State(PCI_MOT.MOT_STORE_PENDING_EDITS, 'data'),
+    State(PCI_MOT.MOT_STORE_EDIT_SEQ, 'data'),
+    prevent_initial_call=True,
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='clientside_client', function_name='cy_apply_patch'),
+    Output('mot-dummy-7', 'children'),
+    Input(PCI_MOT.MOT_STORE_UPDATE_ELEMENTS, 'data'),
+    prevent_initial_call=True,
+)
 
 
 @app.callback(
-    Output(PCI_MOT.MOT_CYTO, 'elements'),
-    Output(PCI_MOT.MOT_BTN_RELOAD_LAYOUT, 'n_clicks'),
-    Output(PCI_MOT.MOT_BTN_CYTO_CENTER_SELECTED, 'n_clicks'),
+    Output(PCI_MOT.MOT_STORE_UPDATE_ELEMENTS, 'data'),
+    Output(PCI_MOT.MOT_STORE_MOT_VERSION, 'data'),
+    Output(PCI_MOT.MOT_STORE_EDIT_SEQ, 'data'),
 
     Input({'type': PCI_MOT.MOT_BTN_PT_EXTEND, 'index': ALL}, 'n_clicks'),
     State({'type': PCI_MOT.MOT_BTN_PT_EXTEND, 'index': ALL}, 'id'),
@@ -705,15 +743,17 @@ app.clientside_callback(
     State({'type': PCI_MOT.MOT_BTN_PT_UNION, 'index': ALL}, 'id'),
     State({'type': PCI_MOT.MOT_BTN_PT_UNION, 'index': ALL}, 'children'),
 
-    Input({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_STATE, 'index': ALL}, 'value'),
-    Input({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_VALUE, 'index': ALL}, 'value'),
-    State({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_STATE, 'index': ALL}, 'id'),
-    State({'type': PCI_MOT.MOT_INPUT_PT_ELEMENT_VALUE, 'index': ALL}, 'id'),
+    Input(PCI_MOT.MOT_STORE_PRUNE_REQUEST, 'data'),
+
+    Input(PCI_MOT.MOT_BTN_UNDO, 'n_clicks'),
+    Input(PCI_MOT.MOT_BTN_REDO, 'n_clicks'),
 
-    # TODO should this be input?
-    State(PCI_MOT.MOT_CYTO, 'elements'),
-    State(PCI_MOT.MOT_BTN_RELOAD_LAYOUT, 'n_clicks'),
-    State(PCI_MOT.MOT_BTN_CYTO_CENTER_SELECTED, 'n_clicks'),
+    Input(PCI_MOT.MOT_BTN_RELOAD_LAYOUT, 'n_clicks'),
+
+    State(PCI_MOT.MOT_STORE_SESSION_ID, 'data'),
+    State(PCI_MOT.MOT_STORE_PROTOTYPE_ID, 'data'),
+    State(PCI_MOT.MOT_STORE_MOT_VERSION, 'data'),
+    State(PCI_MOT.MOT_STORE_PENDING_EDITS, 'data'),
     prevent_initial_call=True,
 )
 def update_cyto_elements(
@@ -723,14 +763,100 @@ def update_cyto_elements(
         to_delete_btn_n_clicks, to_delete_btn_ids,
         to_union_btn_n_clicks, to_union_btn_ids, to_union_mid,
 
-        # operations that would only update element style classes
-        set_state_values, set_value_values,
-        set_state_ids, set_value_ids,
+        # a state edit that prunes descendants
+        prune_request,
+
+        # history operations
+        undo_n_clicks, redo_n_clicks,
+
+        # send the positions of all nodes
+        reload_layout_n_clicks,
 
-        current_elements,
-        current_n_clicks_reload_layout,
-        current_n_clicks_center,
+        session_id,
+        prototype_id,
+        client_version,
+        pending_edits,
 ):
+    """
+    apply the triggered operation to the session MOT and send the changed elements to `cy_apply_patch`,
+    the whole element list is only sent if the client is out of sync, e.g. the session was reloaded
+
+    positions are sent for the nodes that moved, added nodes are placed next to their parents,
+    all nodes are laid out again if asked or if too many nodes were placed, see `LayoutDriftThreshold`
+    """
+    session = get_session(session_id, prototype_id)
+    with session.lock:
+        in_sync = session.version == client_version
+        n_rejected = session.n_rejected
+        # edits made in the browser come first, they are already shown in the graph
+        edit_deltas = session.apply_edits(pending_edits)
+        # a rejected edit is still shown in the browser
+        in_sync = in_sync and session.n_rejected == n_rejected
+        reload_layout = ctx.triggered_id == PCI_MOT.MOT_BTN_RELOAD_LAYOUT
+        if ctx.triggered_id == PCI_MOT.MOT_STORE_PRUNE_REQUEST:
+            delta, center = MotDelta(), False
+            for d in edit_deltas:
+                delta.merge(d)
+        elif reload_layout:
+            delta, center = MotDelta(), False
+        else:
+            delta, center = _update_session_mot(
+                session,
+                to_extend_btn_n_clicks, to_extend_btn_ids,
+                to_detach_btn_n_clicks, to_detach_btn_ids,
+                to_delete_btn_n_clicks, to_delete_btn_ids,
+                to_union_btn_n_clicks, to_union_btn_ids,
+            )
+        if not delta and in_sync and not reload_layout:
+            return no_update, no_update, session.edit_seq
+        version = session.bump()
+        old_positions = session.positions or dict()
+        n_changed = len(delta.nodes_added) + len(delta.nodes_removed) if in_sync else 0
+        if not in_sync or reload_layout or session.positions is None or \
+                session.layout_drift + n_changed > LayoutDriftThreshold * len(session.mot):
+            _, session.positions = MOT_LAYOUTS.get(session.mot)
+            session.layout_drift = 0
+        elif n_changed > 0:
+            # new nodes are placed next to their parents, the others stay where they are
+            positions = place_new_nodes(session.mot, session.positions, delta.nodes_added)
+            for n in delta.nodes_removed:
+                positions.pop(n, None)
+            session.positions = positions
+            session.layout_drift += n_changed
+        if not in_sync:
+            logger.warning(f"editor session {session_id} is out of sync, sending all elements")
+            patch = dict(reset=mot_to_cyto_element_list(session.mot, session.positions), remove=[], add=[], update=[],
+                         positions=dict())
+        else:
+            patch = mot_delta_to_cyto_patch(session.mot, delta, session.positions)
+            patch['positions'] = {
+                str(n): p for n, p in session.positions.items()
+                if reload_layout or (n not in delta.nodes_added and old_positions.get(n) != p)
+            }
+        edit_seq = session.edit_seq
+    patch.update(version=version, center=center)
+    return patch, version, edit_seq
+
+
+def _update_session_mot(
+        session: MotSession,
+        to_extend_btn_n_clicks, to_extend_btn_ids,
+        to_detach_btn_n_clicks, to_detach_btn_ids,
+        to_delete_btn_n_clicks, to_delete_btn_ids,
+        to_union_btn_n_clicks, to_union_btn_ids,
+) -> tuple[Optional[MotDelta], bool]:
+    """
+    apply the triggered operation to the MOT of the session, the caller holds `session.lock`
+
+    :return: the delta applied to the MOT (None if nothing changed), and if the selection should be centered
+    """
+    mot = session.mot
+    history = session.history
+    if ctx.triggered_id in (PCI_MOT.MOT_BTN_UNDO, PCI_MOT.MOT_BTN_REDO):
+        if ctx.triggered_id == PCI_MOT.MOT_BTN_UNDO:
+            return history.undo(mot), False
+        return history.redo(mot), False
+
     triggered_cids = []
     triggered_types = []
     for it in ctx.triggered_prop_ids.values():
@@ -739,7 +865,7 @@ def update_cyto_elements(
 
     # trigger type can only be one
     if len(triggered_types) != 1:
-        return no_update
+        return None, False
 
     # one trigger
     assert len(set(triggered_cids)) == 1
@@ -752,13 +878,7 @@ def update_cyto_elements(
 
     do_union = False
     pt_operation = None
-    if triggered_type == PCI_MOT.MOT_INPUT_PT_ELEMENT_STATE:
-        same_type_ids = set_state_ids
-        same_type_props = set_state_values
-    elif triggered_type == PCI_MOT.MOT_INPUT_PT_ELEMENT_VALUE:
-        same_type_ids = set_value_ids
-        same_type_props = set_value_values
-    elif triggered_type == PCI_MOT.MOT_BTN_PT_EXTEND:
+    if triggered_type == PCI_MOT.MOT_BTN_PT_EXTEND:
         same_type_ids = to_extend_btn_ids
         same_type_props = to_extend_btn_n_clicks
         pt_operation = pt_extend_node
@@ -779,79 +899,21 @@ def update_cyto_elements(
 
     id_to_prop = dict(zip([si['index'] for si in same_type_ids], same_type_props))
     prop = id_to_prop[triggered_cid]
-    # TODO DRY this
-    if triggered_type == PCI_MOT.MOT_INPUT_PT_ELEMENT_STATE:
-        for e in current_elements:
-            if e['data']['id'] == str(triggered_cid):
-                if prop:
-                    e['data']['ele_attrs']['mot_state'] = PT_PLACEHOLDER
-                    if CYTO_PLACEHOLDER_CLASS not in e['classes']:
-                        e['classes'] += " " + CYTO_PLACEHOLDER_CLASS
-                    e['classes'] = e['classes'].replace(CYTO_PRESET_CLASS, "")
-                    # remove successors if a non-literal is marked as placeholder
-                    # TODO make this work without importing
-                    is_e_edge = " " in e['data']['id']
-                    if not is_e_edge and import_string(
-                            e['data']['ele_attrs']['mot_class_string']) not in OrdEnumClasses + BuiltinLiteralClasses:
-                        mot = cyto_to_mot(current_elements)
-                        successors = [nn for nn in nx.descendants(mot, triggered_cid) if nn != triggered_cid]
-                        for s in successors:
-                            mot.remove_node(s)
-                        current_elements = mot_to_cyto_element_list(mot)
-                else:
-                    e['data']['ele_attrs']['mot_state'] = PT_PRESET
-                    if CYTO_PRESET_CLASS not in e['classes']:
-                        e['classes'] += " " + CYTO_PRESET_CLASS
-                    e['classes'] = e['classes'].replace(CYTO_PLACEHOLDER_CLASS, "")
-                    # non-literal is by default preset
-                    if import_string(
-                            e['data']['ele_attrs']['mot_class_string']) not in OrdEnumClasses + BuiltinLiteralClasses:
-                        e['classes'] = e['classes'].replace(CYTO_PRESET_CLASS, "")
-                break
-        # TODO this and the following set_value would trigger reload_layout and center even n_clicks do not change
-        return current_elements, current_n_clicks_reload_layout, current_n_clicks_center
-    elif triggered_type == PCI_MOT.MOT_INPUT_PT_ELEMENT_VALUE:
-        for e in current_elements:
-            if e['data']['id'] == str(triggered_cid):
-                e['data']['ele_attrs']['mot_value'] = prop
-                break
-        return current_elements, current_n_clicks_reload_layout, current_n_clicks_center
+    if not prop:
+        return None, False
+    target_node_id = triggered_cid
+    if do_union:
+        # do not do union if it has existing children
+        target_node_id, mid = target_node_id.split("@@")
+        target_node_id = int(target_node_id)
+        if len([*mot.successors(target_node_id)]) > 0:
+            return None, False
+        other_graph = MONGO_DB[COLLECTION].find_one({"_id": ObjectId(mid)})
+        other_graph = nx.node_link_graph(other_graph['node_link_data'], directed=True)
+        delta = MotDelta(label=f"union {mid} at {target_node_id}")
+        pt_graft_subtree(mot, target_node_id, other_graph, inplace=True, delta=delta)
     else:
-        if prop:
-            current_mot = cyto_to_mot(current_elements)
-            target_node_id = triggered_cid
-            if do_union:
-                # do not do union if it has existing children
-                target_node_id, mid = target_node_id.split("@@")
-                target_node_id = int(target_node_id)
-                if len([*current_mot.successors(target_node_id)]) > 0:
-                    return current_elements, current_n_clicks_reload_layout, current_n_clicks_center
-                other_graph = MONGO_DB[COLLECTION].find_one({"_id": ObjectId(to_union_mid[0])})
-                other_graph = other_graph['node_link_data']
-                other_graph = nx.node_link_graph(other_graph, directed=True)
-                baseline = max(current_mot.nodes) + 1
-                other_graph_mapping = dict()
-                for n in other_graph.nodes:
-                    other_graph_mapping[n] = n + baseline
-                nx.relabel_nodes(other_graph, other_graph_mapping, copy=False)
-                other_graph_root = get_root(other_graph)
-                other_graph_mapping = {other_graph_root: target_node_id}
-                nx.relabel_nodes(other_graph, other_graph_mapping, copy=False)
-
-                # missing_edge = (next(current_mot.predecessors(target_node_id)), target_node_id)
-                # missing_edge_attrs = current_mot.edges[missing_edge]
-                for n in other_graph.nodes:
-                    other_graph.nodes[n]['mot_element_id'] = n
-                for e in other_graph.edges:
-                    other_graph.edges[e]['mot_element_id'] = e
-
-                merged_mot = nx.compose(current_mot, other_graph)
-                # merged_mot.add_edge(*missing_edge, **missing_edge_attrs)
-                current_elements = mot_to_cyto_element_list(merged_mot)
-            else:
-                pt_operation(current_mot, target_node_id, inplace=True)
-                current_elements = mot_to_cyto_element_list(current_mot)
-            current_n_clicks_reload_layout += 1
-            current_n_clicks_center += 1
-
-        return current_elements, current_n_clicks_reload_layout, current_n_clicks_center
+        delta = MotDelta(label=f"{pt_operation.__name__} {target_node_id}")
+        pt_operation(mot, target_node_id, inplace=True, delta=delta)
+    history.push(delta)
+    return delta, True
@@ -1,5 +1,8 @@
+import hashlib
 import json
 import os
+import threading
+from collections import OrderedDict
 
 from dash_app_support.components import get_literal_node_value_input
 from dash_app_support.cyto_elements import BytesDump
@@ -8,14 +11,16 @@ import dash_bootstrap_components as dbc
 import dash_renderjson
 import networkx as nx
 from bson.objectid import ObjectId
-from dash import html, Input, Output, dcc, ALL, register_page, get_app, State, ctx
+from dash import html, Input, Output, dcc, ALL, register_page, get_app, State
 from pymongo import MongoClient
 
 from dash_app_support.components import JsonTheme
 from dash_app_support.components import simple_open
 from dash_app_support.db import ENV_MONGO_URI, ENV_MONGO_DB, ENV_MONGO_COLLECTION
-from ord_tree.mot import PT_PLACEHOLDER, MotEleAttr, mot_get_path, message_from_mot
-from ord_tree.utils import import_string, get_leafs
+from ord_tree.mot import PT_PLACEHOLDER, MotEleAttr, mot_get_path, MotPathIndex
+from ord_tree.ord_classes import ClassTable
+from ord_tree.template import PrototypeTemplate, compile_prototype, SlotUnset
+from ord_tree.utils import get_leafs
 
 this_folder = os.path.dirname(os.path.abspath(__file__))
 register_page(__name__, path_template="/instantiate/<prototype_id>", description="Instantiate")
@@ -23,6 +28,11 @@ app = get_app()
 # TODO auth
 MONGO_DB = MongoClient(ENV_MONGO_URI)[ENV_MONGO_DB]
 COLLECTION = ENV_MONGO_COLLECTION
+# templates compiled when pages are loaded, keyed by the hash of the prototype data of the page,
+# a prototype can be modified after a page is loaded, slots are the nodes and edges with an input
+P2R_TEMPLATES_MAX_SIZE = 32
+P2R_TEMPLATES: OrderedDict[str, PrototypeTemplate] = OrderedDict()
+P2R_TEMPLATES_LOCK = threading.Lock()
 
 
 #
@@ -30,8 +40,9 @@ COLLECTION = ENV_MONGO_COLLECTION
 class PCI_P2R:
     CID_P2R_ELEMENT_INPUT = "CID_P2R_ELEMENT_INPUT"
 
-    CID_P2R_STORE_LIVE_PT = "CID_P2R_STORE_LIVE_PT"
     CID_P2R_STORE_INIT_PT = "CID_P2R_STORE_INIT_PT"
+    CID_P2R_STORE_PROTOTYPE_ID = "CID_P2R_STORE_PROTOTYPE_ID"
+    CID_P2R_STORE_TEMPLATE_KEY = "CID_P2R_STORE_TEMPLATE_KEY"
 
     CID_P2R_BTN_OPEN_JSON_VIEWER_MODAL = "CID_P2R_BTN_OPEN_JSON_VIEWER_MODAL"
     CID_P2R_JSON_VIEWER_MODAL = "CID_P2R_JSON_VIEWER_MODAL"
@@ -52,11 +63,15 @@ def layout(prototype_id=None):
     init_pt_data = json.loads(json.dumps(init_pt_data, cls=BytesDump))
     init_metadata = {k: v for k, v in init_doc.items() if k not in ('node_link_data', '_id')}
     init_pt = nx.node_link_graph(init_pt_data)
+    init_path_index = MotPathIndex(init_pt)
+    template_key = get_p2r_template_key(init_pt_data)
+    put_p2r_template(template_key, get_p2r_template(init_pt))
 
     return html.Div(
         [
             dcc.Store(id=PCI_P2R.CID_P2R_STORE_INIT_PT, data=init_pt_data),
-            dcc.Store(id=PCI_P2R.CID_P2R_STORE_LIVE_PT),
+            dcc.Store(id=PCI_P2R.CID_P2R_STORE_PROTOTYPE_ID, data=prototype_id),
+            dcc.Store(id=PCI_P2R.CID_P2R_STORE_TEMPLATE_KEY, data=template_key),
             html.Div(
                 [
                     dbc.Button("JSON", id=PCI_P2R.CID_P2R_BTN_OPEN_JSON_VIEWER_MODAL, className="mb-3 me-3"),
@@ -90,9 +105,9 @@ def layout(prototype_id=None):
 
             # get_reaction_input_card(pt_reaction_input=init_pt, pt_main=init_pt),
             html.Hr(className="mb-3"),
-            get_leaf_inputs(pt_main=init_pt),
+            get_leaf_inputs(pt_main=init_pt, path_index=init_path_index),
             html.Hr(className="mt-3 mb-3"),
-            get_edge_inputs(pt_main=init_pt),
+            get_edge_inputs(pt_main=init_pt, path_index=init_path_index),
         ]
     )
 
@@ -107,7 +122,7 @@ app.callback(
 
 
 
-def get_edge_input_group(pt_main: nx.DiGraph, u: int, v:int):
+def get_edge_input_group(pt_main: nx.DiGraph, u: int, v: int, path_index: MotPathIndex = None):
     ele_attrs = pt_main.edges[(u, v)]
     ele_attrs: MotEleAttr
     element_class = str
@@ -120,7 +135,7 @@ def get_edge_input_group(pt_main: nx.DiGraph, u: int, v:int):
         disable_input = True
     value_input = get_literal_node_value_input(element_class, node_value=element_value, cid=cid, disabled=disable_input)
 
-    path = mot_get_path(pt_main, v, with_node=False, delimiter="arrow", remove_last=True)
+    path = mot_get_path(pt_main, v, with_node=False, delimiter="arrow", remove_last=True, path_index=path_index)
     return dbc.InputGroup(
         [
             dbc.InputGroupText(["EdgeTarget: ", path], className="d-block w-100 rounded-0"),
@@ -132,10 +147,10 @@ def get_edge_input_group(pt_main: nx.DiGraph, u: int, v:int):
     )
 
 
-def get_node_input_group(pt_main: nx.DiGraph, node: int, path_width=None):
+def get_node_input_group(pt_main: nx.DiGraph, node: int, path_width=None, path_index: MotPathIndex = None):
     ele_attrs = pt_main.nodes[node]
     ele_attrs: MotEleAttr
-    element_class = import_string(ele_attrs['mot_class_string'])
+    element_class = ClassTable.by_string(ele_attrs['mot_class_string']).cls
     element_value = ele_attrs['mot_value']
     element_id = ele_attrs['mot_element_id']  # TODO make sure this is consistent with current tree
     cid = {'type': PCI_P2R.CID_P2R_ELEMENT_INPUT, 'index': element_id}
@@ -145,7 +160,7 @@ def get_node_input_group(pt_main: nx.DiGraph, node: int, path_width=None):
         disable_input = True
     value_input = get_literal_node_value_input(element_class, node_value=element_value, cid=cid, disabled=disable_input)
 
-    path = mot_get_path(pt_main, node, with_node=False, delimiter="arrow")
+    path = mot_get_path(pt_main, node, with_node=False, delimiter="arrow", path_index=path_index)
     if path_width:
         width = f"{path_width}px"
         style = {"width": width}
@@ -162,82 +177,108 @@ def get_node_input_group(pt_main: nx.DiGraph, node: int, path_width=None):
     )
 
 
-def get_leaf_inputs(pt_main: nx.DiGraph):
+def get_leaf_inputs(pt_main: nx.DiGraph, path_index: MotPathIndex = None):
+    if path_index is None:
+        path_index = MotPathIndex(pt_main)
     shown_leafs = []
     shown_leafs_paths = []
     for leaf in get_leafs(pt_main, sort=True):
         if pt_main.nodes[leaf]['mot_state'] != PT_PLACEHOLDER:
             continue
         shown_leafs.append(leaf)
-        shown_leafs_paths.append(mot_get_path(pt_main, leaf))
+        shown_leafs_paths.append(mot_get_path(pt_main, leaf, path_index=path_index))
     if len(shown_leafs) == 0:
         return dbc.Alert("No placeholder nodes found in this prototype!", color="warning")
     path_max = max([len(p) for p in shown_leafs_paths])
 
     input_divs = []
     for leaf in shown_leafs:
-        input_div = get_node_input_group(pt_main, leaf, path_max * 10 + 5)
+        input_div = get_node_input_group(pt_main, leaf, path_max * 10 + 5, path_index=path_index)
         input_divs.append(input_div)
     return html.Div(input_divs)
 
 
-def get_edge_inputs(pt_main: nx.DiGraph):
+def get_edge_inputs(pt_main: nx.DiGraph, path_index: MotPathIndex = None):
+    if path_index is None:
+        path_index = MotPathIndex(pt_main)
     shown_edges = []
     shown_edges_paths = []
     for u, v, d in pt_main.edges(data=True):
         if d['mot_state'] != PT_PLACEHOLDER:
             continue
         shown_edges.append((u, v, d))
-        shown_edges_paths.append(mot_get_path(pt_main, v))
+        shown_edges_paths.append(mot_get_path(pt_main, v, path_index=path_index))
     if len(shown_edges) == 0:
         return dbc.Alert("No placeholder edges found in this prototype!", color="warning")
 
     input_divs = []
     for u, v, d in shown_edges:
-        input_div = get_edge_input_group(pt_main, u, v)
+        input_div = get_edge_input_group(pt_main, u, v, path_index=path_index)
         input_divs.append(input_div)
     return html.Div(input_divs)
 
 
 
+def get_p2r_template(pt: nx.DiGraph) -> PrototypeTemplate:
+    """ the slots are the inputs of `get_leaf_inputs` and `get_edge_inputs`, only dict keys can be edges """
+    slots = [n for n in get_leafs(pt, sort=False) if pt.nodes[n]['mot_state'] == PT_PLACEHOLDER]
+    slots += [(u, v) for u, v, d in pt.edges(data=True) if d['mot_state'] == PT_PLACEHOLDER and d['mot_can_edit']]
+    return compile_prototype(pt, slots)
+
+
+def get_p2r_template_key(pt_data: dict) -> str:
+    return hashlib.blake2b(json.dumps(pt_data, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def put_p2r_template(template_key: str, template: PrototypeTemplate):
+    with P2R_TEMPLATES_LOCK:
+        P2R_TEMPLATES[template_key] = template
+        P2R_TEMPLATES.move_to_end(template_key)
+        while len(P2R_TEMPLATES) > P2R_TEMPLATES_MAX_SIZE:
+            P2R_TEMPLATES.popitem(last=False)
+
+
+def get_p2r_template_of_page(template_key: str, pt_data: dict) -> PrototypeTemplate:
+    """ the template of the prototype a page was loaded with, compiled again if it was dropped """
+    with P2R_TEMPLATES_LOCK:
+        template = P2R_TEMPLATES.get(template_key)
+        if template is not None:
+            P2R_TEMPLATES.move_to_end(template_key)
+            return template
+    # the page was loaded by another worker or the template was dropped
+    template = get_p2r_template(nx.node_link_graph(pt_data))
+    put_p2r_template(template_key, template)
+    return template
+
+
 @app.callback(
-    Output(PCI_P2R.CID_P2R_STORE_LIVE_PT, 'data'),
+    Output(PCI_P2R.CID_P2R_DIV_JSON_VIEWER_IN_JSON_VIEWER_MODAL, "data"),
     Input({'type': PCI_P2R.CID_P2R_ELEMENT_INPUT, 'index': ALL}, 'value'),
     Input({'type': PCI_P2R.CID_P2R_ELEMENT_INPUT, 'index': ALL}, 'id'),
-    Input(PCI_P2R.CID_P2R_STORE_INIT_PT, "data"),
+    State(PCI_P2R.CID_P2R_STORE_TEMPLATE_KEY, "data"),
+    State(PCI_P2R.CID_P2R_STORE_INIT_PT, "data"),
 )
-def update_live_store_pt(p2r_values, p2r_ids, init_pt_data):
-    for it in ctx.triggered_prop_ids.values():
-        if isinstance(it, str):
-            if it == PCI_P2R.CID_P2R_STORE_INIT_PT:
-                return init_pt_data
-
-    pt = nx.node_link_graph(init_pt_data)
+def update_jv(p2r_values, p2r_ids, template_key, init_pt_data):
+    # the graph is not rebuilt for every input, only the slots of the template are bound
+    template = get_p2r_template_of_page(template_key, init_pt_data)
+    values = dict()
     for val, j in zip(p2r_values, p2r_ids):
         i = j['index']
         if not isinstance(i, int):
             u, v = i.split()
-            u = int(u)
-            v = int(v)
-            edge = (u, v)
             if val == "true":
                 val = True
             elif val == "false":
                 val = False
-            pt.edges[edge]['mot_value'] = val
+            element = (int(u), int(v))
         else:
-            n = int(i)
-            pt.nodes[n]['mot_value'] = val
-    return nx.node_link_data(pt)
-
-
-@app.callback(
-    Output(PCI_P2R.CID_P2R_DIV_JSON_VIEWER_IN_JSON_VIEWER_MODAL, "data"),
-    Input(PCI_P2R.CID_P2R_STORE_LIVE_PT, 'data')
-)
-def update_jv(mot_data):
-    mot = nx.node_link_graph(mot_data)
-    m = message_from_mot(mot)
+            element = int(i)
+        if val is None:
+            # a cleared input unsets the field
+            val = SlotUnset
+        if element in template:
+            values[element] = val
+    m = template.instantiate(values)
     # TODO m can also be a list/dict of message!
     try:
         data = m.to_dict()
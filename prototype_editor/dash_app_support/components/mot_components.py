@@ -1,24 +1,32 @@
+import base64
 from typing import Type, Any
 from dash_app_support.components import path_to_path_md
 import dash_bootstrap_components as dbc
 import networkx as nx
 from dash import html, dcc
 
-from ord_tree.mot import MotEleAttr, mot_get_path, get_literal_nodes, PT_PLACEHOLDER
-from ord_tree.mtt import OrdEnumClasses
-from ord_tree.utils import import_string, NodePathDelimiter, enum_class_to_options
+from ord_tree.mot import MotEleAttr, mot_get_path, get_literal_nodes, PT_PLACEHOLDER, MotPathIndex
+from ord_tree.ord_classes import OrdEnumClasses
+from ord_tree.ord_classes import ClassTable
+from ord_tree.utils import NodePathDelimiter, enum_class_to_options
 
 
 # page component ids
 class PCI_MOT:
     # intermediates
-    MOT_STORE_EDITABLE_NODES = "MOT_STORE_EDITABLE_NODES"
-    MOT_STORE_EDITABLE_EDGES = "MOT_STORE_EDITABLE_EDGES"
-    MOT_STORE_ALL_NODES = "MOT_STORE_ALL_NODES"
-    MOT_STORE_ALL_EDGES = "MOT_STORE_ALL_EDGES"
-    MOT_STORE_PROTOTYPE_DOC = "MOT_STORE_PROTOTYPE_DOC"
     MOT_STORE_INIT_PROTOTYPE_DOC = "MOT_STORE_INIT_PROTOTYPE_DOC"
     MOT_STORE_UPDATE_ELEMENTS = "MOT_STORE_UPDATE_ELEMENTS"
+    # the MOT is kept on the server, keyed by the session id and the prototype id
+    MOT_STORE_SESSION_ID = "MOT_STORE_SESSION_ID"
+    MOT_STORE_PROTOTYPE_ID = "MOT_STORE_PROTOTYPE_ID"
+    MOT_STORE_MOT_VERSION = "MOT_STORE_MOT_VERSION"  # bumped by every change of the MOT
+    # state and value edits made in the browser, and the edit that needs the server to prune descendants
+    MOT_STORE_PENDING_EDITS = "MOT_STORE_PENDING_EDITS"
+    MOT_STORE_PRUNE_REQUEST = "MOT_STORE_PRUNE_REQUEST"
+    # sequence numbers of the edits applied to the server MOT, sent by the element editor and the graph callbacks,
+    # applied edits are dropped from the pending edits
+    MOT_STORE_EDIT_SEQ = "MOT_STORE_EDIT_SEQ"
+    MOT_STORE_EDITOR_EDIT_SEQ = "MOT_STORE_EDITOR_EDIT_SEQ"
 
     # main cyto
     MOT_CYTO = "MOT_CYTO"
@@ -82,6 +90,10 @@ class PCI_MOT:
     MOT_BTN_CYTO_FIT = "CID_MOT_BTN_CYTO_FIT"
     MOT_BTN_CYTO_CENTER_SELECTED = "CID_MOT_BTN_CYTO_CENTER_SELECTED"
 
+    # history buttons
+    MOT_BTN_UNDO = "CID_MOT_BTN_UNDO"
+    MOT_BTN_REDO = "CID_MOT_BTN_REDO"
+
     # MOT_DIV_EDITOR_ELEMENT_STATE = "CID_MOT_DIV_EDITOR_ELEMENT_STATE"
     # MOT_SWITCHES = "CID_MOT_SWITCHES"
     # MOT_EDITABLE_ID_SELECTOR = "CID_MOT_EDITABLE_ID_SELECTOR"
@@ -113,8 +125,10 @@ def get_literal_node_value_input(node_class: Type, node_value: Any, cid: dict[st
         #                      value=node_value, id=cid,), className="dash-bootstrap")
 
     elif node_class == bytes:
-        # TODO make this better
-        value_input = dbc.Textarea(value=str(node_value), id=cid, disabled=disabled)
+        # base64 as in the `ele_attrs` of cytoscape elements, strings are values loaded from json
+        if isinstance(node_value, bytes):
+            node_value = base64.b64encode(node_value).decode('ascii')
+        value_input = dbc.Textarea(value=node_value, id=cid, disabled=disabled)
     else:
         raise TypeError(f"illegal literal class: {node_class}")
     return value_input
@@ -167,9 +181,11 @@ def get_literal_editor_node(node_id: int, node_state: str, node_value: Any, node
     return editor
 
 
-def get_cards_from_selected_nodes(node_data, mot: nx.DiGraph):
+def get_cards_from_selected_nodes(node_data, mot: nx.DiGraph, path_index: MotPathIndex = None):
     cards = []
     literal_nodes = get_literal_nodes(mot)
+    if path_index is None:
+        path_index = MotPathIndex(mot)
     for node_d in node_data:
         node_id_str = node_d['id']
         node_id = int(node_id_str)
@@ -206,9 +222,9 @@ def get_cards_from_selected_nodes(node_data, mot: nx.DiGraph):
 
         node_attr = mot.nodes[node_id]
         node_attr: MotEleAttr
-        node_class = import_string(node_attr['mot_class_string'])
+        node_class = ClassTable.by_string(node_attr['mot_class_string']).cls
 
-        path = mot_get_path(mot, node_id, with_node=True)
+        path = mot_get_path(mot, node_id, with_node=True, path_index=path_index)
         path = path_to_path_md(path, NodePathDelimiter)
 
         item_path = dbc.ListGroupItem([html.H6("Path"), path])
@@ -272,15 +288,17 @@ def get_literal_editor_edge(edge_header: str, u_id: int, v_id: int, edge_state:
     return editor
 
 
-def get_cards_from_selected_edges(edge_data, mot: nx.DiGraph):
+def get_cards_from_selected_edges(edge_data, mot: nx.DiGraph, path_index: MotPathIndex = None):
     cards = []
+    if path_index is None:
+        path_index = MotPathIndex(mot)
     for edge_d in edge_data:
         u_id_str = edge_d['source']
         v_id_str = edge_d['target']
         u_id = int(u_id_str)
         v_id = int(v_id_str)
-        u_path = mot_get_path(mot, u_id)
-        v_path = mot_get_path(mot, v_id)
+        u_path = mot_get_path(mot, u_id, path_index=path_index)
+        v_path = mot_get_path(mot, v_id, path_index=path_index)
 
         # TODO this is a dirty fix for the bug where `node_id` doesn't exist after a deletion is made to cyto elements
         try:
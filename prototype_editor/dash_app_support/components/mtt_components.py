@@ -3,7 +3,7 @@ import networkx as nx
 from dash import html, dcc
 
 from dash_app_support.cyto_elements import MttNodeAttr
-from ord_tree.mtt import OrdEnumClasses, BuiltinLiteralClasses, OrdMessageClasses
+from ord_tree.ord_classes import OrdEnumClasses, BuiltinLiteralClasses, OrdMessageClasses
 from ord_tree.utils import import_string, NodePathDelimiter
 
 
@@ -6,10 +6,12 @@ from typing import Any, Iterable, Tuple, Type
 
 import networkx as nx
 
+from ord_tree.history import MotDelta
+from ord_tree.layout import MotPositions
 from ord_tree.mot import MotEleAttr, PT_PLACEHOLDER
 from ord_tree.mtt import MttNodeAttr
-from ord_tree.ord_classes import OrdMessageClasses, BuiltinLiteralClasses, OrdEnumClasses
-from ord_tree.utils import import_string, RootNodePath
+from ord_tree.ord_classes import ClassTable, ClassKindList, ClassKindDict, ClassKindMessage
+from ord_tree.utils import RootNodePath
 from .cyto_config import *
 
 CYTO_COLORS = ["red", "orange", "yellow", "green", "blue", "indigo", "violet"]
@@ -143,14 +145,16 @@ class CytoElementNode(CytoElement):
     @staticmethod
     def derive_cyto_classes_from_node_class(node_class: Type) -> [str]:
         cyto_classes = []
-        if node_class in (dict, list):
+        try:
+            node_entry = ClassTable.by_class(node_class)
+        except TypeError:
+            raise TypeError(f"illegal node class: {node_class}")
+        if node_entry.kind in (ClassKindDict, ClassKindList):
             cyto_classes.append(CYTO_MUTABLE_NODE_CLASS)
-        elif node_class in BuiltinLiteralClasses + OrdEnumClasses:
+        elif node_entry.is_literal:
             cyto_classes.append(CYTO_LITERAL_NODE_CLASS)
-        elif node_class in OrdMessageClasses:
-            cyto_classes.append(CYTO_MESSAGE_NODE_CLASS)
         else:
-            raise TypeError(f"illegal node class: {node_class}")
+            cyto_classes.append(CYTO_MESSAGE_NODE_CLASS)
         return cyto_classes
 
     @staticmethod
@@ -166,8 +170,7 @@ class CytoElementNode(CytoElement):
 
         u_attr = mtt.nodes[parent]
         u_attr = MttNodeAttr(**u_attr)
-        u_class = import_string(u_attr['mtt_class_string'])
-        if u_class not in OrdMessageClasses:
+        if ClassTable.by_string(u_attr['mtt_class_string']).kind != ClassKindMessage:
             return dict()
 
         children = mtt.successors(parent)
@@ -186,7 +189,7 @@ class CytoElementNode(CytoElement):
         node_attr = mtt.nodes[mtt_node]
         node_attr: MttNodeAttr
 
-        node_class = import_string(node_attr['mtt_class_string'])
+        node_class = ClassTable.by_string(node_attr['mtt_class_string']).cls
         cyto_classes = CytoElementNode.derive_cyto_classes_from_node_class(node_class)
 
         oneof_color_dict = CytoElementNode.derive_oneof_color_mtt(mtt, mtt_node)
@@ -203,7 +206,7 @@ class CytoElementNode(CytoElement):
     @classmethod
     def from_mot_node(cls, mot: nx.DiGraph, mot_node: int):
         node_attrs = MotEleAttr(**mot.nodes[mot_node])
-        node_class = import_string(node_attrs['mot_class_string'])
+        node_class = ClassTable.by_string(node_attrs['mot_class_string']).cls
         cyto_classes = CytoElementNode.derive_cyto_classes_from_node_class(node_class)
 
         # everything should be jsonable
@@ -314,7 +317,7 @@ def mtt_to_cyto(mtt: nx.DiGraph, hide_literal=True) -> Tuple[
         e = CytoElementNode.from_mtt_node(mtt, n)
         node_attr = mtt.nodes[n]
         node_attr: MttNodeAttr
-        if hide_literal and import_string(node_attr['mtt_class_string']) in BuiltinLiteralClasses + OrdEnumClasses:
+        if hide_literal and ClassTable.by_string(node_attr['mtt_class_string']).is_literal:
             continue
         elements_node[n] = e
         included.append(n)
@@ -328,48 +331,72 @@ def mtt_to_cyto(mtt: nx.DiGraph, hide_literal=True) -> Tuple[
     return elements_node, elements_edge
 
 
-def mot_to_cyto(mot: nx.DiGraph) -> Tuple[
+def mot_node_to_cyto(mot: nx.DiGraph, n: int, positions: MotPositions = None) -> CytoElementNode:
+    e = CytoElementNode.from_mot_node(mot, n)
+    if positions is not None and n in positions:
+        e.position_x, e.position_y = positions[n]
+    # TODO make _classes a set so no duplicates
+    if ClassTable.by_string(mot.nodes[n]['mot_class_string']).is_literal:
+        e._classes = [*e._classes] + [CYTO_LITERAL_NODE_CLASS]
+        if mot.nodes[n]['mot_state'] == PT_PLACEHOLDER:
+            e._classes = [*e._classes] + [CYTO_PLACEHOLDER_CLASS]
+        else:
+            e._classes = [*e._classes] + [CYTO_PRESET_CLASS]
+    else:
+        if mot.nodes[n]['mot_state'] == PT_PLACEHOLDER:
+            e._classes = [*e._classes] + [CYTO_PLACEHOLDER_CLASS]
+    return e
+
+
+def mot_edge_to_cyto(mot: nx.DiGraph, edge: Tuple[int, int]) -> CytoElementEdge:
+    e = CytoElementEdge.from_mot_edge(mot, edge)
+    if e.data_ele_attrs['mot_can_edit']:
+        e._classes = [*e._classes] + [CYTO_MESSAGE_EDGE_CAN_EDIT_CLASS]
+        if e.data_ele_attrs['mot_state'] == PT_PLACEHOLDER:
+            e._classes = [*e._classes] + [CYTO_PLACEHOLDER_CLASS]
+        else:
+            e._classes = [*e._classes] + [CYTO_PRESET_CLASS]
+    return e
+
+
+def mot_to_cyto(mot: nx.DiGraph, positions: MotPositions = None) -> Tuple[
     dict[int, CytoElementNode],
     dict[Tuple[int, int], CytoElementEdge],
 ]:
     elements_node = dict()
-    n_to_class = {n: import_string(mot.nodes[n]['mot_class_string']) for n in mot.nodes}
     for n in mot.nodes:
-        e = CytoElementNode.from_mot_node(mot, n)
-        node_class = n_to_class[n]
-        # TODO make _classes a set so no duplicates
-        if node_class in BuiltinLiteralClasses + OrdEnumClasses:
-            e._classes = [*e._classes] + [CYTO_LITERAL_NODE_CLASS]
-            if mot.nodes[n]['mot_state'] == PT_PLACEHOLDER:
-                e._classes = [*e._classes] + [CYTO_PLACEHOLDER_CLASS]
-            else:
-                e._classes = [*e._classes] + [CYTO_PRESET_CLASS]
-        else:
-            if mot.nodes[n]['mot_state'] == PT_PLACEHOLDER:
-                e._classes = [*e._classes] + [CYTO_PLACEHOLDER_CLASS]
-        elements_node[n] = e
+        elements_node[n] = mot_node_to_cyto(mot, n, positions)
 
     elements_edge = dict()
     for e in mot.edges:
-        u, v = e
-        e = CytoElementEdge.from_mot_edge(mot, e)
-        if e.data_ele_attrs['mot_can_edit']:
-            e._classes = [*e._classes] + [CYTO_MESSAGE_EDGE_CAN_EDIT_CLASS]
-            if e.data_ele_attrs['mot_state'] == PT_PLACEHOLDER:
-                e._classes = [*e._classes] + [CYTO_PLACEHOLDER_CLASS]
-            else:
-                e._classes = [*e._classes] + [CYTO_PRESET_CLASS]
-        elements_edge[(u, v)] = e
+        elements_edge[e] = mot_edge_to_cyto(mot, e)
     return elements_node, elements_edge
 
 
-def mot_to_cyto_element_list(mot: nx.DiGraph) -> list[dict]:
-    elements_node, elements_edge = mot_to_cyto(mot)
+def mot_to_cyto_element_list(mot: nx.DiGraph, positions: MotPositions = None) -> list[dict]:
+    """ elements of a MOT, nodes are placed at `positions` for the preset layout if given """
+    elements_node, elements_edge = mot_to_cyto(mot, positions)
     elements_node.update(elements_edge)
     return [e.as_dict() for e in elements_node.values()]
 
 
-def cyto_to_mot(elements: list[dict]):
+def mot_delta_to_cyto_patch(mot: nx.DiGraph, delta: MotDelta, positions: MotPositions = None) -> dict[str, list]:
+    """
+    the cytoscape elements changed by a delta that has been applied to `mot`, consumed by `cy_apply_patch`
+
+    - remove: ids of removed elements, edges first
+    - add: added elements, nodes first
+    - update: elements with changed attributes, replacing their data and classes
+    """
+    remove = [f"{u} {v}" for u, v in delta.edges_removed] + [str(n) for n in delta.nodes_removed]
+    add = [mot_node_to_cyto(mot, n, positions).as_dict() for n in delta.nodes_added]
+    add += [mot_edge_to_cyto(mot, e).as_dict() for e in delta.edges_added]
+    update = [mot_node_to_cyto(mot, n).as_dict() for n in delta.nodes_changed]
+    update += [mot_edge_to_cyto(mot, e).as_dict() for e in delta.edges_changed]
+    return dict(remove=remove, add=add, update=update)
+
+
+def cyto_to_mot(elements: list[dict], graph: dict = None):
     node_element_dict = dict()
     edge_element_dict = dict()
     for e in elements:
@@ -379,12 +406,14 @@ def cyto_to_mot(elements: list[dict]):
             edge_element_dict[e['data']['id']] = e
 
     mot = nx.DiGraph()
+    if graph:
+        mot.graph.update(graph)
     for node, node_dict in node_element_dict.items():
         node_id = int(node)
         # make a copy for bytes
         data_ele_attrs = MotEleAttr(**node_dict['data']['ele_attrs'])
         # this can only happen for nodes, not edges
-        if import_string(data_ele_attrs['mot_class_string']) == bytes:
+        if ClassTable.by_string(data_ele_attrs['mot_class_string']).cls == bytes:
             data_ele_attrs['mot_value'] = base64.b64decode(data_ele_attrs['mot_value'])
         mot.add_node(node_id, **data_ele_attrs)
     for edge, edge_dict in edge_element_dict.items():
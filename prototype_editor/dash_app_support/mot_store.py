@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import networkx as nx
+from loguru import logger
+
+from ord_tree.history import MotDelta, MotHistory
+from ord_tree.layout import MotPositions
+from ord_tree.pt_batch import PtOperation, pt_apply_operations
+
+"""
+server side store of the MOTs being edited, keyed by (session id, prototype id)
+
+the store holds the authoritative MOT of every editor session so callbacks only exchange ids with the browser,
+it is bounded: the least recently used sessions are dropped beyond `max_sessions`,
+and sessions not used for `ttl` seconds are dropped on the next access
+
+sessions live in the memory of one server process, run the editor with one worker (or sticky sessions),
+a session that is not found is reloaded from the database by the `loader` of `MotSessionStore.get`
+
+state and value edits are made in the browser first and collected in a store of pending edits,
+they are applied to the session MOT by `MotSession.apply_edits` when a server callback needs the MOT
+"""
+
+
+class MotSession:
+    """ a MOT and its undo/redo history, hold `lock` while reading or modifying them """
+
+    __slots__ = ("session_id", "prototype_id", "mot", "history", "version", "edit_seq", "n_rejected", "positions",
+                 "layout_drift", "last_used", "lock")
+
+    def __init__(self, session_id: str, prototype_id: str, mot: nx.DiGraph, history: MotHistory):
+        self.session_id = session_id
+        self.prototype_id = prototype_id
+        self.mot = mot
+        self.history = history
+        self.version = 0  # bumped by every change of `mot` that is not made in the browser
+        self.edit_seq = 0  # sequence number of the last applied browser edit
+        self.n_rejected = 0  # browser edits that could not be applied
+        self.positions: Optional[MotPositions] = None  # node positions the browser has
+        self.layout_drift = 0  # nodes placed or removed since the last full layout
+        self.last_used = time.monotonic()
+        self.lock = threading.RLock()
+
+    def bump(self) -> int:
+        self.version += 1
+        return self.version
+
+    def apply_edits(self, pending: Optional[dict]) -> list[MotDelta]:
+        """
+        apply the browser edits that are not applied yet, each edit is an undo step,
+        an edit with an invalid value is skipped and counted in `n_rejected`
+
+        :param pending: {"seq": last sequence number, "edits": {key: {"seq", "op", "target", "value"}}},
+            the latest edit of every element attribute, `op` is `PtOpSetState` or `PtOpSetValue`,
+            `target` is a cytoscape element id
+        :return: the deltas applied to `mot`
+        """
+        if not pending:
+            return []
+        deltas = []
+        for edit in sorted(pending['edits'].values(), key=lambda e: e['seq']):
+            if edit['seq'] <= self.edit_seq:
+                continue
+            self.edit_seq = edit['seq']
+            target = tuple(int(i) for i in edit['target'].split())
+            if len(target) == 1:
+                target = target[0]
+                exists = target in self.mot
+            else:
+                exists = self.mot.has_edge(*target)
+            if not exists:
+                # e.g. the session was reloaded without the nodes the edit was made on
+                logger.warning(f"skipped an edit of a missing element: {edit}")
+                continue
+            delta = MotDelta(label=f"{edit['op']} of {edit['target']}")
+            try:
+                pt_apply_operations(self.mot, [PtOperation(edit['op'], target, edit['value'])], inplace=True,
+                                    delta=delta, validate=False)
+            except (ValueError, AssertionError) as e:
+                # the browser shows the edit, the version mismatch makes the next patch reset it
+                logger.warning(f"rejected an edit: {edit}, {e!r}")
+                self.n_rejected += 1
+                self.version += 1
+                continue
+            self.history.push(delta)
+            deltas.append(delta)
+            if delta.nodes_removed:
+                # a pruned placeholder is only shown in the browser by a patch, the version mismatch forces one
+                self.version += 1
+        return deltas
+
+
+class MotSessionStore:
+
+    def __init__(self, max_sessions: int = 64, ttl: float = 2 * 3600, history_max_depth: int = 100,
+                 history_max_bytes: int = 16 * 1024 * 1024):
+        assert max_sessions >= 1 and ttl > 0
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.history_max_depth = history_max_depth
+        self.history_max_bytes = history_max_bytes
+        self._sessions: OrderedDict[tuple[str, str], MotSession] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, key: tuple[str, str]):
+        return key in self._sessions
+
+    def _evict(self, now: float):
+        # least recently used first
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - session.last_used > self.ttl:
+                del self._sessions[key]
+                logger.info(f"dropped editor session {key}")
+            else:
+                break
+
+    def open(self, session_id: str, prototype_id: str, mot: nx.DiGraph, replace=True) -> MotSession:
+        """ start a session, an existing session with the same key is replaced, or returned if not `replace` """
+        session = MotSession(
+            session_id, prototype_id, mot,
+            MotHistory(max_depth=self.history_max_depth, max_bytes=self.history_max_bytes),
+        )
+        key = (session_id, prototype_id)
+        with self._lock:
+            existing = self._sessions.get(key)
+            if existing is not None and not replace:
+                existing.last_used = session.last_used
+                session = existing
+            else:
+                self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            self._evict(session.last_used)
+        return session
+
+    def get(self, session_id: str, prototype_id: str,
+            loader: Optional[Callable[[], nx.DiGraph]] = None) -> MotSession:
+        """ the session of a key, a missing session is opened with the MOT from `loader` or raises KeyError """
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get((session_id, prototype_id))
+            if session is not None:
+                session.last_used = now
+                self._sessions.move_to_end((session_id, prototype_id))
+                return session
+        if loader is None:
+            raise KeyError(f"no editor session: {(session_id, prototype_id)}")
+        logger.warning(f"editor session {(session_id, prototype_id)} expired, reloading the prototype")
+        # the loader runs without the lock, a concurrent callback may have reloaded the session meanwhile
+        return self.open(session_id, prototype_id, loader(), replace=False)
+
+    def drop(self, session_id: str, prototype_id: str):
+        with self._lock:
+            self._sessions.pop((session_id, prototype_id), None)
@@ -0,0 +1,32 @@
+import glob
+import json
+import os.path
+import timeit
+
+import networkx as nx
+
+from ord_betterproto import Reaction
+from ord_tree import read_file, get_mot, message_from_mot, compile_prototype
+
+"""
+`message_from_mot` vs an instantiation of a compiled template, run from `test/`
+
+    LOGURU_LEVEL=WARNING PYTHONPATH=.. python benchmark/prototype_template.py
+"""
+
+N = 200
+
+prototypes = dict()
+for jf in sorted(glob.glob("../prototype_editor/samples/sample_prototype_*.json")):
+    prototypes[os.path.basename(jf).replace(".json", "")] = nx.node_link_graph(json.loads(read_file(jf))['node_link_data'])
+prototypes["ORD_Reaction"] = get_mot(Reaction().from_json(read_file("fixture/ORD_Reaction.json")))
+
+print(f"{'prototype':<20} {'nodes':>6} {'message_from_mot':>17} {'compile':>9} {'instantiate':>12} {'speedup':>8}")
+for name, pt in prototypes.items():
+    t_mot = timeit.timeit(lambda: message_from_mot(pt), number=N) / N
+    t_compile = timeit.timeit(lambda: compile_prototype(pt), number=N) / N
+    template = compile_prototype(pt)
+    assert template.instantiate() == message_from_mot(pt)
+    t_template = timeit.timeit(template.instantiate, number=N) / N
+    print(f"{name:<20} {len(pt):>6} {t_mot * 1e3:>14.3f} ms {t_compile * 1e3:>6.3f} ms {t_template * 1e3:>9.3f} ms "
+          f"{t_mot / t_template:>7.1f}x")
@@ -1,12 +1,32 @@
+import csv
 import glob
+import gzip
 import json
 import os.path
+from copy import deepcopy
 
+import betterproto
 import networkx as nx
 import pytest
 
+import ord_betterproto
+from ord_betterproto.descriptors import get_message_descriptor, ContainerList, ContainerDict
+
 from ord_tree import OrdMessageClasses, read_file, import_string, get_mtt, write_dot, mtt_to_dict, write_file, \
-    mtt_from_dict, get_mot, mot_to_dict, mot_from_dict, message_from_mot
+    mtt_from_dict, get_mot, mot_to_dict, mot_from_dict, message_from_mot, get_registered_mtt, invalidate_mtt_registry, \
+    get_cmot, cmot_from_mot, cmot_to_mot, message_from_cmot, cmot_extend_node, cmot_remove_node, pt_extend_node, \
+    pt_remove_node, pt_detach_node, MotPathIndex, mot_get_path, ClassTable, ClassKindDict, ClassKindEnum, ClassKindMessage, \
+    BuiltinLiteralClasses, OrdEnumClasses, get_class_string, get_type_hints_without_private, \
+    is_default_message, MotView, iter_mots, get_mots, iter_dataset_reactions, mot_snapshot, mot_touch_node, \
+    PT_PLACEHOLDER, PT_PRESET, MotDelta, MotHistory, get_mot_delta, pt_apply_operations, PtOpExtend, PtOpRemove, \
+    PtOpSetValue, PtOpSetState, PtOpGraft, get_root, MotNextIdKey, mot_new_node_id, \
+    pt_graft_subtree, pt_validate, compile_prototype, get_placeholder_elements, SlotUnset, \
+    coerce_placeholder_value, DoeRange, DoeFactorial, \
+    DoeLatinHypercube, DoeRandom, iter_design, iter_doe_instances, iter_doe_datasets, DatasetWriter, \
+    write_dataset_reactions, normalize_units, gather_unit_leaves, get_unit_paths, get_structure_hash, \
+    get_mot_positions, MotLayoutCache, dump_positions, load_positions, place_new_nodes
+from ord_tree.instantiate import iter_instances, iter_table_rows, PrototypeInstantiator, main as main_instantiate
+from prototype_editor.dash_app_support.mot_store import MotSession, MotSessionStore
 
 
 @pytest.fixture
@@ -20,6 +40,21 @@ def ord_jsons():
     return d
 
 
+@pytest.fixture
+def sample_prototypes():
+    d = dict()
+    for jf in sorted(glob.glob("../prototype_editor/samples/sample_prototype_*.json")):
+        doc = json.loads(read_file(jf))
+        d[os.path.basename(jf).replace(".json", "")] = nx.node_link_graph(doc['node_link_data'])
+    return d
+
+
+def same_elements(a: nx.DiGraph, b: nx.DiGraph) -> bool:
+    """ same nodes and edges with the same attributes, graph attributes like the id counter are ignored """
+    return dict(a.nodes(data=True)) == dict(b.nodes(data=True)) and \
+        {(u, v): d for u, v, d in a.edges(data=True)} == {(u, v): d for u, v, d in b.edges(data=True)}
+
+
 class TestOrdBetterproto:
 
     def test__init(self):
@@ -33,6 +68,29 @@ class TestOrdBetterproto:
             js_rec = msg.to_json(indent=2)
             assert js_rec == js
 
+    def test__descriptors(self):
+        for c in OrdMessageClasses:
+            descriptor = get_message_descriptor(c)
+            assert descriptor is get_message_descriptor(c)
+            m = c()
+            assert [f.name for f in descriptor.sorted_fields] == list(m._betterproto.sorted_field_names)
+            assert [f.name for f in descriptor.fields] == list(get_type_hints_without_private(c))
+            for f in descriptor.fields:
+                assert f.default == m._get_field_default(f.name)
+                assert f.oneof_group == m._betterproto.oneof_group_by_field.get(f.name)
+
+    def test__class_table(self):
+        for c in [*BuiltinLiteralClasses, list, dict, *OrdEnumClasses, *OrdMessageClasses]:
+            entry = ClassTable.by_class(c)
+            assert entry is ClassTable.by_string(get_class_string(c))
+            assert entry is ClassTable[ClassTable.intern(entry.class_string)]
+            assert entry.cls is import_string(entry.class_string)
+            assert entry.is_literal == (c in BuiltinLiteralClasses + OrdEnumClasses)
+        assert ClassTable.by_class(dict).kind == ClassKindDict
+        assert ClassTable.by_class(ord_betterproto.Reaction).kind == ClassKindMessage
+        with pytest.raises(TypeError):
+            ClassTable.by_class(set)
+
 
 class TestOrdTree:
 
@@ -45,6 +103,16 @@ class TestOrdTree:
             mtt_dict = mtt_to_dict(mtt)
             write_file(json.dumps(mtt_dict), f"output/mtt_{t}.json")
 
+    def test__registered_mtt(self):
+        for t in ["Reaction", "ProductCompound"]:
+            m = import_string(f"ord_betterproto.{t}")
+            mtt = get_registered_mtt(m)
+            assert nx.is_frozen(mtt)
+            assert mtt is get_registered_mtt(m)
+            assert mtt_to_dict(mtt) == mtt_to_dict(get_mtt(m))
+            invalidate_mtt_registry(m)
+            assert mtt is not get_registered_mtt(m)
+
     def test__mtt_json_load(self, ord_jsons):
         for t, js in ord_jsons.items():
             mtt_json_file = f"output/mtt_{t}.json"
@@ -61,6 +129,35 @@ class TestOrdTree:
             d = mot_to_dict(mot)
             write_file(json.dumps(d, indent=2), f"output/mot_{t}.json")
 
+    def test__mot_view(self, ord_jsons):
+        for t, js in ord_jsons.items():
+            message = import_string(f"ord_betterproto.{t}")().from_json(js)
+            mot = get_mot(message)
+            view = MotView(message)
+            assert view.root._children is None
+            assert nx.node_link_data(view.to_mot()) == nx.node_link_data(mot)
+            for node in view.iter_preorder():
+                n = next(n for n, d in mot.nodes(data=True) if d['mtt_element_name'] == node.mtt_element_name)
+                assert mot.nodes[n]['mot_class_string'] == node.mot_class_string
+        view = MotView(import_string("ord_betterproto.Reaction")().from_json(ord_jsons["Reaction"]))
+        node = view.get("workups", 0, "type")
+        assert node.mtt_element_name == "<ROOT>|workups|<ListIndex>|type"
+        assert node.mot_value == view.message.workups[0].type
+        assert view.get("inputs", "dichloromethane").mtt_element_name == "<ROOT>|inputs|<DictKey>"
+        # only the visited paths are converted
+        assert view.root["outcomes"]._children is None
+
+    def test__iter_mots(self, ord_jsons):
+        reaction = import_string("ord_betterproto.Reaction")().from_json(ord_jsons["Reaction"])
+        reactions = [reaction, import_string("ord_betterproto.Reaction")()] * 3
+        expected = [nx.node_link_data(get_mot(r)) for r in reactions]
+        dataset = ord_betterproto.Dataset(reactions=reactions)
+        assert [nx.node_link_data(mot) for mot in iter_mots(dataset, processes=2, chunksize=2)] == expected
+        unordered = dict(iter_mots(iter(reactions), processes=2, chunksize=4, ordered=False))
+        assert [nx.node_link_data(unordered[i]) for i in range(len(reactions))] == expected
+        cmots = get_mots(reactions, processes=1, compact=True)
+        assert [nx.node_link_data(cmot_to_mot(cmot)) for cmot in cmots] == expected
+
     def test__mot_json_load(self, ord_jsons):
         for t, js in ord_jsons.items():
             msg = import_string(f"ord_betterproto.{t}")
@@ -72,3 +169,629 @@ class TestOrdTree:
             assert nx.is_arborescence(mot)
             m = message_from_mot(mot)
             assert m.to_json() == message.to_json()
+
+    def test__is_default_message(self, ord_jsons):
+        def is_default_message_deep(message):
+            # the deep comparison, on a copy as getattr materializes defaults
+            message = deepcopy(message)
+            return all(
+                getattr(message, f) == message._get_field_default(f) for f in message._betterproto.sorted_field_names
+            )
+
+        def sample_values(field):
+            c = field.child_class
+            if c in OrdMessageClasses:
+                v = c()
+            elif c in OrdEnumClasses:
+                v = c(max(e.value for e in c))
+            else:
+                v = c(1)
+            if field.container == ContainerList:
+                return [[], [v]]
+            elif field.container == ContainerDict:
+                return [{}, {"k": v}]
+            return [field.default, v]
+
+        messages = []
+        for c in OrdMessageClasses:
+            messages.append(c())
+            for field in get_message_descriptor(c).fields:
+                for v in sample_values(field):
+                    m = c()
+                    setattr(m, field.name, v)
+                    messages.append(m)
+        # and all nested messages in the fixtures
+        stack = [import_string(f"ord_betterproto.{t}")().from_json(js) for t, js in ord_jsons.items()]
+        while stack:
+            m = stack.pop()
+            messages.append(m)
+            for field in get_message_descriptor(m.__class__).fields:
+                v = m._Message__raw_get(field.name)
+                if v is betterproto.PLACEHOLDER:
+                    continue
+                if field.container == ContainerList:
+                    stack += [x for x in v if x.__class__ in OrdMessageClasses]
+                elif field.container == ContainerDict:
+                    stack += [x for x in v.values() if x.__class__ in OrdMessageClasses]
+                elif v.__class__ in OrdMessageClasses:
+                    stack.append(v)
+        for m in messages:
+            assert is_default_message(m) == is_default_message_deep(m)
+
+    def test__message_from_prototype(self, sample_prototypes):
+        for name, pt in sample_prototypes.items():
+            pt_data = nx.node_link_data(pt)
+            m = message_from_mot(pt)
+            # the prototype is not modified by reconstruction
+            assert nx.node_link_data(pt) == pt_data
+            if len(pt) > 1:
+                assert m.__class__ in OrdMessageClasses
+
+    def test__path_index(self, sample_prototypes):
+        def assert_index(mot, path_index):
+            assert set(path_index.paths) == set(mot.nodes)
+            for n in mot.nodes:
+                for delimiter in ("default", "arrow", "dot"):
+                    for with_node in (True, False):
+                        for remove_last in (True, False):
+                            kwargs = dict(delimiter=delimiter, with_node=with_node, remove_last=remove_last)
+                            assert mot_get_path(mot, n, path_index=path_index, **kwargs) == \
+                                   mot_get_path(mot, n, **kwargs)
+
+        pt = sample_prototypes["sample_prototype_1"]
+        path_index = MotPathIndex(pt)
+        assert_index(pt, path_index)
+
+        pt = pt_extend_node(pt, 0, path_index=path_index)
+        assert_index(pt, path_index)
+        # remove an element of a list so its siblings are reindexed
+        list_node = [n for n in pt.nodes if pt.nodes[n]['mot_class_string'] == "builtins.list"
+                     and pt.out_degree(n) > 2][0]
+        pt_remove_node(pt, next(pt.successors(list_node)), inplace=True, path_index=path_index)
+        assert_index(pt, path_index)
+        pt = pt_detach_node(pt, list_node, path_index=path_index)
+        assert_index(pt, path_index)
+
+    def test__pt_snapshots(self, sample_prototypes):
+        pt = max(sample_prototypes.values(), key=len)
+        list_node = [n for n in pt.nodes if pt.nodes[n]['mot_class_string'] == "builtins.list"
+                     and pt.out_degree(n) > 2][0]
+        versions = [pt]
+        versions.append(pt_extend_node(versions[-1], list_node))
+        versions.append(pt_remove_node(versions[-1], next(versions[-1].successors(list_node))))
+        versions.append(pt_detach_node(versions[-1], list_node))
+        snapshot = mot_snapshot(versions[-1])
+        pt_extend_node(snapshot, list_node, inplace=True)
+        pt_remove_node(snapshot, next(snapshot.successors(list_node)), inplace=True)
+        mot_touch_node(snapshot, list_node)['mot_state'] = PT_PLACEHOLDER
+        versions.append(snapshot)
+        # old versions are not modified by operations on later ones
+        for v in versions[:-1]:
+            expected = deepcopy(v)
+            for u in versions:
+                pt_extend_node(mot_snapshot(u), list_node, inplace=True)
+                pt_remove_node(mot_snapshot(u), next(u.successors(list_node)), inplace=True)
+                pt_detach_node(mot_snapshot(u), list_node, inplace=True)
+            assert nx.node_link_data(v) == nx.node_link_data(expected)
+        for v in versions:
+            assert nx.is_arborescence(v)
+            assert nx.node_link_data(cmot_to_mot(cmot_from_mot(v))) == nx.node_link_data(v)
+        assert pt.nodes[list_node]['mot_state'] != PT_PLACEHOLDER
+
+    def test__mot_history(self, sample_prototypes):
+        pt = max(sample_prototypes.values(), key=len)
+        list_node = [n for n in pt.nodes if pt.nodes[n]['mot_class_string'] == "builtins.list"
+                     and pt.out_degree(n) > 2][0]
+        original = deepcopy(pt)
+        mot = mot_snapshot(pt)
+        history = MotHistory()
+        versions = [deepcopy(mot)]
+        for op, node in [
+            (pt_extend_node, list_node),
+            (pt_remove_node, next(mot.successors(list_node))),
+            (pt_extend_node, list_node),
+            (pt_detach_node, list_node),
+        ]:
+            delta = MotDelta()
+            op(mot, node, inplace=True, delta=delta)
+            history.push(delta)
+            versions.append(deepcopy(mot))
+        # edits outside `pt_*` operations are recorded by diffing
+        before = mot_snapshot(mot)
+        mot_touch_node(mot, list_node)['mot_state'] = PT_PLACEHOLDER
+        history.push(get_mot_delta(before, mot, nodes=[list_node]))
+        versions.append(deepcopy(mot))
+
+        for v in reversed(versions[:-1]):
+            assert history.undo(mot)
+            assert same_elements(mot, v)
+        assert not history.undo(mot)
+        assert same_elements(pt, original)
+        for v in versions[1:]:
+            assert history.redo(mot)
+            assert same_elements(mot, v)
+        assert not history.redo(mot)
+        # undo and redo return the delta they applied to the MOT
+        undone = history.undo(mot)
+        assert undone.nodes_changed == history.redo_stack[-1].inverted().nodes_changed
+        assert history.redo(mot) is history.undo_stack[-1]
+        assert same_elements(mot, versions[-1])
+        # merged deltas give the same MOT as the deltas applied in order
+        merged = MotDelta()
+        for d in history.undo_stack:
+            merged.merge(d)
+        merged_mot = mot_snapshot(pt)
+        merged.apply(merged_mot)
+        assert same_elements(merged_mot, versions[-1])
+        assert same_elements(pt, original)
+        # undo does not rewind the id counter, ids of removed nodes are not reused
+        assert mot.graph[MotNextIdKey] > max(n for v in versions for n in v.nodes)
+
+        # a new edit clears redo, limits drop the oldest edits
+        history.undo(mot)
+        history.push(get_mot_delta(mot, versions[-1]))
+        assert not history.can_redo()
+        history.max_depth = 2
+        history.push(get_mot_delta(versions[-1], mot))
+        assert len(history.undo_stack) == 2
+        history.max_bytes = 0
+        history.push(get_mot_delta(mot, versions[-1]))
+        assert len(history.undo_stack) == 0 and history.nbytes == 0
+
+    def test__mot_new_node_id(self, ord_jsons, sample_prototypes):
+        mot = get_mot(ord_betterproto.Reaction().from_json(ord_jsons["Reaction"]))
+        assert mot.graph[MotNextIdKey] == len(mot)
+        mot = nx.node_link_graph(json.loads(json.dumps(nx.node_link_data(mot))))
+        assert mot.graph[MotNextIdKey] == len(mot)
+        # ids of removed nodes are not reused, also for prototypes saved without a counter
+        pt = max(sample_prototypes.values(), key=len)
+        assert MotNextIdKey not in pt.graph
+        list_node = [n for n in pt.nodes if pt.nodes[n]['mot_class_string'] == "builtins.list"][0]
+        extended = pt_extend_node(pt, list_node)
+        new_child = max(extended.nodes)
+        assert MotNextIdKey not in pt.graph
+        pt_remove_node(extended, new_child, inplace=True)
+        pt_extend_node(extended, list_node, inplace=True)
+        assert max(extended.nodes) == new_child + 1
+        assert mot_new_node_id(extended) == new_child + 2
+        extended.add_node(new_child + 3)
+        assert mot_new_node_id(extended) == new_child + 4
+
+    def test__pt_apply_operations(self, sample_prototypes):
+        pt = max(sample_prototypes.values(), key=len)
+        list_node = [n for n in pt.nodes if pt.nodes[n]['mot_class_string'] == "builtins.list"
+                     and pt.out_degree(n) > 2][0]
+        literal = [n for n in pt.nodes if pt.nodes[n]['mot_can_edit'] and pt.nodes[n]['mot_class_string'] == "builtins.str"][0]
+        expected = pt_extend_node(pt, list_node)
+        new_child = max(expected.nodes)
+        pt_extend_node(expected, new_child, inplace=True)
+        pt_remove_node(expected, next(expected.successors(list_node)), inplace=True)
+        expected.nodes[literal]['mot_value'] = "value"
+        expected.nodes[literal]['mot_state'] = PT_PRESET
+        operations = [
+            (PtOpExtend, list_node),
+            (PtOpExtend, new_child),
+            (PtOpRemove, next(pt.successors(list_node))),
+            (PtOpSetValue, literal, "value"),
+            (PtOpSetState, literal, PT_PRESET),
+        ]
+        delta = MotDelta()
+        batched = pt_apply_operations(pt, operations, delta=delta)
+        assert same_elements(batched, expected)
+        delta.revert(batched)
+        assert same_elements(batched, pt)
+
+        with pytest.raises(ValueError):
+            pt_apply_operations(pt, [(PtOpSetValue, list_node, "value")])
+        # targets are checked before an operation is applied
+        with pytest.raises(ValueError):
+            pt_apply_operations(pt, [(PtOpRemove, max(pt.nodes) + 1)])
+        with pytest.raises(ValueError):
+            pt_apply_operations(pt, [(PtOpSetValue, [literal, list_node], "value")])
+
+        # values are coerced to the class of the node, enums by name or value
+        enum_node = [n for n in pt.nodes if pt.nodes[n]['mot_can_edit']
+                     and ClassTable.by_string(pt.nodes[n]['mot_class_string']).kind == ClassKindEnum][0]
+        enum_cls = ClassTable.by_string(pt.nodes[enum_node]['mot_class_string']).cls
+        member = list(enum_cls)[1]
+        for value in (member.name, str(member.value), member.value):
+            batched = pt_apply_operations(pt, [(PtOpSetValue, enum_node, value)])
+            assert batched.nodes[enum_node]['mot_value'] is member
+        with pytest.raises(ValueError):
+            pt_apply_operations(pt, [(PtOpSetValue, enum_node, "value")])
+        with pytest.raises(ValueError):
+            pt_apply_operations(pt, [(PtOpSetValue, literal, {"value": 1})])
+        invalid = deepcopy(pt)
+        invalid.nodes[enum_node]['mot_value'] = "value"
+        invalid.nodes[enum_node]['mot_state'] = PT_PRESET
+        with pytest.raises(ValueError):
+            pt_validate(invalid)
+
+    def test__pt_graft_subtree(self, sample_prototypes):
+        pt = sample_prototypes["sample_prototype_1"]
+        donor = sample_prototypes["sample_prototype_4"]
+        donor_root = get_root(donor)
+        # a new compound under a different path than the one the donor is detached from
+        components = [n for n, name in pt.nodes(data='mtt_element_name')
+                      if name.endswith("|components") and not name.startswith("<ROOT>|inputs")][0]
+        pt = pt_extend_node(pt, components)
+        target = max(pt.nodes)
+        assert pt.nodes[target]['mot_class_string'] == donor.nodes[donor_root]['mot_class_string']
+        donor_data = nx.node_link_data(donor)
+
+        delta = MotDelta()
+        grafted = pt_graft_subtree(pt, target, donor, delta=delta)
+        assert nx.node_link_data(donor) == donor_data
+        assert len(grafted) == len(pt) + len(donor) - 1
+        pt_validate(grafted)
+        mtt = get_registered_mtt(ord_betterproto.Reaction)
+        assert all(d['mtt_element_name'] in mtt for _, d in grafted.nodes(data=True))
+        target_path = grafted.nodes[target]['mtt_element_name']
+        assert all(grafted.nodes[n]['mtt_element_name'].startswith(target_path) for n in nx.descendants(grafted, target))
+        assert message_from_mot(grafted).inputs is not None
+        assert nx.is_isomorphic(
+            nx.subgraph(grafted, nx.descendants(grafted, target) | {target}), donor,
+            node_match=lambda a, b: a['mot_class_string'] == b['mot_class_string'] and a['mot_value'] == b['mot_value']
+        )
+        delta.revert(grafted)
+        assert same_elements(grafted, pt)
+
+        # the donor root must be of the class of the target, which must be a leaf
+        with pytest.raises(ValueError):
+            pt_graft_subtree(pt, next(pt.successors(components)), donor)
+        with pytest.raises(ValueError):
+            pt_graft_subtree(pt, components, donor)
+        leaf = [n for n, d in pt.nodes(data=True) if pt.out_degree(n) == 0 and d['mot_class_string'] == "builtins.str"][0]
+        with pytest.raises(ValueError):
+            pt_graft_subtree(pt, leaf, donor)
+        # a failed graft does not modify the prototype
+        bad_donor = deepcopy(donor)
+        bad_leaf = max(n for n in bad_donor.nodes if bad_donor.out_degree(n) == 0)
+        bad_donor.nodes[bad_leaf]['mtt_element_name'] += "|unknown"
+        kept = deepcopy(pt)
+        with pytest.raises(ValueError):
+            pt_graft_subtree(kept, target, bad_donor, inplace=True)
+        assert same_elements(kept, pt)
+        # batched
+        grafted = pt_apply_operations(pt, [(PtOpGraft, target, donor)])
+        assert len(grafted) == len(pt) + len(donor) - 1
+
+
+class TestCompactMot:
+
+    def test__get_cmot(self, ord_jsons):
+        for t, js in ord_jsons.items():
+            m = import_string(f"ord_betterproto.{t}")
+            message = m().from_json(js)
+            cmot = get_cmot(message)
+            assert nx.node_link_data(cmot_to_mot(cmot)) == nx.node_link_data(get_mot(message))
+            assert message_from_cmot(cmot) == message
+
+    def test__cmot_prototype(self, sample_prototypes):
+        for name, pt in sample_prototypes.items():
+            cmot = cmot_from_mot(pt)
+            assert nx.node_link_data(cmot_to_mot(cmot)) == nx.node_link_data(pt)
+            assert message_from_cmot(cmot) == message_from_mot(pt)
+            for n in list(pt.nodes)[:20]:
+                assert nx.node_link_data(cmot_to_mot(cmot_extend_node(cmot, n))) == \
+                       nx.node_link_data(pt_extend_node(pt, n))
+                if pt.in_degree(n) == 1:
+                    assert nx.node_link_data(cmot_to_mot(cmot_remove_node(cmot, n))) == \
+                           nx.node_link_data(pt_remove_node(pt, n))
+
+
+class TestLayout:
+
+    def test__mot_layout(self, sample_prototypes):
+        pt = max(sample_prototypes.values(), key=len)
+        positions = get_mot_positions(pt)
+        assert positions.keys() == set(pt.nodes)
+        # top-down, y grows downwards
+        for u, v in pt.edges:
+            assert positions[u][1] < positions[v][1]
+        assert load_positions(json.loads(json.dumps(dump_positions(positions)))) == positions
+
+        # the hash ignores values and states, not the structure
+        mot = mot_snapshot(pt)
+        leaf = next(n for n in pt.nodes if pt.out_degree(n) == 0)
+        mot_touch_node(mot, leaf)['mot_value'] = "changed"
+        assert get_structure_hash(mot) == get_structure_hash(pt)
+        list_node = next(n for n in pt.nodes if pt.nodes[n]['mot_class_string'] == "builtins.list")
+        delta = MotDelta()
+        pt_extend_node(mot, list_node, inplace=True, delta=delta)
+        assert get_structure_hash(mot) != get_structure_hash(pt)
+
+        # new nodes are placed below their parents, right of their siblings, nothing else moves
+        placed = place_new_nodes(mot, positions, delta.nodes_added)
+        assert placed.keys() == set(mot.nodes)
+        assert all(placed[n] == p for n, p in positions.items())
+        for n in delta.nodes_added:
+            parent = next(mot.predecessors(n))
+            assert placed[n][1] > placed[parent][1]
+            assert all(placed[n][0] > placed[s][0] for s in mot.successors(parent) if s not in delta.nodes_added)
+
+        cache = MotLayoutCache(max_size=1)
+        h, cached = cache.get(pt)
+        assert cached == positions and h in cache
+        assert cache.get(pt)[1] is cached
+        cache.get(mot)
+        assert len(cache) == 1 and h not in cache
+
+
+class TestMotSession:
+
+    def test__apply_edits(self, sample_prototypes):
+        pt = sample_prototypes["sample_prototype_1"]
+        session = MotSession("session", "prototype", mot_snapshot(pt), MotHistory())
+        float_node = next(n for n, d in pt.nodes(data=True)
+                          if d['mot_can_edit'] and d['mot_class_string'] == "builtins.float")
+        str_node = next(n for n, d in pt.nodes(data=True)
+                        if d['mot_can_edit'] and d['mot_class_string'] == "builtins.str")
+
+        # an invalid value is rejected, later edits are applied and the version mismatch resets the client
+        pending = {"seq": 2, "edits": {
+            f"set_value {float_node}": {"seq": 1, "op": PtOpSetValue, "target": str(float_node), "value": "abc"},
+            f"set_value {str_node}": {"seq": 2, "op": PtOpSetValue, "target": str(str_node), "value": "value"},
+        }}
+        deltas = session.apply_edits(pending)
+        assert len(deltas) == 1 and session.edit_seq == 2
+        assert session.n_rejected == 1 and session.version == 1
+        assert session.mot.nodes[float_node]['mot_value'] == pt.nodes[float_node]['mot_value']
+        assert session.mot.nodes[str_node]['mot_value'] == "value"
+
+        # edits are applied by sequence number, once, edits of missing elements are skipped
+        missing = max(pt.nodes) + 1
+        pending = {"seq": 5, "edits": {
+            **pending['edits'],
+            f"set_state {str_node}": {"seq": 5, "op": PtOpSetState, "target": str(str_node), "value": PT_PLACEHOLDER},
+            f"set_value {missing}": {"seq": 4, "op": PtOpSetValue, "target": str(missing), "value": "value"},
+            f"set_value {str_node}": {"seq": 3, "op": PtOpSetValue, "target": str(str_node), "value": "other"},
+        }}
+        deltas = session.apply_edits(pending)
+        assert [d.label for d in deltas] == [f"set_value of {str_node}", f"set_state of {str_node}"]
+        assert session.edit_seq == 5 and session.version == 1
+        assert session.mot.nodes[str_node]['mot_value'] == "other"
+        assert session.mot.nodes[str_node]['mot_state'] == PT_PLACEHOLDER
+        assert session.apply_edits(pending) == []
+
+        # a non-literal placeholder is pruned, the version is bumped for the browser to get a patch
+        parent = next(n for n in pt.nodes if pt.out_degree(n) > 0 and pt.nodes[n]['mot_state'] == PT_PRESET
+                      and n != get_root(pt))
+        pending = {"seq": 6, "edits": {
+            f"set_state {parent}": {"seq": 6, "op": PtOpSetState, "target": str(parent), "value": PT_PLACEHOLDER},
+        }}
+        deltas = session.apply_edits(pending)
+        assert len(deltas) == 1 and deltas[0].nodes_removed
+        assert session.version == 2 and session.mot.out_degree(parent) == 0
+
+    def test__session_store(self, sample_prototypes):
+        pt = sample_prototypes["sample_prototype_1"]
+        store = MotSessionStore(max_sessions=2, ttl=60)
+        a = store.open("a", "prototype", mot_snapshot(pt))
+        store.open("b", "prototype", mot_snapshot(pt))
+        # a is used last, b is dropped
+        assert store.get("a", "prototype") is a
+        store.open("c", "prototype", mot_snapshot(pt))
+        assert len(store) == 2 and ("b", "prototype") not in store and ("a", "prototype") in store
+        with pytest.raises(KeyError):
+            store.get("b", "prototype")
+
+        # sessions not used within the ttl are dropped and reloaded
+        a.last_used -= 61
+        loaded = []
+        reloaded = store.get("a", "prototype", loader=lambda: loaded.append(1) or mot_snapshot(pt))
+        assert reloaded is not a and loaded == [1] and reloaded.edit_seq == 0
+
+        # a session reloaded by a concurrent callback while loading is kept
+        store.drop("a", "prototype")
+
+        def loader():
+            inner.append(store.get("a", "prototype", loader=lambda: mot_snapshot(pt)))
+            return mot_snapshot(pt)
+
+        inner = []
+        outer = store.get("a", "prototype", loader=loader)
+        assert outer is inner[0] and store.get("a", "prototype") is outer
+
+
+class TestUnits:
+
+    def test__normalize_units(self, ord_jsons):
+        reaction = ord_betterproto.Reaction().from_json(ord_jsons["Reaction"])
+        path = "inputs|<DictKey>|components|<ListIndex>|amount|volume"
+        assert "<ROOT>|" + path in get_unit_paths(ord_betterproto.Reaction)
+        reactions = [deepcopy(reaction) for _ in range(4)]
+        volumes = gather_unit_leaves(reactions, path).messages
+        assert len(volumes) == 4 * len(gather_unit_leaves([reaction], path).messages)
+        volumes[0].value, volumes[0].units, volumes[0].precision = 2, ord_betterproto.VolumeUnit.LITER, 0.5
+        volumes[1].value, volumes[1].units = 3, ord_betterproto.VolumeUnit.UNSPECIFIED
+        volumes[2].value, volumes[2].units = None, ord_betterproto.VolumeUnit.LITER
+        volumes[3].value, volumes[3].units = 4, ord_betterproto.VolumeUnit.MICROLITER
+        unit = ord_betterproto.VolumeUnit
+        expected = [(2000, 500, unit.MILLILITER), (3, None, unit.UNSPECIFIED), (None, None, unit.LITER),
+                    (4e-3, None, unit.MILLILITER)]
+        n_converted = len(volumes) - 2
+        assert normalize_units(reactions, path, ord_betterproto.VolumeUnit.MILLILITER) == n_converted
+        for v, (value, precision, units) in zip(volumes, expected):
+            assert v.value == pytest.approx(value) if value is not None else v.value is None
+            assert v.precision == pytest.approx(precision) if precision is not None else v.precision is None
+            assert v.units == units
+
+        temperature = ord_betterproto.Reaction()
+        temperature.conditions.temperature.setpoint = ord_betterproto.Temperature(
+            value=212, precision=9, units=ord_betterproto.TemperatureUnit.FAHRENHEIT
+        )
+        assert normalize_units([temperature], "conditions|temperature|setpoint") == 1
+        setpoint = temperature.conditions.temperature.setpoint
+        assert (setpoint.value, setpoint.precision, setpoint.units) == \
+               (pytest.approx(100), pytest.approx(5), ord_betterproto.TemperatureUnit.CELSIUS)
+
+        with pytest.raises(AssertionError):
+            normalize_units(reactions, "inputs|<DictKey>|components")
+
+
+class TestDatasetIO:
+
+    def test__iter_dataset_reactions(self, ord_jsons, tmp_path):
+        reaction = ord_betterproto.Reaction().from_json(ord_jsons["Reaction"])
+        reactions = [reaction, ord_betterproto.Reaction(), reaction]
+        dataset = ord_betterproto.Dataset(name="name", reactions=reactions, reaction_ids=["a", "b"], dataset_id="id")
+        with open(tmp_path / "dataset.pb", "wb") as f:
+            f.write(bytes(dataset))
+        with gzip.open(tmp_path / "dataset.pb.gz", "wb") as f:
+            f.write(bytes(dataset))
+        write_file(dataset.to_json(indent=2), tmp_path / "dataset.json")
+        with gzip.open(tmp_path / "dataset.json.gz", "wt") as f:
+            f.write(dataset.to_json())
+        write_file("\n".join(r.to_json() for r in reactions), tmp_path / "dataset.ndjson")
+
+        # empty messages are not serialized in binary
+        expected_pb = [bytes(r) for r in ord_betterproto.Dataset().parse(bytes(dataset)).reactions]
+        for fn in ["dataset.pb", "dataset.pb.gz"]:
+            assert [bytes(r) for r in iter_dataset_reactions(tmp_path / fn)] == expected_pb
+        for fn in ["dataset.json", "dataset.json.gz", "dataset.ndjson"]:
+            assert list(iter_dataset_reactions(tmp_path / fn)) == reactions
+
+    def test__dataset_writer(self, ord_jsons, tmp_path):
+        reaction = ord_betterproto.Reaction().from_json(ord_jsons["Reaction"])
+        reactions = [deepcopy(reaction) for _ in range(5)]
+        for i, r in enumerate(reactions):
+            r.reaction_id = f"ord-{i}"
+        header = ord_betterproto.Dataset(name="writer", description="chunks")
+        # empty messages are not serialized in binary
+        expected = [bytes(r) for r in reactions]
+        for ext in ("pb", "pb.gz", "json", "json.gz", "ndjson", "ndjson.gz"):
+            fn = tmp_path / f"dataset.{ext}"
+            assert write_dataset_reactions(fn, iter(reactions), chunksize=2, dataset=header) == 5
+            assert [bytes(r) for r in iter_dataset_reactions(fn)] == expected
+            if not ext.startswith("ndjson"):
+                f = gzip.open(fn, "rb") if ext.endswith(".gz") else open(fn, "rb")
+                with f:
+                    data = f.read()
+                dataset = ord_betterproto.Dataset().parse(data) if ext.startswith("pb") else \
+                    ord_betterproto.Dataset().from_json(data)
+                assert dataset.name == "writer" and [bytes(r) for r in dataset.reactions] == expected
+            if ext.startswith("json"):
+                continue
+            with DatasetWriter(fn, chunksize=10, append=True) as writer:
+                writer.write(reactions[0])
+                # chunks are on disk once flushed, before the writer is closed
+                writer.flush()
+                assert len(list(iter_dataset_reactions(fn))) == 6
+                writer.write(reactions[1])
+            assert [bytes(r) for r in iter_dataset_reactions(fn)] == expected + expected[:2]
+
+
+class TestInstantiate:
+
+    def test__iter_instances(self, sample_prototypes, tmp_path):
+        pt = sample_prototypes["sample_prototype_1"]
+        volume_path = "inputs|<DictKey>dichloromethane|components|<ListIndex>0|amount|volume|value"
+        table = {
+            volume_path: [1.5, "2.5", ""],
+            "8": ["CCl", "C(Cl)Cl", None],
+            "7": ["SMILES", "3", 2],
+            "61": ["false", "true", ""],
+            "1 2": ["dcm", "solvent", ""],
+        }
+        expected = []
+        for row in iter_table_rows(table):
+            m = message_from_mot(pt)
+            reaction_input = m.inputs.pop("dichloromethane")
+            component = reaction_input.components[0]
+            component.amount.volume.value = float(row[volume_path] or 250)
+            component.identifiers[0].value = row["8"] or "C(Cl)Cl"
+            component.identifiers[0].type = ord_betterproto.CompoundIdentifierType.SMILES if row["7"] != "3" \
+                else ord_betterproto.CompoundIdentifierType(3)
+            m.inputs["N,N-dibenzylhydroxylamine"].components[0].is_limiting = row["61"] != "false"
+            m.inputs[row["1 2"] or "dichloromethane"] = reaction_input
+            expected.append(m)
+        assert [m.to_dict() for m in iter_instances(pt, table)] == [m.to_dict() for m in expected]
+
+        fn = tmp_path / "table.csv"
+        with open(fn, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(list(table))
+            writer.writerows(zip(*table.values()))
+        assert [m.to_dict() for m in iter_instances(pt, fn, processes=2, chunksize=1)] == \
+               [m.to_dict() for m in expected]
+
+        pt_fn = tmp_path / "prototype.json"
+        write_file(json.dumps({"node_link_data": nx.node_link_data(pt)}), pt_fn)
+        main_instantiate([str(pt_fn), str(fn), "-o", str(tmp_path / "reactions.ndjson")])
+        assert [m.to_dict() for m in iter_dataset_reactions(tmp_path / "reactions.ndjson")] == \
+               [m.to_dict() for m in expected]
+
+        with pytest.raises(AssertionError):
+            PrototypeInstantiator(pt, ["0"])
+        with pytest.raises(KeyError):
+            PrototypeInstantiator(pt, ["inputs|no such path"])
+
+        # ints are not truncated
+        assert coerce_placeholder_value("3.0", "builtins.int") == 3
+        assert coerce_placeholder_value(" 12345678901234567891 ", "builtins.int") == 12345678901234567891
+        for value in ("3.7", 3.7, "nan"):
+            with pytest.raises(ValueError):
+                coerce_placeholder_value(value, "builtins.int")
+
+    def test__prototype_template(self, ord_jsons, sample_prototypes):
+        prototypes = dict(sample_prototypes)
+        prototypes["Reaction"] = get_mot(ord_betterproto.Reaction().from_json(ord_jsons["Reaction"]))
+        for name, pt in prototypes.items():
+            template = compile_prototype(pt)
+            assert template.slots == get_placeholder_elements(pt)
+            m = template.instantiate()
+            assert m == message_from_mot(pt)
+            if m is not None:
+                assert m._group_current == message_from_mot(pt)._group_current
+                assert template.instantiate() is not m
+
+        pt = sample_prototypes["sample_prototype_1"]
+        slots = [8, 61, (1, 2)]
+        template = compile_prototype(pt, slots)
+        expected_pt = pt.copy()
+        expected_pt.nodes[8]['mot_value'] = "CCl"
+        expected_pt.nodes[61]['mot_value'] = False
+        expected_pt.edges[(1, 2)]['mot_value'] = "dcm"
+        assert template.instantiate(["CCl", False, "dcm"]) == message_from_mot(expected_pt)
+        assert template.instantiate({8: "CCl", (1, 2): "dcm", 61: False}) == message_from_mot(expected_pt)
+        # unset slots keep the prototype values
+        assert template.instantiate([None, None]) == message_from_mot(pt)
+        # unless they are set to `SlotUnset`
+        expected_pt = pt.copy()
+        expected_pt.nodes[8]['mot_value'] = None
+        assert template.instantiate({8: SlotUnset}) == message_from_mot(expected_pt)
+        assert 8 in template and (1, 2) in template and 1 not in template
+
+        m1 = template.instantiate()
+        m2 = template.instantiate()
+        m1.inputs["dichloromethane"].components[0].identifiers[0].value = "CCl"
+        assert m2 == message_from_mot(pt)
+
+        with pytest.raises(AssertionError):
+            compile_prototype(pt, [1])
+
+    def test__doe(self, sample_prototypes):
+        factors = [DoeRange(0, 1, levels=3), ["a", "b"]]
+        assert list(iter_design(factors)) == [(0, "a"), (0, "b"), (0.5, "a"), (0.5, "b"), (1, "a"), (1, "b")]
+        rows = list(iter_design(factors, DoeLatinHypercube, n=10, seed=0))
+        assert sorted(int(r[0] * 10) for r in rows) == list(range(10))
+        assert sorted(r[1] for r in rows) == ["a"] * 5 + ["b"] * 5
+        assert rows == list(iter_design(factors, DoeLatinHypercube, n=10, seed=0))
+        assert all(0 <= r[0] < 1 for r in iter_design(factors, DoeRandom, n=10, seed=0))
+
+        pt = sample_prototypes["sample_prototype_1"]
+        volume_path = "inputs|<DictKey>dichloromethane|components|<ListIndex>0|amount|volume|value"
+        factors = {volume_path: DoeRange(100, 300, levels=3), "61": ["true", False], "1 2": ["dcm", "solvent"]}
+        table = {volume_path: [], "61": [], "1 2": []}
+        for row in iter_design(factors.values()):
+            for c, v in zip(table, row):
+                table[c].append(v)
+        expected = [m.to_dict() for m in iter_instances(pt, table)]
+        assert len(expected) == 12
+        assert [m.to_dict() for m in iter_doe_instances(pt, factors)] == expected
+
+        datasets = list(iter_doe_datasets(pt, factors, DoeRandom, n=10, seed=0, chunksize=4, name="plate"))
+        assert [len(d.reactions) for d in datasets] == [4, 4, 2] and datasets[0].name == "plate"
+        with pytest.raises(AssertionError):
+            next(iter_doe_instances(pt, {"1 2": DoeRange(0, 1)}))